@@ -2,6 +2,7 @@ import os
 import logging
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import UniqueConstraint, inspect, literal, text
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -29,6 +30,13 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_pre_ping": True,
 }
 
+# Large downloads can be handed off to a front-end web server instead of occupying a worker:
+# DOWNLOAD_OFFLOAD=x-accel-redirect (nginx, internal location at DOWNLOAD_ACCEL_PREFIX) or x-sendfile
+download_offload = os.environ.get("DOWNLOAD_OFFLOAD", "").lower()
+app.config["DOWNLOAD_OFFLOAD"] = download_offload
+app.config["DOWNLOAD_ACCEL_PREFIX"] = os.environ.get("DOWNLOAD_ACCEL_PREFIX", "/protected-backups/")
+app.config["USE_X_SENDFILE"] = download_offload == "x-sendfile"
+
 # Initialize the app with the extension
 db.init_app(app)
 
@@ -51,21 +59,99 @@ scheduler = BackgroundScheduler(
     timezone='UTC'
 )
 
+# APP_ROLE decides what this process runs besides the web app:
+#   all    - scheduler and in-process queue workers (single-host default)
+#   web    - scheduler only; backups are left to standalone workers (worker.py)
+#   worker - neither, and no web routes; set by worker.py, which runs its own queue workers
+#   cli    - neither, and no web routes; set by cli.py, which runs backups in the foreground
+app_role = os.environ.get("APP_ROLE", "all").lower()
+serves_web = app_role not in ("worker", "cli")
+
 # Initialize scheduler
-scheduler.start()
+if serves_web:
+    scheduler.start()
+
+def upgrade_schema():
+    """Add columns, indexes and unique constraints that models gained since the tables were created
+
+    create_all() only creates missing tables, so an upgraded install would otherwise fail
+    on every query that touches a new column. New columns are added as nullable unless
+    they have a constant default to fill existing rows with. Unique constraints become
+    unique indexes (SQLite cannot add constraints to a table); one whose columns already
+    hold duplicate values is logged and left out until the duplicates are resolved.
+    """
+    inspector = inspect(db.engine)
+    dialect = db.engine.dialect
+    quote = dialect.identifier_preparer.quote
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column.type.compile(dialect=dialect)}"
+                default = column.default.arg if column.default is not None and column.default.is_scalar else None
+                if default is not None:
+                    rendered = literal(default, type_=column.type).compile(dialect=dialect, compile_kwargs={'literal_binds': True})
+                    ddl += f" DEFAULT {rendered}"
+                    if not column.nullable:
+                        ddl += " NOT NULL"
+                connection.execute(text(ddl))
+                logging.info(f"Database upgrade: added column {table.name}.{column.name}")
+
+            indexes = inspector.get_indexes(table.name)
+            existing_indexes = {index['name'] for index in indexes}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(connection)
+                    logging.info(f"Database upgrade: added index {index.name}")
+
+            unique = {tuple(constraint['column_names']) for constraint in inspector.get_unique_constraints(table.name)}
+            unique |= {tuple(index['column_names']) for index in indexes if index['unique']}
+            for constraint in table.constraints:
+                columns = tuple(column.name for column in constraint.columns)
+                if not isinstance(constraint, UniqueConstraint) or columns in unique:
+                    continue
+                quoted = ', '.join(quote(name) for name in columns)
+                duplicates = connection.execute(text(
+                    f"SELECT {quoted}, COUNT(*) FROM {quote(table.name)} "
+                    f"WHERE {' AND '.join(f'{quote(name)} IS NOT NULL' for name in columns)} "
+                    f"GROUP BY {quoted} HAVING COUNT(*) > 1"
+                )).all()
+                if duplicates:
+                    listed = '; '.join(f"{', '.join(map(str, row[:-1]))} ({row[-1]} rows)" for row in duplicates[:10])
+                    logging.error(
+                        f"Database upgrade: {table.name}({', '.join(columns)}) is not unique yet; "
+                        f"{len(duplicates)} duplicated values, e.g. {listed}. Remove the duplicates and restart."
+                    )
+                    continue
+                name = constraint.name or f"uq_{table.name}_{'_'.join(columns)}"
+                connection.execute(text(f"CREATE UNIQUE INDEX {quote(name)} ON {quote(table.name)} ({quoted})"))
+                logging.info(f"Database upgrade: added unique index {name}")
 
 with app.app_context():
     # Import models here so their tables are created
     import models  # noqa: F401
     
-    # For development, we'll recreate tables to include new columns
-    try:
-        db.drop_all()
-        db.create_all()
-        logging.info("Database tables recreated with latest schema")
-    except Exception as e:
-        logging.warning(f"Could not recreate database tables: {e}")
-        db.create_all()
+    # Data (configuration, job history, the GitHub response cache) persists across restarts;
+    # upgrade_schema() adds columns introduced since. For development, set RESET_DATABASE=1
+    # to start from empty tables.
+    if os.environ.get("RESET_DATABASE"):
+        try:
+            db.drop_all()
+            logging.info("Database tables dropped (RESET_DATABASE is set)")
+        except Exception as e:
+            logging.warning(f"Could not drop database tables: {e}")
+    db.create_all()
+    upgrade_schema()
 
 # Import routes after app initialization
-from routes import *  # noqa: F401, E402
+if serves_web:
+    from routes import *  # noqa: F401, E402
+
+# Background workers for the persistent backup queue
+if app_role == "all":
+    from queue_service import worker_pool  # noqa: E402
+    worker_pool.start()
@@ -0,0 +1,214 @@
+import os
+import shutil
+import hashlib
+import logging
+import subprocess
+import tempfile
+import zlib
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+# git's well-known empty tree; archiving it yields a valid, empty archive for repositories without commits
+EMPTY_TREE = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+
+# Supported archive formats: file extension, download MIME type, default and allowed compression levels
+ARCHIVE_FORMATS = {
+    'zip': {'label': 'ZIP (deflate)', 'extension': '.zip', 'mimetype': 'application/zip', 'level': 6, 'levels': (0, 9)},
+    'zip-store': {'label': 'ZIP (store only)', 'extension': '.zip', 'mimetype': 'application/zip', 'level': 0, 'levels': (0, 0)},
+    'tar.gz': {'label': 'tar + gzip', 'extension': '.tar.gz', 'mimetype': 'application/gzip', 'level': 6, 'levels': (0, 9)},
+    'tar.zst': {'label': 'tar + zstd (multi-threaded)', 'extension': '.tar.zst', 'mimetype': 'application/zstd', 'level': 3, 'levels': (1, 19)},
+}
+DEFAULT_ARCHIVE_FORMAT = 'zip'
+
+# info/attributes overrides the repository's own .gitattributes, so `git archive` neither
+# drops export-ignore paths nor expands export-subst placeholders: the archive matches HEAD
+EXPORT_ATTRIBUTES_OVERRIDE = '* -export-ignore -export-subst\n'
+
+
+def archive_format_for_path(path):
+    """Infer the archive format from a backup file name (for jobs that predate the format column)"""
+    for name, spec in ARCHIVE_FORMATS.items():
+        if name != 'zip-store' and path.endswith(spec['extension']):
+            return name
+    return DEFAULT_ARCHIVE_FORMAT
+
+
+def compression_level_error(archive_format, level):
+    """Why level cannot be used with archive_format, or None if it can (None means the format default)"""
+    low, high = ARCHIVE_FORMATS[archive_format]['levels']
+    if level is None or low <= level <= high:
+        return None
+    if archive_format == 'zip-store':
+        return "ZIP (store only) does not compress; leave the compression level empty"
+    return f"Compression level for {ARCHIVE_FORMATS[archive_format]['label']} must be between {low} and {high}"
+
+
+def file_sha256(path):
+    """Hex sha256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as backup_file:
+        for chunk in iter(lambda: backup_file.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def disable_export_attributes(git_dir):
+    """Make `git archive` in git_dir ignore export-ignore and export-subst attributes"""
+    attributes_path = os.path.join(git_dir, 'info', 'attributes')
+    try:
+        with open(attributes_path) as attributes_file:
+            if attributes_file.read() == EXPORT_ATTRIBUTES_OVERRIDE:
+                return
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(attributes_path), exist_ok=True)
+    with open(attributes_path, 'w') as attributes_file:
+        attributes_file.write(EXPORT_ATTRIBUTES_OVERRIDE)
+
+
+def list_tree(git_dir, treeish):
+    """Regular files and symlinks in a tree, with mode, blob id and size"""
+    result = subprocess.run([
+        'git', f'--git-dir={git_dir}', 'ls-tree', '-r', '-l', '-z', treeish
+    ], check=True, capture_output=True)
+    entries = []
+    for record in result.stdout.split(b'\0'):
+        if not record:
+            continue
+        meta, path = record.split(b'\t', 1)
+        mode, object_type, blob_id, size = meta.decode().split()
+        if object_type != 'blob':
+            continue  # Submodule commits have no content in this repository
+        entries.append({
+            'path': path.decode('utf-8', errors='surrogateescape'),
+            'mode': mode,
+            'blob': blob_id,
+            'size': int(size)
+        })
+    return entries
+
+
+class StreamBuffer:
+    """Write-only file object that collects zipfile output so it can be yielded incrementally"""
+    
+    def __init__(self):
+        self._buffer = bytearray()
+    
+    def write(self, data):
+        self._buffer += data
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def take(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+class ArchiveService:
+    """Builds archives straight from a git repository's object store, without a checked-out working tree"""
+    
+    def __init__(self, archive_format=DEFAULT_ARCHIVE_FORMAT, level=None, threads=0):
+        if archive_format not in ARCHIVE_FORMATS:
+            raise ValueError(f"Unsupported archive format: {archive_format}")
+        if archive_format == 'tar.zst' and not shutil.which('zstd'):
+            raise Exception("The tar.zst archive format requires the zstd command-line tool")
+        self.archive_format = archive_format
+        if archive_format == 'zip-store' or level is None:
+            level = ARCHIVE_FORMATS[archive_format]['level']
+        elif compression_level_error(archive_format, level):
+            # Saved for another format (e.g. a zstd level with a --format override); use this format's default
+            logger.warning(f"Compression level {level} does not apply to {archive_format}; using the default")
+            level = ARCHIVE_FORMATS[archive_format]['level']
+        self.level = level
+        self.threads = threads or 0  # zstd worker threads; 0 lets zstd use every core
+    
+    @property
+    def extension(self):
+        return ARCHIVE_FORMATS[self.archive_format]['extension']
+    
+    def stream(self, git_dir, treeish='HEAD'):
+        """Yield the compressed archive of a tree as chunks of bytes, as they are produced
+        
+        Raises subprocess.CalledProcessError (with text stderr) if git or the compressor fails.
+        """
+        disable_export_attributes(git_dir)
+        if self.archive_format in ('zip', 'zip-store'):
+            command = ['git', f'--git-dir={git_dir}', 'archive', '--format=zip', f'-{self.level}', treeish]
+            yield from self._run_pipeline([command])
+        elif self.archive_format == 'tar.zst':
+            yield from self._run_pipeline([
+                ['git', f'--git-dir={git_dir}', 'archive', '--format=tar', treeish],
+                ['zstd', '-q', '-c', f'-{self.level}', f'-T{self.threads}']
+            ])
+        else:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+            for chunk in self._run_pipeline([['git', f'--git-dir={git_dir}', 'archive', '--format=tar', treeish]]):
+                compressed = compressor.compress(chunk)
+                if compressed:
+                    yield compressed
+            yield compressor.flush()
+    
+    def _run_pipeline(self, commands):
+        """Run commands connected by pipes and yield the last one's stdout"""
+        processes = []
+        # stderr goes to files so a chatty process can never block on a full pipe while we read stdout
+        stderr_files = [tempfile.TemporaryFile() for _ in commands]
+        try:
+            stdin = None
+            for command, stderr_file in zip(commands, stderr_files):
+                process = subprocess.Popen(command, stdin=stdin, stdout=subprocess.PIPE, stderr=stderr_file)
+                if stdin is not None:
+                    stdin.close()  # Only the downstream process should hold the pipe open
+                stdin = process.stdout
+                processes.append(process)
+            
+            output = processes[-1].stdout
+            try:
+                for chunk in iter(lambda: output.read(CHUNK_SIZE), b''):
+                    yield chunk
+            finally:
+                output.close()
+                returncodes = [process.wait() for process in processes]
+            
+            for command, returncode, stderr_file in zip(commands, returncodes, stderr_files):
+                if returncode != 0:
+                    stderr_file.seek(0)
+                    stderr = stderr_file.read().decode('utf-8', errors='replace')
+                    raise subprocess.CalledProcessError(returncode, command, stderr=stderr)
+        finally:
+            for process in processes:
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+            for stderr_file in stderr_files:
+                stderr_file.close()
+    
+    def write(self, git_dir, treeish, archive_path, progress=None):
+        """Stream an archive of a tree into archive_path
+        
+        The archive is written under a .partial name and renamed once complete, so a
+        failed run never leaves a truncated file behind. progress, if given, is called
+        with the bytes written so far. Returns (size, sha256 hexdigest).
+        """
+        partial_path = f"{archive_path}.partial"
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(partial_path, 'wb') as archive_file:
+                for chunk in self.stream(git_dir, treeish):
+                    archive_file.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+                    if progress:
+                        progress(size)
+            os.replace(partial_path, archive_path)
+        except BaseException:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+        return size, digest.hexdigest()
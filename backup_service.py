@@ -1,20 +1,79 @@
 import os
-import zipfile
+import json
 import shutil
+import cProfile
+import fnmatch
 import tempfile
 import subprocess
+import threading
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import logging
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
 from app import app, db, scheduler
-from models import BackupConfig, Repository, BackupJob
+from models import BackupConfig, Repository, BackupJob, BackupFileEntry, SnapshotObject
 from github_service import GitHubService
+from http_cache import DatabaseResponseCache
+from sync_service import RepositorySyncService
+from archive_service import ArchiveService, DEFAULT_ARCHIVE_FORMAT, EMPTY_TREE, file_sha256
+from bundle_service import BundleService, EmptyBundleError
+from snapshot_store import SnapshotStore
+from index_service import BackupIndexService
+from job_progress import JobProgress, run_git_with_progress
+from job_trace import JobTrace, PROFILE_DIRNAME
+from disk_space import disk_admission
+from metrics import BACKUPS_IN_PROGRESS, FETCHED_BYTES, JOBS, PHASE_DURATION, WRITTEN_BYTES
 
 logger = logging.getLogger(__name__)
 
+# Bare mirrors live in a hidden directory inside backup_path
+MIRROR_DIRNAME = '.mirrors'
+
+# git stderr fragments that mean the upstream repository is gone rather than the mirror being broken
+UPSTREAM_MISSING_MARKERS = ('Repository not found', "' not found", 'does not appear to be a git repository')
+
+# Job statuses subject to max_backups retention (skipped jobs have no file but would pile up)
+RETAINED_STATUSES = ('completed', 'skipped')
+DELETE_BATCH_SIZE = 500
+INDEX_BATCH_SIZE = 1000  # Content index rows per bulk insert
+
+BUNDLE_KINDS = ('bundle-full', 'bundle-incremental')
+
+# Job kinds each backup mode produces; jobs without a kind predate the column and are snapshots
+MODE_KINDS = {
+    'snapshot': ('snapshot', None),
+    'bundle': BUNDLE_KINDS,
+    'dedup': ('dedup',),
+}
+
+DISPATCH_INTERVAL = 60  # Seconds between staggered-schedule checks for repositories whose slot has come up
+
+# Disk space estimates (from GitHub's reported size or the previous backup) are padded by this factor
+DISK_ESTIMATE_HEADROOM = 1.2
+DEFAULT_MIN_FREE_SPACE_MB = 1024
+
+# Concurrency limits are per process, not per BackupService: the queue creates a service per item
+_slot_pools = {}
+_slot_pools_lock = threading.Lock()
+
+def _shared_slots(kind, size):
+    """The process-wide semaphore for a kind of work, replaced when its configured size changes"""
+    with _slot_pools_lock:
+        current = _slot_pools.get(kind)
+        if current is None or current[0] != size:
+            # Backups holding a slot of the old semaphore release it there
+            current = _slot_pools[kind] = (size, threading.BoundedSemaphore(size))
+        return current[1]
+
 class BackupService:
     def __init__(self):
         self.config = None
         self.github_service = None
+        self._clone_slots = None
+        self._archive_slots = None
+        self.listing_fresh = False  # pushed_at values were refreshed by this sweep's sync
         self._load_config()
     
     def _load_config(self):
@@ -22,14 +81,33 @@ class BackupService:
         with app.app_context():
             self.config = BackupConfig.query.first()
             if self.config and self.config.github_token:
-                self.github_service = GitHubService(self.config.github_token)
+                self.github_service = GitHubService(
+                    self.config.github_token,
+                    pool_size=self.config.api_pool_size,
+                    cache=DatabaseResponseCache()
+                )
+        
+        # Network-bound and CPU/disk-bound phases are limited separately so
+        # a burst of clones cannot starve compression and vice versa
+        max_clone_workers = (self.config.max_clone_workers if self.config else None) or 4
+        max_archive_workers = (self.config.max_archive_workers if self.config else None) or 2
+        self._clone_slots = _shared_slots('clone', max(1, max_clone_workers))
+        self._archive_slots = _shared_slots('archive', max(1, max_archive_workers))
     
     def schedule_backup(self, cron_expression):
-        """Schedule automatic backups using cron expression"""
+        """Schedule automatic backups using cron expression
+        
+        In staggered mode the cron expression is unused: a dispatcher checks every
+        minute for repositories whose own slot has come up (see schedule_service).
+        """
         try:
             # Remove existing backup jobs
             self.unschedule_backup()
             
+            if self.config and self.config.schedule_mode == 'staggered':
+                self._schedule_staggered()
+                return
+            
             # Parse cron expression (minute hour day month day_of_week)
             cron_parts = cron_expression.split()
             if len(cron_parts) != 5:
@@ -38,8 +116,9 @@ class BackupService:
             minute, hour, day, month, day_of_week = cron_parts
             
             # Add new scheduled job
+            # Scheduled sweeps go through the persistent queue, so a restart mid-sweep resumes it
             scheduler.add_job(
-                func=self.backup_all_repositories,
+                func='queue_service:queue_scheduled_sweep',
                 trigger='cron',
                 minute=minute,
                 hour=hour,
@@ -56,6 +135,21 @@ class BackupService:
             logger.error(f"Error scheduling backup: {str(e)}")
             raise
     
+    def _schedule_staggered(self):
+        # Slots are planned afresh, so a changed window or tier applies from the next dispatch
+        with app.app_context():
+            db.session.execute(update(Repository).values(next_backup_at=None))
+            db.session.commit()
+        scheduler.add_job(
+            func='schedule_service:dispatch_due_backups',
+            trigger='interval',
+            seconds=DISPATCH_INTERVAL,
+            id='github_backup_job',
+            coalesce=True,
+            replace_existing=True
+        )
+        logger.info(f"Staggered backups scheduled over a {self.config.schedule_window_hours}-hour window")
+    
     def unschedule_backup(self):
         """Remove scheduled backup job"""
         try:
@@ -72,102 +166,247 @@ class BackupService:
             return
         
         with app.app_context():
-            # Auto-sync repositories if enabled
-            if getattr(self.config, 'auto_sync_enabled', True):
-                logger.info("Auto-sync enabled, checking for new repositories...")
-                try:
-                    self._sync_repositories()
-                except Exception as e:
-                    logger.error(f"Error during auto-sync: {str(e)}")
-            
-            enabled_repos = Repository.query.filter_by(enabled=True).all()
+            enabled_repos = self.sync_and_list_repositories()
             
             if not enabled_repos:
                 logger.info("No enabled repositories found for backup")
                 return
             
-            logger.info(f"Starting backup of {len(enabled_repos)} repositories")
+            self.backup_repositories(enabled_repos)
             
-            for repo in enabled_repos:
+            # Clean up old backups
+            self.cleanup_old_backups()
+            self.prune_orphaned_mirrors()
+    
+    def backup_repositories(self, repositories):
+        """Back up the given repositories, max_workers at a time; failures are logged, not raised"""
+        max_workers = max(1, self.config.max_workers or 1)
+        logger.info(f"Starting backup of {len(repositories)} repositories ({max_workers} worker(s))")
+        
+        if max_workers > 1:
+            self._backup_in_parallel([repo.id for repo in repositories], max_workers)
+        else:
+            for repo in repositories:
                 try:
                     self.backup_repository(repo)
                 except Exception as e:
                     logger.error(f"Error backing up repository {repo.full_name}: {str(e)}")
-            
-            # Clean up old backups
-            self.cleanup_old_backups()
     
-    def backup_repository(self, repository):
-        """Backup a single repository"""
+    def sync_and_list_repositories(self):
+        """Auto-sync the repository list if enabled, then return the repositories to back up"""
+        if getattr(self.config, 'auto_sync_enabled', True):
+            logger.info("Auto-sync enabled, checking for new repositories...")
+            trace = JobTrace()
+            try:
+                with PHASE_DURATION.time(phase='listing'), trace.span('sync'):
+                    self._sync_repositories(trace)
+                self.listing_fresh = True
+            except Exception as e:
+                logger.error(f"Error during auto-sync: {str(e)}")
+            logger.debug(f"Sync trace: {trace.to_json()}")
+        
+        # Repositories that vanished upstream keep their existing backups but are not retried
+        repositories = Repository.query.filter(
+            Repository.enabled.is_(True),
+            Repository.missing_upstream.isnot(True)
+        ).all()
+        return self.order_by_expected_duration(repositories)
+    
+    def order_by_expected_duration(self, repositories):
+        """Longest expected backup first, so the largest repositories do not start last
+        
+        A repository's previous successful backup gives its expected duration; one without
+        history is estimated from its GitHub size at the average seconds per KB of the rest.
+        """
+        history = self._latest_completed_jobs([repo.id for repo in repositories])
+        durations = {}
+        seconds, kilobytes = 0.0, 0
+        for repo in repositories:
+            started_at, completed_at, _ = history.get(repo.id, (None, None, None))
+            if started_at and completed_at:
+                durations[repo.id] = (completed_at - started_at).total_seconds()
+                if repo.size:
+                    seconds += durations[repo.id]
+                    kilobytes += repo.size
+        seconds_per_kb = seconds / kilobytes if kilobytes else None
+        
+        def expected(repo):
+            if repo.id in durations:
+                return durations[repo.id]
+            if seconds_per_kb is None:
+                # No timings at all yet: size alone still puts the big ones first
+                return repo.size or 0
+            return (repo.size or 0) * seconds_per_kb
+        
+        return sorted(repositories, key=expected, reverse=True)
+    
+    def _latest_completed_jobs(self, repository_ids):
+        """{repository_id: (started_at, completed_at, file_size)} of each one's newest completed job"""
+        if not repository_ids:
+            return {}
+        rank = func.row_number().over(
+            partition_by=BackupJob.repository_id,
+            order_by=BackupJob.completed_at.desc()
+        ).label('rank')
+        ranked = select(
+            BackupJob.repository_id, BackupJob.started_at, BackupJob.completed_at, BackupJob.file_size, rank
+        ).where(
+            BackupJob.repository_id.in_(repository_ids),
+            BackupJob.status == 'completed'
+        ).subquery()
+        rows = db.session.execute(
+            select(ranked.c.repository_id, ranked.c.started_at, ranked.c.completed_at, ranked.c.file_size)
+            .where(ranked.c.rank == 1)
+        ).all()
+        return {repository_id: (started_at, completed_at, file_size)
+                for repository_id, started_at, completed_at, file_size in rows}
+    
+    def _backup_in_parallel(self, repository_ids, max_workers):
+        """Backup repositories concurrently using a pool of worker threads"""
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='backup-worker') as executor:
+            futures = {
+                executor.submit(self._backup_repository_by_id, repository_id): repository_id
+                for repository_id in repository_ids
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"Error backing up repository id {futures[future]}: {str(e)}")
+    
+    def _backup_repository_by_id(self, repository_id):
+        """Worker entry point: load the repository in this thread's own session and back it up"""
+        with app.app_context():
+            try:
+                repository = db.session.get(Repository, repository_id)
+                if repository is None:
+                    logger.warning(f"Repository id {repository_id} no longer exists, skipping")
+                    return
+                self.backup_repository(repository)
+            finally:
+                db.session.remove()
+    
+    def backup_repository(self, repository, listing_fresh=None):
+        """Backup a single repository and return the id of its job record
+        
+        listing_fresh says whether repository.pushed_at was just refreshed by a sync;
+        it defaults to whether this service's own sweep ran one.
+        """
+        if listing_fresh is None:
+            listing_fresh = self.listing_fresh
+        
         with app.app_context():
+            # Each app context has its own session; re-attach the repository to it
+            # so last_backup is committed together with the job record
+            repository = db.session.get(Repository, repository.id)
+            trace = JobTrace()
+            
+            unchanged = False
+            if self.config.skip_unchanged:
+                with trace.span('check') as attrs:
+                    unchanged = attrs['unchanged'] = self._is_unchanged(repository, listing_fresh)
+            if unchanged:
+                now = datetime.utcnow()
+                job = BackupJob(
+                    repository_id=repository.id,
+                    status='skipped',
+                    started_at=now,
+                    completed_at=now,
+                    spans=trace.to_json()
+                )
+                db.session.add(job)
+                db.session.commit()
+                JOBS.inc(status='skipped')
+                logger.info(f"Skipping {repository.full_name}: no changes since last backup")
+                return job.id
+            
             # Create backup job record
             job = BackupJob(
                 repository_id=repository.id,
                 status='running',
+                phase='waiting',
                 started_at=datetime.utcnow()
             )
             db.session.add(job)
             db.session.commit()
+            progress = JobProgress(job.id)
+            BACKUPS_IN_PROGRESS.inc()
+            profiler = self._start_profile(repository)
             
             try:
                 # Create backup directory if it doesn't exist
                 os.makedirs(self.config.backup_path, exist_ok=True)
                 
-                # Create temporary directory for cloning
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    repo_dir = os.path.join(temp_dir, repository.name)
+                # Wait for disk space before taking a clone slot, so a waiting giant holds up no one
+                with self._reserve_disk_space(repository, trace):
+                    # Bring the local mirror up to date
+                    with self._acquire_slot(self._clone_slots, 'clone_wait', trace):
+                        progress.phase('fetching')
+                        with PHASE_DURATION.time(phase='fetch'), trace.span('clone') as attrs:
+                            mirror_path = self._update_mirror(repository, progress)
+                            attrs['bytes_received'] = progress.latest.get('bytes_received', 0)
+                    head_sha = self._mirror_head_sha(mirror_path)
                     
-                    # Clone repository
-                    clone_url = repository.clone_url
-                    if self.config.github_token:
-                        # Add token to clone URL for private repos
-                        clone_url = clone_url.replace('https://', f'https://{self.config.github_token}@')
-                    
-                    logger.info(f"Cloning repository: {repository.full_name}")
-                    subprocess.run([
-                        'git', 'clone', '--depth', '1', clone_url, repo_dir
-                    ], check=True, capture_output=True, text=True)
-                    
-                    # Create zip file
                     timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-                    zip_filename = f"{repository.name}_{timestamp}.zip"
-                    zip_path = os.path.join(self.config.backup_path, zip_filename)
-                    
-                    logger.info(f"Creating backup archive: {zip_filename}")
-                    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                        for root, dirs, files in os.walk(repo_dir):
-                            # Skip .git directory to reduce size
-                            if '.git' in dirs:
-                                dirs.remove('.git')
-                            
-                            for file in files:
-                                file_path = os.path.join(root, file)
-                                arcname = os.path.relpath(file_path, repo_dir)
-                                zipf.write(file_path, arcname)
+                    # Job id keeps names unique across same-named repositories and runs within one second
+                    base_filename = f"{repository.name}_{timestamp}_{job.id}"
                     
-                    # Get file size
-                    file_size = os.path.getsize(zip_path)
-                    
-                    # Update job record
-                    job.status = 'completed'
+                    progress.phase('waiting')
+                    with self._acquire_slot(self._archive_slots, 'archive_wait', trace), \
+                            PHASE_DURATION.time(phase='archive'), trace.span('compress') as attrs:
+                        if self.config.backup_mode == 'bundle':
+                            progress.phase('bundling')
+                            self._write_bundle(repository, job, mirror_path, base_filename)
+                        elif self.config.backup_mode == 'dedup':
+                            progress.phase('storing')
+                            self._write_dedup_snapshot(repository, job, mirror_path, head_sha, base_filename, progress)
+                        else:
+                            progress.phase('archiving')
+                            self._write_snapshot(job, mirror_path, head_sha, base_filename, progress)
+                        attrs.update(mode=self.config.backup_mode or 'snapshot', bytes_written=job.file_size or 0)
+                    progress.flush()
+                
+                if job.status == 'skipped':
+                    job.phase = 'done'
                     job.completed_at = datetime.utcnow()
-                    job.backup_file_path = zip_path
-                    job.file_size = file_size
-                    
-                    # Update repository last backup time
-                    repository.last_backup = datetime.utcnow()
-                    
                     db.session.commit()
-                    
-                    logger.info(f"Successfully backed up {repository.full_name} ({self._format_file_size(file_size)})")
+                    JOBS.inc(status='skipped')
+                    logger.info(f"Skipping {repository.full_name}: no new objects since the previous bundle")
+                    return job.id
+                
+                # Nothing is reported from here on: the index rows hold the write transaction until commit
+                progress.phase('indexing')
+                with PHASE_DURATION.time(phase='index'):
+                    self._index_backup(job, mirror_path, head_sha, trace)
+                
+                # Update job record
+                job.status = 'completed'
+                job.phase = 'done'
+                job.compressed_bytes = job.file_size
+                job.completed_at = datetime.utcnow()
+                file_size = job.file_size
+                
+                # Update repository last backup time and change-detection markers
+                repository.last_backup = datetime.utcnow()
+                repository.last_backup_sha = head_sha
+                repository.last_backup_pushed_at = repository.pushed_at
+                
+                with trace.span('commit'):
+                    db.session.commit()
+                JOBS.inc(status='completed')
+                WRITTEN_BYTES.observe(file_size or 0, mode=self.config.backup_mode or 'snapshot')
+                
+                logger.info(f"Successfully backed up {repository.full_name} ({self._format_file_size(file_size)})")
+                return job.id
             
             except subprocess.CalledProcessError as e:
-                error_msg = f"Git clone failed: {e.stderr if e.stderr else str(e)}"
+                error_msg = self._redact(f"Git command failed: {e.stderr if e.stderr else str(e)}")
                 logger.error(error_msg)
                 job.status = 'failed'
                 job.completed_at = datetime.utcnow()
                 job.error_message = error_msg
                 db.session.commit()
+                JOBS.inc(status='failed')
                 raise Exception(error_msg)
             
             except Exception as e:
@@ -177,73 +416,584 @@ class BackupService:
                 job.completed_at = datetime.utcnow()
                 job.error_message = error_msg
                 db.session.commit()
+                JOBS.inc(status='failed')
                 raise
+            
+            finally:
+                BACKUPS_IN_PROGRESS.dec()
+                self._finish_trace(job, trace, profiler)
+    
+    def _start_profile(self, repository):
+        """Start a cProfile of this thread if the repository matches profile_repositories"""
+        patterns = (self.config.profile_repositories or '').split()
+        if not any(fnmatch.fnmatch(repository.full_name, pattern) for pattern in patterns):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # Python 3.12+ allows one active profiler per process; concurrent backups go unprofiled
+            logger.warning(f"Not profiling {repository.full_name}: {str(e)}")
+            return None
+        return profiler
+    
+    def _finish_trace(self, job, trace, profiler):
+        """Store the job's spans and, if it was profiled, its cProfile output"""
+        try:
+            if profiler is not None:
+                profiler.disable()
+                profile_dir = os.path.join(self.config.backup_path, PROFILE_DIRNAME)
+                os.makedirs(profile_dir, exist_ok=True)
+                job.profile_path = os.path.join(profile_dir, f"job_{job.id}.prof")
+                profiler.dump_stats(job.profile_path)
+            job.spans = trace.to_json()
+            db.session.commit()
+        except Exception as e:
+            # The trace is diagnostic only; never turn a finished backup into an error because of it
+            db.session.rollback()
+            logger.warning(f"Could not store trace for job {job.id}: {str(e)}")
+    
+    @contextmanager
+    def _reserve_disk_space(self, repository, trace):
+        """Reserve the disk space a backup is expected to need, waiting while other backups hold it"""
+        min_free_mb = self.config.min_free_space_mb
+        if min_free_mb is None:
+            min_free_mb = DEFAULT_MIN_FREE_SPACE_MB
+        if min_free_mb <= 0:
+            yield
+            return
+        
+        repository_bytes = (repository.size or 0) * 1024
+        # An existing mirror only grows by what was pushed since; a new one needs the whole repository
+        need = 0 if os.path.isdir(self._mirror_path(repository)) else repository_bytes * DISK_ESTIMATE_HEADROOM
+        previous = self._latest_completed_jobs([repository.id]).get(repository.id)
+        if previous and previous[2] is not None:
+            need += previous[2] * DISK_ESTIMATE_HEADROOM
+        else:
+            need += repository_bytes
+        # git's stderr and object batches are spooled to the temp directory; keep it above the minimum too
+        requests = [(self.config.backup_path, need), (tempfile.gettempdir(), 0)]
+        
+        with ExitStack() as reservation:
+            with PHASE_DURATION.time(phase='disk_wait'), trace.span('disk_wait') as attrs:
+                attrs['bytes'] = int(need)
+                reservation.enter_context(
+                    disk_admission.reserve(requests, min_free_mb * 1024 * 1024, label=repository.full_name)
+                )
+            yield
+    
+    @contextmanager
+    def _acquire_slot(self, slots, wait_phase, trace):
+        """Hold one of a concurrency limit's slots, recording how long it took to get one"""
+        with PHASE_DURATION.time(phase=wait_phase), trace.span(wait_phase):
+            slots.acquire()
+        try:
+            yield
+        finally:
+            slots.release()
+    
+    def _write_snapshot(self, job, mirror_path, head_sha, base_filename, progress):
+        """Archive the tree at HEAD in the configured format"""
+        archive_service = self._archive_service()
+        archive_filename = f"{base_filename}{archive_service.extension}"
+        archive_path = os.path.join(self.config.backup_path, archive_filename)
+        
+        # Stream `git archive` output from the mirror straight into the archive; nothing is checked out
+        logger.info(f"Creating backup archive: {archive_filename}")
+        file_size, checksum = archive_service.write(
+            mirror_path, head_sha or EMPTY_TREE, archive_path,
+            progress=lambda written: progress.update(compressed_bytes=written)
+        )
+        
+        job.backup_kind = 'snapshot'
+        job.backup_file_path = archive_path
+        job.archive_format = archive_service.archive_format
+        job.file_size = file_size
+        job.checksum = checksum
+    
+    def _write_bundle(self, repository, job, mirror_path, base_filename):
+        """Write a full bundle, or an incremental one on top of the repository's latest bundle
+        
+        A new chain is started when there is no previous bundle, the chain already has
+        bundle_full_every increments, or the previous bundle's commits are gone from the
+        mirror (e.g. after a force-push and gc). Sets the job to 'skipped' if nothing is new.
+        """
+        bundle_service = BundleService()
+        refs = bundle_service.read_refs(mirror_path)
+        parent = BackupJob.query.filter(
+            BackupJob.repository_id == repository.id,
+            BackupJob.status == 'completed',
+            BackupJob.backup_kind.in_(BUNDLE_KINDS)
+        ).order_by(BackupJob.completed_at.desc()).first()
+        
+        parent_refs = json.loads(parent.refs) if parent and parent.refs else {}
+        incremental = (
+            parent is not None
+            and self._chain_length(parent) < (self.config.bundle_full_every or 7)
+            and bundle_service.has_objects(mirror_path, list(parent_refs.values()))
+        )
+        if parent is not None and refs == parent_refs:
+            job.status = 'skipped'
+            return
+        
+        kind = 'bundle-incremental' if incremental else 'bundle-full'
+        bundle_filename = f"{base_filename}_{'incr' if incremental else 'full'}.bundle"
+        bundle_path = os.path.join(self.config.backup_path, bundle_filename)
+        
+        logger.info(f"Creating {kind} for {repository.full_name}: {bundle_filename}")
+        try:
+            file_size = bundle_service.create(
+                mirror_path, bundle_path, exclude=parent_refs.values() if incremental else ()
+            )
+        except EmptyBundleError:
+            job.status = 'skipped'
+            return
+        
+        job.backup_kind = kind
+        job.parent_job_id = parent.id if incremental else None
+        job.refs = json.dumps(refs, sort_keys=True)
+        job.backup_file_path = bundle_path
+        job.archive_format = 'bundle'
+        job.file_size = file_size
+        job.checksum = file_sha256(bundle_path)
+    
+    def _write_dedup_snapshot(self, repository, job, mirror_path, head_sha, base_filename, progress):
+        """Store HEAD in the shared content-addressed store and record its manifest"""
+        previous = BackupJob.query.filter_by(
+            repository_id=repository.id, status='completed', backup_kind='dedup'
+        ).order_by(BackupJob.completed_at.desc()).first()
+        
+        store = SnapshotStore(self.config.backup_path)
+        logger.info(f"Creating deduplicated snapshot for {repository.full_name}")
+        manifest_path, bytes_written = store.create(
+            mirror_path, head_sha or EMPTY_TREE, base_filename,
+            previous_manifest=previous.backup_file_path if previous else None,
+            progress=lambda files, written: progress.update(files_archived=files, compressed_bytes=written)
+        )
+        chunk_ids = store.chunk_ids(manifest_path)
+        # Chunks found in the store were reused unreferenced, so a concurrent release may have
+        # collected some; once referenced they stay, and any already gone are written back
+        with store.lock():
+            self._add_snapshot_references(chunk_ids)
+            missing = store.missing_chunks(chunk_ids)
+        if missing:
+            logger.warning(f"{len(missing)} reused chunks were garbage-collected during the snapshot; restoring them")
+            bytes_written += store.restore_chunks(mirror_path, manifest_path, missing)
+        
+        job.backup_kind = 'dedup'
+        job.backup_file_path = manifest_path
+        job.archive_format = 'zip'  # Downloads are assembled as zip on the fly
+        job.file_size = bytes_written  # New bytes this snapshot added to the store
+    
+    def _add_snapshot_references(self, chunk_ids):
+        """Increment reference counts for a new snapshot's chunks"""
+        chunk_ids = sorted(chunk_ids)
+        # Own session, retried: a concurrent snapshot of a fork may insert the same new chunk first
+        for attempt in range(3):
+            with app.app_context():
+                try:
+                    for start in range(0, len(chunk_ids), DELETE_BATCH_SIZE):
+                        batch = chunk_ids[start:start + DELETE_BATCH_SIZE]
+                        existing = set(db.session.execute(
+                            select(SnapshotObject.chunk_id).where(SnapshotObject.chunk_id.in_(batch))
+                        ).scalars())
+                        if existing:
+                            db.session.execute(
+                                update(SnapshotObject)
+                                .where(SnapshotObject.chunk_id.in_(existing))
+                                .values(refcount=SnapshotObject.refcount + 1)
+                            )
+                        new_ids = [chunk_id for chunk_id in batch if chunk_id not in existing]
+                        if new_ids:
+                            db.session.execute(insert(SnapshotObject), [
+                                {'chunk_id': chunk_id, 'refcount': 1} for chunk_id in new_ids
+                            ])
+                    db.session.commit()
+                    return
+                except IntegrityError:
+                    db.session.rollback()
+                    if attempt == 2:
+                        raise
+    
+    def release_snapshot(self, manifest_path):
+        """Drop a deduplicated snapshot: decrement its chunks and delete those no longer referenced"""
+        if not manifest_path or not os.path.exists(manifest_path):
+            return
+        
+        store = SnapshotStore.for_manifest(manifest_path)
+        chunk_ids = sorted(store.chunk_ids(manifest_path))
+        unreferenced = []
+        with app.app_context():
+            for start in range(0, len(chunk_ids), DELETE_BATCH_SIZE):
+                batch = chunk_ids[start:start + DELETE_BATCH_SIZE]
+                db.session.execute(
+                    update(SnapshotObject)
+                    .where(SnapshotObject.chunk_id.in_(batch))
+                    .values(refcount=SnapshotObject.refcount - 1)
+                )
+                orphaned = list(db.session.execute(
+                    select(SnapshotObject.chunk_id).where(
+                        SnapshotObject.chunk_id.in_(batch), SnapshotObject.refcount <= 0
+                    )
+                ).scalars())
+                if orphaned:
+                    db.session.execute(delete(SnapshotObject).where(SnapshotObject.chunk_id.in_(orphaned)))
+                    unreferenced.extend(orphaned)
+            db.session.commit()
+        
+        # Files go only after the counts are committed, so a failure never leaves a live chunk without data,
+        # and only those still unreferenced: a snapshot being stored may have referenced one since
+        with store.lock():
+            with app.app_context():
+                for start in range(0, len(unreferenced), DELETE_BATCH_SIZE):
+                    batch = unreferenced[start:start + DELETE_BATCH_SIZE]
+                    referenced = set(db.session.execute(
+                        select(SnapshotObject.chunk_id).where(SnapshotObject.chunk_id.in_(batch))
+                    ).scalars())
+                    store.delete_objects([chunk_id for chunk_id in batch if chunk_id not in referenced])
+        os.remove(manifest_path)
+        logger.debug(f"Released snapshot {manifest_path}; {len(unreferenced)} chunks garbage-collected")
+    
+    def _index_backup(self, job, mirror_path, head_sha, trace):
+        """Record the backup's content index so single files can be browsed and extracted"""
+        with trace.span('walk') as attrs:
+            rows = BackupIndexService().build(job, mirror_path, head_sha or EMPTY_TREE)
+            attrs['files'] = len(rows)
+        if job.backup_kind == 'snapshot':
+            job.files_archived = len(rows)
+        with trace.span('index'):
+            for start in range(0, len(rows), INDEX_BATCH_SIZE):
+                db.session.execute(insert(BackupFileEntry), rows[start:start + INDEX_BATCH_SIZE])
+    
+    def verify_backup(self, job):
+        """Check that a completed job's backup is intact; returns a list of problems (empty if none)"""
+        path = job.backup_file_path
+        if not path or not os.path.exists(path):
+            return [f"Backup file is missing: {path}"]
+        
+        if job.backup_kind == 'dedup':
+            store = SnapshotStore.for_manifest(path)
+            missing = [chunk_id for chunk_id in store.chunk_ids(path) if not os.path.exists(store.object_path(chunk_id))]
+            return [f"{len(missing)} chunk(s) missing from the snapshot store"] if missing else []
+        
+        problems = []
+        if job.checksum and file_sha256(path) != job.checksum:
+            problems.append(f"Checksum mismatch for {path}")
+        if job.backup_kind in BUNDLE_KINDS:
+            # An increment is only as good as the chain it builds on
+            try:
+                chain = self.bundle_chain(job.id)
+            except Exception as e:
+                return problems + [str(e)]
+            problems += [f"Bundle chain file is missing: {link_path}" for _, link_path in chain
+                         if not link_path or not os.path.exists(link_path)]
+        return problems
+    
+    def _chain_length(self, job):
+        """Number of incremental bundles between a job and its chain's full bundle"""
+        length = 0
+        while job is not None and job.backup_kind == 'bundle-incremental':
+            length += 1
+            job = db.session.get(BackupJob, job.parent_job_id) if job.parent_job_id else None
+        return length
+    
+    def bundle_chain(self, job_id):
+        """Jobs needed to restore a bundle backup: its full bundle first, then each increment in order"""
+        with app.app_context():
+            chain = []
+            job = db.session.get(BackupJob, job_id)
+            while job is not None:
+                chain.append(job)
+                job = db.session.get(BackupJob, job.parent_job_id) if job.parent_job_id else None
+            chain.reverse()
+            if not chain or chain[0].backup_kind != 'bundle-full':
+                raise Exception(f"Backup job {job_id} is not part of a complete bundle chain")
+            # Detach plain values so callers can use them outside the app context
+            return [(chain_job.id, chain_job.backup_file_path) for chain_job in chain]
+    
+    def restore_bundle_chain(self, job_id, target_dir):
+        """Rebuild a bare repository from a bundle backup by replaying its base and increments"""
+        bundle_paths = [path for _, path in self.bundle_chain(job_id)]
+        missing = [path for path in bundle_paths if not path or not os.path.exists(path)]
+        if missing:
+            raise Exception(f"Bundle chain for job {job_id} is incomplete; missing: {', '.join(map(str, missing))}")
+        return BundleService().restore(bundle_paths, target_dir)
+    
+    def _archive_service(self):
+        """Archive writer for the configured format, compression level and thread count"""
+        return ArchiveService(
+            archive_format=self.config.archive_format or DEFAULT_ARCHIVE_FORMAT,
+            level=self.config.compression_level,
+            threads=self.config.compression_threads
+        )
+    
+    def _mirror_path(self, repository):
+        """Location of the bare mirror for a repository inside the backup directory"""
+        return os.path.join(self.config.backup_path, MIRROR_DIRNAME, f"{repository.full_name}.git")
+    
+    def _authenticated_url(self, repository):
+        """Clone URL with the GitHub token embedded for private repositories"""
+        clone_url = repository.clone_url
+        if self.config.github_token:
+            clone_url = clone_url.replace('https://', f'https://{self.config.github_token}@')
+        return clone_url
+    
+    def _redact(self, message):
+        """Strip the GitHub token from git output before it is logged or stored"""
+        if self.config and self.config.github_token:
+            return message.replace(self.config.github_token, '***')
+        return message
+    
+    def _update_mirror(self, repository, progress=None):
+        """Create the bare mirror for a repository, or fetch new objects into an existing one"""
+        mirror_path = self._mirror_path(repository)
+        clone_url = self._authenticated_url(repository)
+        received_bytes = [0]
+        
+        def on_bytes_received(received):
+            received_bytes[0] = received
+            if progress:
+                progress.update(bytes_received=received)
+        
+        if os.path.isdir(mirror_path):
+            try:
+                logger.info(f"Fetching updates into mirror: {repository.full_name}")
+                # Fetch from an explicit URL so the token is never written to the mirror's config.
+                # --git-dir stops git from falling back to an enclosing repository if the mirror is broken
+                run_git_with_progress([
+                    'git', f'--git-dir={mirror_path}', 'fetch', '--prune', '--progress', clone_url, '+refs/*:refs/*'
+                ], on_bytes_received)
+                FETCHED_BYTES.observe(received_bytes[0])
+                return mirror_path
+            except subprocess.CalledProcessError as e:
+                stderr = e.stderr or ''
+                if any(marker in stderr for marker in UPSTREAM_MISSING_MARKERS):
+                    # Keep the mirror: it may be the last copy of a deleted repository
+                    raise Exception(
+                        f"Upstream repository {repository.full_name} is no longer reachable; "
+                        f"existing mirror kept at {mirror_path}"
+                    )
+                if self._mirror_is_intact(mirror_path):
+                    # Network, auth or server trouble: fail this job and keep the history we have
+                    raise Exception(
+                        f"Could not fetch {repository.full_name}; existing mirror kept: "
+                        f"{self._redact(stderr.strip())}"
+                    )
+                logger.warning(
+                    f"Mirror for {repository.full_name} is damaged, re-cloning: "
+                    f"{self._redact(stderr.strip())}"
+                )
+                shutil.rmtree(mirror_path, ignore_errors=True)
+        
+        # Clone into a scratch name and rename, so an interrupted clone never looks like a valid mirror
+        logger.info(f"Creating mirror: {repository.full_name}")
+        os.makedirs(os.path.dirname(mirror_path), exist_ok=True)
+        partial_path = f"{mirror_path}.partial"
+        shutil.rmtree(partial_path, ignore_errors=True)
+        try:
+            run_git_with_progress([
+                'git', 'clone', '--mirror', '--progress', clone_url, partial_path
+            ], on_bytes_received)
+            subprocess.run([
+                'git', f'--git-dir={partial_path}', 'remote', 'set-url', 'origin', repository.clone_url
+            ], check=True, capture_output=True, text=True)
+        except Exception:
+            shutil.rmtree(partial_path, ignore_errors=True)
+            raise
+        os.rename(partial_path, mirror_path)
+        FETCHED_BYTES.observe(received_bytes[0])
+        return mirror_path
+    
+    def _mirror_is_intact(self, mirror_path):
+        """Whether a mirror is a readable repository with all objects its refs need"""
+        for command in (['rev-parse', '--git-dir'], ['fsck', '--connectivity-only', '--no-progress']):
+            result = subprocess.run(
+                ['git', f'--git-dir={mirror_path}', *command], capture_output=True, text=True
+            )
+            if result.returncode != 0:
+                return False
+        return True
+    
+    def _has_backup_in_current_mode(self, repository):
+        """Whether a completed backup of the kind the configured backup mode produces exists"""
+        kinds = MODE_KINDS.get(self.config.backup_mode or 'snapshot', MODE_KINDS['snapshot'])
+        kind_filter = BackupJob.backup_kind.in_([kind for kind in kinds if kind])
+        if None in kinds:
+            kind_filter = kind_filter | BackupJob.backup_kind.is_(None)
+        return db.session.query(
+            BackupJob.query.filter(
+                BackupJob.repository_id == repository.id,
+                BackupJob.status == 'completed',
+                kind_filter
+            ).exists()
+        ).scalar()
+    
+    def _is_unchanged(self, repository, listing_fresh=False):
+        """Check whether a repository has had no pushes since its last successful backup"""
+        if not repository.last_backup_sha:
+            return False
+        
+        # The markers say nothing about modes that have never backed this repository up
+        if not self._has_backup_in_current_mode(repository):
+            return False
+        
+        # Listing data from a sync just before this backup: unchanged push time means nothing new was pushed
+        if (listing_fresh and repository.pushed_at
+                and repository.pushed_at == repository.last_backup_pushed_at):
+            return True
+        
+        # Bundles cover every branch and tag, so a matching HEAD proves nothing; the bundle
+        # step itself detects "no new objects" after a (cheap) fetch
+        if self.config.backup_mode == 'bundle':
+            return False
+        
+        # Otherwise ask the remote for its current HEAD, which costs a single round-trip
+        try:
+            with self._clone_slots:
+                result = subprocess.run([
+                    'git', 'ls-remote', self._authenticated_url(repository), 'HEAD'
+                ], check=True, capture_output=True, text=True, timeout=60)
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            logger.warning(f"Could not check remote HEAD for {repository.full_name}: {self._redact(str(e))}")
+            return False
+        
+        remote_sha = result.stdout.split()[0] if result.stdout.strip() else None
+        return remote_sha == repository.last_backup_sha
+    
+    def _mirror_head_sha(self, mirror_path):
+        """Commit SHA that HEAD resolves to in a mirror, or None for an empty repository"""
+        result = subprocess.run([
+            'git', f'--git-dir={mirror_path}', 'rev-parse', '--verify', '--quiet', 'HEAD'
+        ], capture_output=True, text=True)
+        return result.stdout.strip() or None
+    
+    def prune_orphaned_mirrors(self):
+        """Remove mirrors whose repository is no longer tracked in the database"""
+        if not self.config:
+            return
+        
+        mirror_root = os.path.join(self.config.backup_path, MIRROR_DIRNAME)
+        if not os.path.isdir(mirror_root):
+            return
+        
+        with app.app_context():
+            tracked = {full_name for (full_name,) in db.session.query(Repository.full_name)}
+        
+        for owner in os.listdir(mirror_root):
+            owner_dir = os.path.join(mirror_root, owner)
+            if not os.path.isdir(owner_dir):
+                continue
+            for entry in os.listdir(owner_dir):
+                if not entry.endswith('.git'):
+                    continue
+                if f"{owner}/{entry[:-len('.git')]}" not in tracked:
+                    shutil.rmtree(os.path.join(owner_dir, entry), ignore_errors=True)
+                    logger.info(f"Removed orphaned mirror: {owner}/{entry}")
+            if not os.listdir(owner_dir):
+                os.rmdir(owner_dir)
     
     def cleanup_old_backups(self):
-        """Remove old backup files based on max_backups setting"""
+        """Remove old backup files based on max_backups setting
+        
+        A single window-function query ranks every repository's completed (and
+        skipped) jobs by completion time and returns those beyond max_backups;
+        their files are removed and their rows deleted in bulk.
+        """
         if not self.config or self.config.max_backups <= 0:
             return
         
-        with app.app_context():
-            # Get all repositories
-            repositories = Repository.query.all()
+        trace = JobTrace()
+        with app.app_context(), PHASE_DURATION.time(phase='retention'), trace.span('cleanup') as attrs:
+            rank = func.row_number().over(
+                partition_by=(BackupJob.repository_id, BackupJob.status),
+                order_by=BackupJob.completed_at.desc()
+            ).label('rank')
+            ranked = select(
+                BackupJob.id, BackupJob.backup_file_path, BackupJob.backup_kind, BackupJob.profile_path, rank
+            ).where(
+                BackupJob.repository_id.isnot(None),
+                BackupJob.status.in_(RETAINED_STATUSES)
+            ).subquery()
+            expired = db.session.execute(
+                select(ranked.c.id, ranked.c.backup_file_path, ranked.c.backup_kind, ranked.c.profile_path)
+                .where(ranked.c.rank > self.config.max_backups)
+            ).all()
             
-            for repo in repositories:
-                # Get backup jobs for this repository, ordered by date
-                jobs = BackupJob.query.filter_by(
-                    repository_id=repo.id,
-                    status='completed'
-                ).order_by(BackupJob.completed_at.desc()).all()
-                
-                # Remove excess backups
-                if len(jobs) > self.config.max_backups:
-                    jobs_to_remove = jobs[self.config.max_backups:]
-                    
-                    for job in jobs_to_remove:
-                        try:
-                            # Delete backup file
-                            if job.backup_file_path and os.path.exists(job.backup_file_path):
-                                os.remove(job.backup_file_path)
-                                logger.info(f"Deleted old backup: {job.backup_file_path}")
-                            
-                            # Delete job record
-                            db.session.delete(job)
-                        
-                        except Exception as e:
-                            logger.error(f"Error deleting old backup {job.backup_file_path}: {str(e)}")
-                    
-                    db.session.commit()
+            expired = self._protect_bundle_chains(expired)
+            attrs['expired'] = len(expired)
+            if not expired:
+                return
+            
+            removable_ids = []
+            for job_id, backup_file_path, backup_kind, profile_path in expired:
+                try:
+                    if backup_kind == 'dedup':
+                        self.release_snapshot(backup_file_path)
+                    elif backup_file_path and os.path.exists(backup_file_path):
+                        os.remove(backup_file_path)
+                        logger.debug(f"Deleted old backup: {backup_file_path}")
+                    if profile_path and os.path.exists(profile_path):
+                        os.remove(profile_path)
+                    removable_ids.append(job_id)
+                except Exception as e:
+                    # Keep the row so the file is retried on the next pass
+                    logger.error(f"Error deleting old backup {backup_file_path}: {str(e)}")
+            
+            # Newest first, so an increment is always deleted before the bundle it builds on
+            removable_ids.sort(reverse=True)
+            for start in range(0, len(removable_ids), DELETE_BATCH_SIZE):
+                batch = removable_ids[start:start + DELETE_BATCH_SIZE]
+                db.session.execute(delete(BackupFileEntry).where(BackupFileEntry.job_id.in_(batch)))
+                db.session.execute(delete(BackupJob).where(BackupJob.id.in_(batch)))
+            db.session.commit()
+            
+            logger.info(f"Retention: removed {len(removable_ids)} old backup jobs")
+        logger.debug(f"Retention trace: {trace.to_json()}")
+    
+    def _protect_bundle_chains(self, expired):
+        """Drop expired jobs that a retained incremental bundle still depends on"""
+        expired_ids = {row[0] for row in expired}
+        links = dict(db.session.execute(
+            select(BackupJob.id, BackupJob.parent_job_id).where(
+                BackupJob.backup_kind.in_(BUNDLE_KINDS),
+                BackupJob.status == 'completed'
+            )
+        ).all())
+        if not expired_ids & links.keys():
+            return expired
+        
+        protected = set()
+        for job_id in links.keys() - expired_ids:
+            parent_id = links.get(job_id)
+            while parent_id is not None and parent_id not in protected:
+                protected.add(parent_id)
+                parent_id = links.get(parent_id)
+        
+        if protected & expired_ids:
+            logger.info(f"Retention: keeping {len(protected & expired_ids)} bundles still needed by newer increments")
+        return [row for row in expired if row[0] not in protected]
     
-    def _sync_repositories(self):
+    def _sync_repositories(self, trace=None):
         """Sync repositories from GitHub (used for auto-sync)"""
         if not self.github_service:
             logger.warning("No GitHub service available for auto-sync")
             return
         
+        self.github_service.trace = trace
         try:
-            repos = self.github_service.get_user_repositories()
-            synced_count = 0
-            
-            for repo_data in repos:
-                existing_repo = Repository.query.filter_by(full_name=repo_data['full_name']).first()
-                if not existing_repo:
-                    new_repo = Repository()
-                    new_repo.name = repo_data['name']
-                    new_repo.full_name = repo_data['full_name']
-                    new_repo.clone_url = repo_data['clone_url']
-                    new_repo.enabled = True  # Auto-enable new repositories
-                    db.session.add(new_repo)
-                    synced_count += 1
-            
-            if synced_count > 0:
-                db.session.commit()
-                logger.info(f"Auto-sync: Added {synced_count} new repositories")
+            # Auto-enable new repositories
+            stats = RepositorySyncService(self.github_service).sync(auto_enable=True)
+            if stats['added'] > 0:
+                logger.info(f"Auto-sync: Added {stats['added']} new repositories")
             else:
                 logger.info("Auto-sync: No new repositories found")
                 
         except Exception as e:
+            db.session.rollback()
             logger.error(f"Error during repository auto-sync: {str(e)}")
             raise
+        finally:
+            self.github_service.trace = None
     
     def _format_file_size(self, size_bytes):
         """Format file size in human readable format"""
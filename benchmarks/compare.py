@@ -0,0 +1,72 @@
+"""Compare two benchmark result files and flag regressions
+
+    python benchmarks/compare.py before.json after.json --threshold 0.1
+
+Prints the relative change of each scenario's median metrics and exits with status 1
+if any scenario's wall time (or peak RSS) grew by more than the threshold.
+"""
+import sys
+import json
+import argparse
+
+# Metrics where a larger value is worse; repos_per_second is reported but better when larger
+GATED_METRICS = ('wall_seconds', 'peak_rss_bytes')
+REPORTED_METRICS = ('wall_seconds', 'cpu_seconds', 'child_cpu_seconds', 'peak_rss_bytes',
+                    'disk_bytes_delta', 'api_requests', 'repos_per_second')
+
+
+def load(path):
+    with open(path) as result_file:
+        report = json.load(result_file)
+    if report.get('schema') != 1:
+        raise SystemExit(f"{path}: unsupported result schema {report.get('schema')}")
+    return report
+
+
+def compare(before, after, threshold):
+    """Rows of (scenario, metric, before, after, change) and the list of regressions"""
+    rows = []
+    regressions = []
+    for scenario, metrics in after['summary'].items():
+        baseline = before['summary'].get(scenario)
+        if baseline is None:
+            continue
+        for metric in REPORTED_METRICS:
+            if metric not in metrics or metric not in baseline:
+                continue
+            old, new = baseline[metric], metrics[metric]
+            change = (new - old) / old if old else None
+            rows.append((scenario, metric, old, new, change))
+            if metric in GATED_METRICS and change is not None and change > threshold:
+                regressions.append((scenario, metric, change))
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="relative increase in wall time or peak RSS counted as a regression (default: 0.10)")
+    args = parser.parse_args(argv)
+
+    before, after = load(args.before), load(args.after)
+    if before['parameters'] != after['parameters']:
+        print("Warning: the runs used different parameters; differences may not be due to the code", file=sys.stderr)
+
+    rows, regressions = compare(before, after, args.threshold)
+    print(f"{'scenario':<16} {'metric':<18} {'before':>14} {'after':>14} {'change':>8}")
+    for scenario, metric, old, new, change in rows:
+        change_text = f"{change:+.1%}" if change is not None else 'n/a'
+        print(f"{scenario:<16} {metric:<18} {old:>14.4g} {new:>14.4g} {change_text:>8}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}:")
+        for scenario, metric, change in regressions:
+            print(f"  {scenario} {metric} {change:+.1%}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
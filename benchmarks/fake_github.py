@@ -0,0 +1,174 @@
+"""Local stand-in for the parts of the GitHub REST API that GitHubService calls
+
+Serves /user, /user/repos (paged, with Link and ETag headers, answering If-None-Match
+with 304 like GitHub does), /repos/<owner>/<name>, /repos/<owner>/<name>/branches and
+/rate_limit from an in-memory repository list. Responses carry X-RateLimit-* headers
+and every request is counted, so benchmarks can report API calls per sweep.
+"""
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_PER_PAGE = 30
+MAX_PER_PAGE = 100
+RATE_LIMIT = 5000
+
+class FakeGitHub:
+    """In-memory GitHub account served over HTTP on a local port"""
+    
+    def __init__(self, login='benchmark', latency=0.0):
+        self.login = login
+        self.latency = latency  # Seconds added to every response, to model a real network round-trip
+        self.repositories = []
+        self.requests = 0
+        self.not_modified = 0
+        self._lock = threading.Lock()
+        self._remaining = RATE_LIMIT
+        self._reset_at = int(time.time()) + 3600
+        self._server = None
+    
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    def add_repository(self, name, clone_url, size_kb=0, pushed_at=None):
+        """Add a repository to the listing; returns its API representation"""
+        with self._lock:
+            repo_id = len(self.repositories) + 1
+            timestamp = (pushed_at or datetime.utcnow()).strftime('%Y-%m-%dT%H:%M:%SZ')
+            repo = {
+                'id': repo_id,
+                'name': name,
+                'full_name': f"{self.login}/{name}",
+                'clone_url': clone_url,
+                'private': False,
+                'description': '',
+                'updated_at': timestamp,
+                'pushed_at': timestamp,
+                'size': size_kb,
+                'language': None,
+                'default_branch': 'main'
+            }
+            self.repositories.append(repo)
+            return repo
+    
+    def touch(self, full_name, pushed_at=None):
+        """Record a push to a repository (moving it to the top of an updated-first listing)"""
+        timestamp = (pushed_at or datetime.utcnow()).strftime('%Y-%m-%dT%H:%M:%SZ')
+        with self._lock:
+            for repo in self.repositories:
+                if repo['full_name'] == full_name:
+                    repo['pushed_at'] = repo['updated_at'] = timestamp
+    
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.not_modified = 0
+    
+    def start(self, host='127.0.0.1', port=0):
+        fake = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive, like api.github.com
+            
+            def do_GET(self):
+                fake._handle(self)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='fake-github', daemon=True).start()
+        return self
+    
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+    
+    def _handle(self, handler):
+        if self.latency:
+            time.sleep(self.latency)
+        parsed = urlparse(handler.path)
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        path = parsed.path.rstrip('/')
+        
+        with self._lock:
+            self.requests += 1
+            repositories = list(self.repositories)
+        
+        headers = {}
+        if path == '/user':
+            status, body = 200, {'login': self.login, 'id': 1}
+        elif path == '/user/repos':
+            status, body, headers = self._listing_page(handler, repositories, query)
+        elif path == '/rate_limit':
+            status, body = 200, {'resources': {'core': self._rate_limit_snapshot()}}
+        elif path.startswith('/repos/'):
+            status, body = self._repository(path[len('/repos/'):], repositories)
+        else:
+            status, body = 404, {'message': 'Not Found'}
+        
+        payload = json.dumps(body).encode('utf-8')
+        etag = f'"{hashlib.md5(payload).hexdigest()}"'
+        if status == 200 and handler.headers.get('If-None-Match') == etag:
+            # Conditional requests answered with 304 do not count against GitHub's rate limit
+            with self._lock:
+                self.not_modified += 1
+            self._send(handler, 304, b'', {'ETag': etag, **headers}, spend=False)
+            return
+        self._send(handler, status, payload, {'ETag': etag, 'Content-Type': 'application/json', **headers})
+    
+    def _listing_page(self, handler, repositories, query):
+        # GitHub's defaults: full_name ascending, other sort keys descending
+        sort = query.get('sort', 'full_name')
+        key = 'updated_at' if sort in ('updated', 'pushed') else 'full_name'
+        direction = query.get('direction', 'asc' if key == 'full_name' else 'desc')
+        repositories = sorted(repositories, key=lambda repo: repo[key], reverse=direction == 'desc')
+        per_page = min(MAX_PER_PAGE, int(query.get('per_page', DEFAULT_PER_PAGE)))
+        page = max(1, int(query.get('page', 1)))
+        last_page = max(1, -(-len(repositories) // per_page))
+        body = repositories[(page - 1) * per_page:page * per_page]
+        
+        base = f"http://{handler.headers.get('Host')}/user/repos"
+        links = []
+        if page < last_page:
+            links.append(f'<{base}?page={page + 1}&per_page={per_page}>; rel="next"')
+        links.append(f'<{base}?page={last_page}&per_page={per_page}>; rel="last"')
+        return 200, body, {'Link': ', '.join(links)}
+    
+    def _repository(self, rest, repositories):
+        full_name = rest[:-len('/branches')] if rest.endswith('/branches') else rest
+        repo = next((repo for repo in repositories if repo['full_name'] == full_name), None)
+        if repo is None:
+            return 404, {'message': 'Not Found'}
+        if rest.endswith('/branches'):
+            return 200, [{'name': repo['default_branch'], 'protected': False}]
+        return 200, repo
+    
+    def _rate_limit_snapshot(self):
+        with self._lock:
+            return {'limit': RATE_LIMIT, 'remaining': self._remaining, 'reset': self._reset_at, 'used': RATE_LIMIT - self._remaining}
+    
+    def _send(self, handler, status, payload, headers, spend=True):
+        with self._lock:
+            if spend and self._remaining > 0:
+                self._remaining -= 1
+            rate_headers = {
+                'X-RateLimit-Limit': str(RATE_LIMIT),
+                'X-RateLimit-Remaining': str(self._remaining),
+                'X-RateLimit-Reset': str(self._reset_at),
+                'X-RateLimit-Resource': 'core'
+            }
+        handler.send_response(status)
+        for name, value in {**rate_headers, **headers}.items():
+            handler.send_header(name, value)
+        handler.send_header('Content-Length', str(len(payload)))
+        handler.end_headers()
+        handler.wfile.write(payload)
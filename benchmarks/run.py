@@ -0,0 +1,339 @@
+"""Benchmark syncs, backup sweeps and retention against a local GitHub stand-in
+
+Generates synthetic repositories (cached by shape), serves them through a fake GitHub
+API with file:// clone URLs, and runs the real BackupService against a scratch
+database and backup directory. Each scenario records wall time, CPU time, peak RSS,
+bytes written, repositories per second and API requests; results are written as JSON
+for benchmarks/compare.py.
+
+    python benchmarks/run.py --repos 100 --files 200 --output before.json
+    python benchmarks/run.py --repos 100 --files 200 --output after.json
+    python benchmarks/compare.py before.json after.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import platform
+import resource
+import statistics
+import subprocess
+import threading
+from dataclasses import asdict
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_github import FakeGitHub  # noqa: E402
+from synthetic_repos import RepoShape, add_commit, generate_repositories  # noqa: E402
+
+RESULT_SCHEMA = 1
+RSS_SAMPLE_INTERVAL = 0.02
+BENCHMARK_TOKEN = 'benchmark-token'
+
+class PeakMemory:
+    """Samples this process's resident set size while a scenario runs"""
+    
+    def __init__(self):
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def __enter__(self):
+        self.peak = _current_rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _current_rss())
+    
+    def _sample(self):
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL):
+            self.peak = max(self.peak, _current_rss())
+
+
+def _current_rss():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # No procfs (macOS): fall back to the process-lifetime peak, reported in bytes there
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _directory_size(path):
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(directory, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _code_version():
+    try:
+        commit = subprocess.run(['git', '-C', ROOT, 'rev-parse', 'HEAD'],
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', '-C', ROOT, 'status', '--porcelain', '--untracked-files=no'],
+                                    capture_output=True, text=True).stdout.strip())
+        return {'commit': commit, 'dirty': dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': None, 'dirty': None}
+
+
+class BenchmarkRun:
+    """One repetition of the scenario list against a fresh database and backup directory"""
+    
+    def __init__(self, args, fake, upstream_paths, work_dir):
+        self.args = args
+        self.fake = fake
+        self.upstream_paths = upstream_paths
+        self.backup_path = os.path.join(work_dir, 'backups')
+        self.results = []
+    
+    def setup(self):
+        from app import app, db
+        from models import BackupConfig
+        
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            db.session.add(BackupConfig(
+                github_token=BENCHMARK_TOKEN,
+                backup_path=self.backup_path,
+                max_backups=self.args.sweeps + 1,  # Sweeps keep everything; the retention scenario prunes
+                auto_sync_enabled=True,
+                skip_unchanged=self.args.skip_unchanged,
+                max_workers=self.args.workers,
+                max_clone_workers=self.args.clone_workers,
+                max_archive_workers=self.args.archive_workers,
+                archive_format=self.args.archive_format,
+                backup_mode=self.args.mode
+            ))
+            db.session.commit()
+        shutil.rmtree(self.backup_path, ignore_errors=True)
+        os.makedirs(self.backup_path)
+    
+    def run(self):
+        self.setup()
+        self.measure('sync_cold', self.sync)
+        self.measure('sync_warm', self.sync)
+        for sweep in range(self.args.sweeps):
+            if sweep == 0:
+                name = 'sweep_cold'
+            else:
+                self.push_changes(sweep)
+                name = f"sweep_warm_{sweep}"
+            self.measure(name, self.sweep)
+        self.measure('retention', self.retention)
+        return self.results
+    
+    def sync(self):
+        from app import app
+        from backup_service import BackupService
+        
+        with app.app_context():
+            return {'repos': len(BackupService().sync_and_list_repositories())}
+    
+    def sweep(self):
+        from app import app, db
+        from models import BackupJob
+        from backup_service import BackupService
+        
+        with app.app_context():
+            last_job_id = db.session.query(db.func.max(BackupJob.id)).scalar() or 0
+        BackupService().backup_all_repositories()
+        with app.app_context():
+            jobs = BackupJob.query.filter(BackupJob.id > last_job_id).all()
+            return {
+                'repos': len(jobs),
+                'failed': sum(1 for job in jobs if job.status == 'failed'),
+                'skipped': sum(1 for job in jobs if job.status == 'skipped'),
+                'bytes_written': sum(job.file_size or 0 for job in jobs if job.status == 'completed')
+            }
+    
+    def retention(self):
+        from app import app, db
+        from models import BackupConfig, BackupJob
+        from backup_service import BackupService
+        
+        with app.app_context():
+            config = BackupConfig.query.first()
+            config.max_backups = 1
+            db.session.commit()
+            before = BackupJob.query.count()
+        BackupService().cleanup_old_backups()
+        with app.app_context():
+            return {'jobs_removed': before - BackupJob.query.count()}
+    
+    def push_changes(self, sweep):
+        """Add a commit to change_fraction of the upstream repositories, as pushes between sweeps would"""
+        rng = random.Random(f"{self.args.seed}:sweep:{sweep}")
+        count = int(len(self.upstream_paths) * self.args.change_fraction)
+        for index in sorted(rng.sample(range(len(self.upstream_paths)), count)):
+            add_commit(self.upstream_paths[index], seed=f"{self.args.seed}:{sweep}:{index}")
+            self.fake.touch(f"{self.fake.login}/{os.path.basename(self.upstream_paths[index])[:-len('.git')]}")
+        # pushed_at has one-second resolution; keep this sweep's pushes distinguishable from the last
+        time.sleep(1)
+    
+    def measure(self, scenario, function):
+        self.fake.reset_counters()
+        disk_before = _directory_size(self.backup_path)
+        self_before = resource.getrusage(resource.RUSAGE_SELF)
+        children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        with PeakMemory() as memory:
+            start = time.perf_counter()
+            details = function() or {}
+            wall = time.perf_counter() - start
+        self_after = resource.getrusage(resource.RUSAGE_SELF)
+        children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        
+        result = {
+            'scenario': scenario,
+            'wall_seconds': round(wall, 4),
+            'cpu_seconds': round((self_after.ru_utime + self_after.ru_stime)
+                                 - (self_before.ru_utime + self_before.ru_stime), 4),
+            'child_cpu_seconds': round((children_after.ru_utime + children_after.ru_stime)
+                                       - (children_before.ru_utime + children_before.ru_stime), 4),
+            'peak_rss_bytes': memory.peak,
+            'disk_bytes_delta': _directory_size(self.backup_path) - disk_before,
+            'api_requests': self.fake.requests,
+            'api_not_modified': self.fake.not_modified,
+            **details
+        }
+        if 'repos' in details:
+            result['repos_per_second'] = round(details['repos'] / wall, 3) if wall else None
+        self.results.append(result)
+        print(f"  {scenario:<16} {wall:8.2f}s  " + ', '.join(
+            f"{key}={value}" for key, value in details.items()
+        ), file=sys.stderr)
+
+
+def summarize(repetitions):
+    """Median of each numeric metric per scenario across repetitions"""
+    summary = {}
+    for results in repetitions:
+        for result in results:
+            for key, value in result.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    summary.setdefault(result['scenario'], {}).setdefault(key, []).append(value)
+    return {
+        scenario: {key: statistics.median(values) for key, values in metrics.items()}
+        for scenario, metrics in summary.items()
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark backup sweeps against a local GitHub stand-in")
+    shape = parser.add_argument_group('repository shape')
+    shape.add_argument('--repos', type=int, default=20, help="number of repositories (default: 20)")
+    shape.add_argument('--files', type=int, default=RepoShape.files, help="files per repository")
+    shape.add_argument('--file-size', type=int, default=RepoShape.file_size, help="average file size in bytes")
+    shape.add_argument('--commits', type=int, default=RepoShape.commits, help="commits per repository")
+    shape.add_argument('--churn', type=float, default=RepoShape.churn, help="share of files changed per commit")
+    shape.add_argument('--binary-ratio', type=float, default=RepoShape.binary_ratio,
+                       help="share of incompressible files")
+    shape.add_argument('--depth', type=int, default=RepoShape.depth, help="directory nesting")
+    shape.add_argument('--seed', type=int, default=0)
+
+    run = parser.add_argument_group('run')
+    run.add_argument('--sweeps', type=int, default=3, help="backup sweeps, the first one cold (default: 3)")
+    run.add_argument('--change-fraction', type=float, default=0.1,
+                     help="share of repositories pushed to between sweeps (default: 0.1)")
+    run.add_argument('--repeat', type=int, default=1, help="repetitions; the summary reports medians")
+    run.add_argument('--mode', choices=('snapshot', 'bundle', 'dedup'), default='snapshot')
+    run.add_argument('--archive-format', default='zip')
+    run.add_argument('--workers', type=int, default=4)
+    run.add_argument('--clone-workers', type=int, default=4)
+    run.add_argument('--archive-workers', type=int, default=2)
+    run.add_argument('--skip-unchanged', action='store_true')
+    run.add_argument('--api-latency', type=float, default=0.0,
+                     help="seconds added to every fake API response (default: 0)")
+    run.add_argument('--work-dir', default=os.path.join(ROOT, '.benchmark'),
+                     help="generated repositories and scratch data (default: .benchmark)")
+    run.add_argument('--output', help="write results JSON here (default: stdout)")
+    run.add_argument('--verbose', action='store_true', help="keep application logging")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    shape = RepoShape(files=args.files, file_size=args.file_size, commits=args.commits,
+                      churn=args.churn, binary_ratio=args.binary_ratio, depth=args.depth)
+    work_dir = os.path.abspath(args.work_dir)
+    scratch_dir = os.path.join(work_dir, 'run')
+    shutil.rmtree(scratch_dir, ignore_errors=True)
+    os.makedirs(scratch_dir)
+
+    print(f"Generating {args.repos} repositories ({shape})", file=sys.stderr)
+    started = time.perf_counter()
+    cached_paths = generate_repositories(os.path.join(work_dir, 'cache'), args.repos, shape, seed=args.seed)
+    print(f"  ready in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    fake = FakeGitHub(latency=args.api_latency).start()
+
+    # Before the application is imported: scratch database, fake API, no scheduler or queue workers
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(scratch_dir, 'benchmark.db')}"
+    os.environ['GITHUB_API_URL'] = fake.url
+    os.environ['APP_ROLE'] = 'worker'
+    import app  # noqa: F401
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    repetitions = []
+    try:
+        for repetition in range(args.repeat):
+            print(f"Repetition {repetition + 1}/{args.repeat}", file=sys.stderr)
+            # Pushes between sweeps change the upstream repositories, so each repetition gets
+            # its own hard-linked copy of the cached set (git never rewrites object files)
+            upstream_dir = os.path.join(scratch_dir, 'upstream')
+            shutil.rmtree(upstream_dir, ignore_errors=True)
+            fake.repositories.clear()
+            upstream_paths = []
+            for path in cached_paths:
+                target = os.path.join(upstream_dir, os.path.basename(path))
+                shutil.copytree(path, target, copy_function=os.link)
+                upstream_paths.append(target)
+                fake.add_repository(os.path.basename(path)[:-len('.git')], f"file://{target}",
+                                    size_kb=_directory_size(target) // 1024,
+                                    pushed_at=datetime(2024, 1, 1))
+            repetitions.append(BenchmarkRun(args, fake, upstream_paths, scratch_dir).run())
+    finally:
+        fake.stop()
+
+    report = {
+        'schema': RESULT_SCHEMA,
+        'created_at': datetime.utcnow().isoformat() + 'Z',
+        'code': _code_version(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'git': subprocess.run(['git', '--version'], capture_output=True, text=True).stdout.strip()
+        },
+        'parameters': {**{key: value for key, value in vars(args).items() if key not in ('output', 'work_dir', 'verbose')},
+                       'shape': asdict(shape)},
+        'repetitions': repetitions,
+        'summary': summarize(repetitions)
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
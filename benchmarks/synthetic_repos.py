@@ -0,0 +1,130 @@
+"""Deterministic synthetic git repositories for benchmarks
+
+Repositories are written in one `git fast-import` stream each, without a working tree or
+a process per commit. The same shape and seed always produce byte-identical
+repositories, and a generated set is reused across runs.
+"""
+import os
+import json
+import random
+import shutil
+import hashlib
+import subprocess
+from dataclasses import asdict, dataclass
+
+TEXT_POOL_WORDS = 64 * 1024  # Text files are cut from one pool of random words per repository
+WORDS = ('backup', 'mirror', 'commit', 'archive', 'branch', 'object', 'delta', 'index',
+         'stream', 'bundle', 'chunk', 'remote', 'fetch', 'tree', 'blob', 'refs')
+
+@dataclass(frozen=True)
+class RepoShape:
+    """Size and shape of each generated repository"""
+    files: int = 50
+    file_size: int = 4096  # Average bytes per file; actual sizes vary from half to one and a half times this
+    commits: int = 5
+    churn: float = 0.2  # Share of files rewritten by each commit after the first
+    binary_ratio: float = 0.1  # Share of files with incompressible content
+    depth: int = 3  # Directory nesting
+    
+    def key(self, seed):
+        return hashlib.sha256(json.dumps({**asdict(self), 'seed': seed}, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def generate_repositories(root, count, shape, seed=0):
+    """Create (or reuse) count bare repositories under root; returns their paths"""
+    set_dir = os.path.join(root, f"repos-{shape.key(seed)}")
+    os.makedirs(set_dir, exist_ok=True)
+    paths = []
+    for index in range(count):
+        path = os.path.join(set_dir, f"repo-{index:05d}.git")
+        if not os.path.isdir(path):
+            _generate_repository(path, shape, random.Random(f"{seed}:{index}"))
+        paths.append(path)
+    return paths
+
+
+def add_commit(path, seed, files=3, file_size=1024):
+    """Push one more commit to an existing repository (a "push" between sweeps)"""
+    rng = random.Random(seed)
+    pool = _text_pool(rng)
+    parent = subprocess.run(
+        ['git', f'--git-dir={path}', 'rev-parse', 'refs/heads/main'],
+        check=True, capture_output=True, text=True
+    ).stdout.strip()
+    stream = bytearray()
+    changes = []
+    for number in range(files):
+        content = _text(rng, file_size, pool)
+        stream += _blob(number + 1, content)
+        changes.append((f"changes/{rng.getrandbits(32):08x}.txt", number + 1))
+    stream += _commit(files + 1, changes, message=f"Update {seed}", timestamp=2_000_000_000, parent=parent)
+    subprocess.run(['git', f'--git-dir={path}', 'fast-import', '--quiet'], input=bytes(stream), check=True)
+
+
+def _generate_repository(path, shape, rng):
+    partial = f"{path}.partial"
+    shutil.rmtree(partial, ignore_errors=True)
+    subprocess.run(['git', 'init', '--bare', '--quiet', partial], check=True)
+    subprocess.run(['git', f'--git-dir={partial}', 'symbolic-ref', 'HEAD', 'refs/heads/main'], check=True)
+
+    paths = [_random_path(rng, shape.depth, number) for number in range(shape.files)]
+    binary = {file_path for file_path in paths if rng.random() < shape.binary_ratio}
+    pool = _text_pool(rng)
+    stream = bytearray()
+    mark = 0
+    previous_commit = None
+    for commit_number in range(shape.commits):
+        if commit_number == 0:
+            changed = paths
+        else:
+            changed = rng.sample(paths, max(1, int(len(paths) * shape.churn)))
+        changes = []
+        for file_path in changed:
+            size = rng.randint(shape.file_size // 2, shape.file_size * 3 // 2)
+            content = rng.randbytes(size) if file_path in binary else _text(rng, size, pool)
+            mark += 1
+            stream += _blob(mark, content)
+            changes.append((file_path, mark))
+        mark += 1
+        stream += _commit(mark, changes, message=f"Commit {commit_number}",
+                          timestamp=1_700_000_000 + commit_number * 3600,
+                          parent=previous_commit)
+        previous_commit = f":{mark}"
+
+    subprocess.run(['git', f'--git-dir={partial}', 'fast-import', '--quiet'], input=bytes(stream), check=True)
+    os.rename(partial, path)
+
+
+def _random_path(rng, depth, number):
+    directories = [rng.choice(WORDS) for _ in range(rng.randint(0, depth))]
+    return '/'.join(directories + [f"{rng.choice(WORDS)}_{number}.txt"])
+
+
+def _text_pool(rng):
+    return ' '.join(rng.choices(WORDS, k=TEXT_POOL_WORDS)).encode('ascii')
+
+
+def _text(rng, size, pool):
+    """Compressible text: a slice of the pool at a random offset, repeated if size exceeds it"""
+    start = rng.randrange(len(pool))
+    text = pool[start:] + pool[:start]
+    return (text * (size // len(text) + 1))[:size]
+
+
+def _blob(mark, content):
+    return b'blob\nmark :%d\ndata %d\n%s\n' % (mark, len(content), content)
+
+
+def _commit(mark, changes, message, timestamp, parent=None):
+    message = message.encode('utf-8')
+    lines = [
+        b'commit refs/heads/main',
+        b'mark :%d' % mark,
+        b'committer Benchmark <benchmark@example.com> %d +0000' % timestamp,
+        b'data %d' % len(message),
+        message
+    ]
+    if parent:
+        lines.append(b'from ' + parent.encode('ascii'))
+    lines += [b'M 100644 :%d %s' % (blob_mark, file_path.encode('utf-8')) for file_path, blob_mark in changes]
+    return b'\n'.join(lines) + b'\n\n'
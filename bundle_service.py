@@ -0,0 +1,73 @@
+import os
+import logging
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+# Only branches and tags are bundled; GitHub's refs/pull/* are left out
+BUNDLED_REF_PREFIXES = ('refs/heads/', 'refs/tags/')
+
+class EmptyBundleError(Exception):
+    """Raised when there are no new objects to put in an incremental bundle"""
+    pass
+
+class BundleService:
+    """Creates and restores full and incremental git bundles from a bare mirror"""
+    
+    def read_refs(self, git_dir):
+        """Map of ref name to object id for the branches and tags in a repository"""
+        result = subprocess.run([
+            'git', f'--git-dir={git_dir}', 'for-each-ref', '--format=%(objectname) %(refname)',
+            *BUNDLED_REF_PREFIXES
+        ], check=True, capture_output=True, text=True)
+        refs = {}
+        for line in result.stdout.splitlines():
+            object_id, ref = line.split(' ', 1)
+            refs[ref] = object_id
+        return refs
+    
+    def has_objects(self, git_dir, object_ids):
+        """True if every object id is still present in the repository"""
+        if not object_ids:
+            return True
+        result = subprocess.run(
+            ['git', f'--git-dir={git_dir}', 'cat-file', '--batch-check'],
+            input='\n'.join(object_ids) + '\n', capture_output=True, text=True
+        )
+        return result.returncode == 0 and 'missing' not in result.stdout
+    
+    def create(self, git_dir, bundle_path, exclude=()):
+        """Write a bundle of all branches and tags, leaving out history reachable from exclude
+        
+        With no exclusions this is a full bundle; otherwise it is an incremental bundle whose
+        prerequisites are the excluded commits. Raises EmptyBundleError if nothing is new.
+        """
+        # Revisions go through stdin so thousands of refs never hit the argv limit
+        revisions = [ref for ref in self.read_refs(git_dir)] + [f'^{object_id}' for object_id in sorted(set(exclude))]
+        partial_path = f"{bundle_path}.partial"
+        try:
+            result = subprocess.run(
+                ['git', f'--git-dir={git_dir}', 'bundle', 'create', '--quiet', partial_path, '--stdin'],
+                input='\n'.join(revisions) + '\n', capture_output=True, text=True
+            )
+            if result.returncode != 0:
+                if 'empty bundle' in result.stderr:
+                    raise EmptyBundleError("No new objects since the previous bundle")
+                raise subprocess.CalledProcessError(result.returncode, result.args, stderr=result.stderr)
+            os.replace(partial_path, bundle_path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        return os.path.getsize(bundle_path)
+    
+    def restore(self, bundle_paths, target_dir):
+        """Rebuild a bare repository by fetching a base bundle and its increments in order"""
+        subprocess.run(['git', 'init', '--bare', '--quiet', target_dir], check=True, capture_output=True, text=True)
+        for bundle_path in bundle_paths:
+            subprocess.run([
+                'git', f'--git-dir={target_dir}', 'bundle', 'verify', '--quiet', bundle_path
+            ], check=True, capture_output=True, text=True)
+            subprocess.run([
+                'git', f'--git-dir={target_dir}', 'fetch', '--quiet', bundle_path, '+refs/*:refs/*'
+            ], check=True, capture_output=True, text=True)
+        return target_dir
@@ -0,0 +1,244 @@
+"""Headless command-line runs, without the web app, scheduler or queue workers
+
+Runs sync, backups, retention and verification in the foreground against the configured
+database, for cron, systemd timers or other orchestration. Each command prints a JSON
+report on stdout (logs go to stderr) and exits with status 1 if anything failed:
+
+    python cli.py sync
+    python cli.py backup --workers 4 --format tar.zst
+    python cli.py backup --repo myorg/api --repo myorg/web --no-retention
+    python cli.py retention
+    python cli.py verify --report /var/log/github-backup/verify.json
+
+Settings given on the command line apply to that run only; the rest come from the
+configuration saved through the web interface.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from datetime import datetime
+
+from archive_service import ARCHIVE_FORMATS  # Standard library only; safe to import before app
+
+logger = logging.getLogger('cli')
+
+BACKUP_MODES = ('snapshot', 'bundle', 'dedup')
+
+
+def _add_common_arguments(parser, default=None):
+    parser.add_argument('--database-url', default=default,
+                        help="database to use (default: DATABASE_URL, else sqlite:///backup_app.db)")
+    parser.add_argument('--report', metavar='PATH', default=default, help="also write the JSON report to this file")
+    parser.add_argument('-v', '--verbose', action='store_true', default=default or False, help="log at debug level")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run GitHub backups without the web app")
+    _add_common_arguments(parser)
+    # Also accepted after the command name; SUPPRESS keeps a command's parser from resetting them
+    common = argparse.ArgumentParser(add_help=False)
+    _add_common_arguments(common, default=argparse.SUPPRESS)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('sync', parents=[common], help="refresh the repository list from GitHub")
+
+    backup = commands.add_parser('backup', parents=[common],
+                                 help="back up all enabled repositories, or those given with --repo")
+    backup.add_argument('--repo', action='append', default=[], metavar='OWNER/NAME',
+                        help="back up only this repository (repeatable)")
+    backup.add_argument('--workers', type=int,
+                        help="repositories backed up in parallel (default: max_workers from the configuration)")
+    backup.add_argument('--format', dest='archive_format', choices=list(ARCHIVE_FORMATS),
+                        help="archive format for snapshots (default: from the configuration)")
+    backup.add_argument('--mode', choices=BACKUP_MODES, help="backup mode (default: from the configuration)")
+    backup.add_argument('--no-sync', action='store_true', help="do not refresh the repository list before a full run")
+    backup.add_argument('--no-retention', action='store_true', help="do not remove old backups afterwards")
+
+    commands.add_parser('retention', parents=[common], help="remove backups beyond max_backups and orphaned mirrors")
+
+    verify = commands.add_parser('verify', parents=[common], help="check the latest completed backup of each repository")
+    verify.add_argument('--repo', action='append', default=[], metavar='OWNER/NAME',
+                        help="check only this repository (repeatable)")
+    verify.add_argument('--all', action='store_true', help="check every retained backup, not just the latest")
+    return parser
+
+
+def run_sync(args, report):
+    from models import BackupConfig
+    from github_service import GitHubService
+    from http_cache import DatabaseResponseCache
+    from sync_service import RepositorySyncService
+
+    config = BackupConfig.query.first()
+    if not config or not config.github_token:
+        raise Exception("No GitHub token configured")
+    github_service = GitHubService(config.github_token, pool_size=config.api_pool_size, cache=DatabaseResponseCache())
+    report['sync'] = RepositorySyncService(github_service).sync()
+    return True
+
+
+def run_backup(args, report):
+    from app import db
+    from models import BackupJob, Repository
+
+    service = _backup_service()
+    # The loaded configuration is detached from any session, so these overrides are never saved
+    if args.workers:
+        service.config.max_workers = max(1, args.workers)
+    if args.archive_format:
+        service.config.archive_format = args.archive_format
+    if args.mode:
+        service.config.backup_mode = args.mode
+
+    run_started = datetime.utcnow()
+    if args.repo:
+        repositories = Repository.query.filter(Repository.full_name.in_(args.repo)).all()
+        unknown = sorted(set(args.repo) - {repo.full_name for repo in repositories})
+        if unknown:
+            raise Exception(f"Unknown repositories: {', '.join(unknown)}")
+        repositories = service.order_by_expected_duration(repositories)
+    else:
+        if args.no_sync:
+            service.config.auto_sync_enabled = False
+        repositories = service.sync_and_list_repositories()
+
+    service.backup_repositories(repositories)
+    if not args.no_retention:
+        service.cleanup_old_backups()
+        service.prune_orphaned_mirrors()
+
+    repository_ids = [repo.id for repo in repositories]
+    jobs = BackupJob.query.filter(
+        BackupJob.repository_id.in_(repository_ids),
+        BackupJob.started_at >= run_started
+    ).order_by(BackupJob.id).all() if repository_ids else []
+    counts = {}
+    for job in jobs:
+        counts[job.status] = counts.get(job.status, 0) + 1
+    # A repository without a job record failed before its backup could start
+    without_job = sorted({repo.full_name for repo in repositories} - {job.repository.full_name for job in jobs})
+
+    report['backup'] = {
+        'settings': {
+            'workers': service.config.max_workers or 1,
+            'mode': service.config.backup_mode or 'snapshot',
+            'format': service.config.archive_format,
+            'retention': not args.no_retention
+        },
+        'repositories': len(repositories),
+        'counts': counts,
+        'bytes_written': sum(job.file_size or 0 for job in jobs),
+        'not_started': without_job,
+        'jobs': [{
+            'repository': job.repository.full_name,
+            'job_id': job.id,
+            'status': job.status,
+            'kind': job.backup_kind,
+            'file_size': job.file_size,
+            'duration_seconds': (job.completed_at - job.started_at).total_seconds()
+            if job.completed_at and job.started_at else None,
+            'error': job.error_message
+        } for job in jobs]
+    }
+    db.session.commit()
+    return not without_job and not counts.get('failed')
+
+
+def run_retention(args, report):
+    from models import BackupJob
+
+    service = _backup_service()
+    before = BackupJob.query.count()
+    service.cleanup_old_backups()
+    service.prune_orphaned_mirrors()
+    report['retention'] = {'jobs_removed': before - BackupJob.query.count()}
+    return True
+
+
+def run_verify(args, report):
+    from models import BackupJob, Repository
+
+    service = _backup_service()
+    query = BackupJob.query.join(Repository).filter(BackupJob.status == 'completed')
+    if args.repo:
+        query = query.filter(Repository.full_name.in_(args.repo))
+    jobs = query.order_by(BackupJob.completed_at.desc()).all()
+    if not args.all:
+        latest = {}
+        for job in jobs:
+            latest.setdefault(job.repository_id, job)
+        jobs = list(latest.values())
+
+    results = []
+    for job in jobs:
+        problems = service.verify_backup(job)
+        if problems:
+            logger.error(f"{job.repository.full_name} (job {job.id}): {'; '.join(problems)}")
+        results.append({
+            'repository': job.repository.full_name,
+            'job_id': job.id,
+            'kind': job.backup_kind,
+            'completed_at': job.completed_at.isoformat() if job.completed_at else None,
+            'ok': not problems,
+            'problems': problems
+        })
+    failed = sum(1 for result in results if not result['ok'])
+    report['verify'] = {'checked': len(results), 'failed': failed, 'jobs': results}
+    return not failed
+
+
+def _backup_service():
+    from backup_service import BackupService
+
+    service = BackupService()
+    if not service.config:
+        raise Exception("No backup configuration found")
+    return service
+
+
+COMMANDS = {
+    'sync': run_sync,
+    'backup': run_backup,
+    'retention': run_retention,
+    'verify': run_verify,
+}
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    # Before importing app: no scheduler, web routes or queue workers in this process
+    os.environ['APP_ROLE'] = 'cli'
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    from app import app
+    logging.getLogger().setLevel(logging.DEBUG if args.verbose else logging.INFO)
+
+    started = time.monotonic()
+    report = {'command': args.command, 'started_at': datetime.utcnow().isoformat()}
+    with app.app_context():
+        try:
+            ok = COMMANDS[args.command](args, report)
+        except Exception as e:
+            logger.error(f"{args.command} failed: {str(e)}")
+            report['error'] = str(e)
+            ok = False
+    report.update(
+        finished_at=datetime.utcnow().isoformat(),
+        duration_seconds=round(time.monotonic() - started, 3),
+        ok=ok
+    )
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.report:
+        with open(args.report, 'w') as report_file:
+            report_file.write(output + '\n')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
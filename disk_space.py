@@ -0,0 +1,83 @@
+import os
+import time
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DISK_WAIT_POLL_INTERVAL = 10  # Seconds between free-space checks while a backup waits; releases wake it sooner
+DISK_WAIT_TIMEOUT = 3600  # A backup that has waited this long for space fails
+
+class DiskSpaceAdmission:
+    """Process-wide reservations of disk space for backups in progress
+    
+    Before writing, a backup reserves its estimated size on each filesystem it uses. It
+    waits while the free space, less what other running backups have reserved, would drop
+    below the configured minimum. If nothing else holds a reservation and it still does
+    not fit, it fails at once instead of waiting for space that will never appear.
+    Reservations overlap with data already written by their backups, which errs on the
+    side of waiting.
+    """
+    
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._reserved = {}  # st_dev -> bytes reserved by running backups
+    
+    @contextmanager
+    def reserve(self, requests, min_free_bytes, label='backup'):
+        """Hold reservations for [(path, bytes), ...] for the duration of the block"""
+        demands = {}
+        for path, nbytes in requests:
+            device = os.stat(path).st_dev
+            required_path, required = demands.get(device, (path, 0))
+            demands[device] = (required_path, required + max(0, int(nbytes)))
+        
+        deadline = time.monotonic() + DISK_WAIT_TIMEOUT
+        waiting = False
+        with self._condition:
+            while True:
+                shortfall = self._shortfall(demands, min_free_bytes)
+                if shortfall is None:
+                    break
+                path, needed, free, reserved = shortfall
+                if not reserved:
+                    raise Exception(
+                        f"Not enough disk space for {label} on {path}: needs about {_megabytes(needed)} "
+                        f"plus {_megabytes(min_free_bytes)} kept free, {_megabytes(free)} available"
+                    )
+                if time.monotonic() >= deadline:
+                    raise Exception(f"Timed out waiting for disk space for {label} on {path}")
+                if not waiting:
+                    waiting = True
+                    logger.info(
+                        f"Waiting for disk space for {label}: needs about {_megabytes(needed)} on {path}, "
+                        f"{_megabytes(free)} free with {_megabytes(reserved)} reserved by running backups"
+                    )
+                self._condition.wait(DISK_WAIT_POLL_INTERVAL)
+            for device, (_, required) in demands.items():
+                self._reserved[device] = self._reserved.get(device, 0) + required
+        try:
+            yield
+        finally:
+            with self._condition:
+                for device, (_, required) in demands.items():
+                    self._reserved[device] -= required
+                self._condition.notify_all()
+    
+    def _shortfall(self, demands, min_free_bytes):
+        """(path, needed, free, reserved) for the first filesystem without room, or None"""
+        for device, (path, required) in demands.items():
+            free = shutil.disk_usage(path).free
+            reserved = self._reserved.get(device, 0)
+            if free - reserved - required < min_free_bytes:
+                return path, required, free, reserved
+        return None
+
+
+def _megabytes(nbytes):
+    return f"{nbytes / 1024 ** 2:.0f} MB"
+
+
+disk_admission = DiskSpaceAdmission()
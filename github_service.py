@@ -1,25 +1,302 @@
+import os
 import requests
+import hashlib
+import json
 import logging
-from typing import List, Dict, Optional
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Dict, Iterator, Optional, Union
+from urllib.parse import parse_qs, urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from metrics import Counter, gauge_lines, registry
 
 logger = logging.getLogger(__name__)
 
+# GitHub Enterprise Server (https://host/api/v3) or a local stand-in such as benchmarks/fake_github.py
+GITHUB_API_URL = os.environ.get("GITHUB_API_URL", "https://api.github.com").rstrip("/")
+DEFAULT_POOL_SIZE = 10
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+SECONDARY_RATE_LIMIT_WAIT = 60  # Seconds to wait when GitHub gives no Retry-After
+LISTING_PER_PAGE = 100
+DEFAULT_LISTING_CONCURRENCY = 4  # Listing pages fetched at once
+RATE_LIMIT_RESERVE = 50  # Requests held back for interactive use (dashboard, token checks)
+RATE_LIMIT_PACING_THRESHOLD = 0.2  # Start pacing once less than this share of the budget is left
+
+# Keep-alive sessions shared by every GitHubService using the same token and pool size
+_sessions: Dict[tuple, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+# Rate-limit state shared by every GitHubService using the same token
+_rate_limiters: Dict[str, "RateLimiter"] = {}
+
+THROTTLED_SECONDS = registry.register(Counter(
+    "github_api_throttled_seconds_total",
+    "Time spent waiting before GitHub API requests, by cause (pacing, secondary rate limit)",
+    labelnames=("reason",)
+))
+
+
+def _get_shared_session(token: str, pool_size: int) -> requests.Session:
+    """Return the pooled, retrying session for a token, creating it on first use"""
+    key = (token, pool_size)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            # 5xx responses are retried with exponential backoff by urllib3;
+            # secondary rate limits need the response body and are handled in _get,
+            # so urllib3 must not retry (and sleep on) a 403/429 with Retry-After itself
+            retry = Retry(
+                total=MAX_RETRIES,
+                backoff_factor=BACKOFF_FACTOR,
+                status_forcelist=(500, 502, 503, 504),
+                allowed_methods=frozenset(["GET", "HEAD"]),
+                respect_retry_after_header=False,
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[key] = session
+        return session
+
+
+def _get_shared_rate_limiter(token: str) -> "RateLimiter":
+    """Return the rate limiter for a token, creating it on first use"""
+    with _sessions_lock:
+        limiter = _rate_limiters.get(token)
+        if limiter is None:
+            limiter = RateLimiter()
+            _rate_limiters[token] = limiter
+        return limiter
+
+
+class RateLimiter:
+    """Token bucket driven by GitHub's X-RateLimit-* response headers
+    
+    While plenty of budget is left requests go out unthrottled. Once the remaining
+    budget drops below RATE_LIMIT_PACING_THRESHOLD of the limit, requests are spaced
+    evenly over the time left until reset, and when only the reserve is left callers
+    wait for the reset instead of failing. Interactive callers (token checks and syncs
+    started from the web interface) are neither paced nor held back: the reserve is theirs.
+    """
+    
+    def __init__(self, reserve: int = RATE_LIMIT_RESERVE):
+        self.reserve = reserve
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        self.reset_at: Optional[float] = None  # Epoch seconds
+        self._next_slot = 0.0
+        self._waiting_until: Optional[float] = None
+        self._lock = threading.Lock()
+    
+    def acquire(self, interactive: bool = False):
+        """Block until the next request may be sent, then spend one unit of budget"""
+        with self._lock:
+            now = time.time()
+            wait = 0.0 if interactive else self._delay(now)
+            if not interactive:
+                self._next_slot = now + wait
+                self._waiting_until = self._next_slot if wait > 0 else None
+            if self.remaining is not None:
+                # Spend optimistically so concurrent callers see it before the response arrives
+                self.remaining -= 1
+        if wait > 0:
+            logger.info(f"GitHub rate limit pacing: waiting {wait:.1f}s")
+            THROTTLED_SECONDS.inc(wait, reason="pacing")
+            time.sleep(wait)
+    
+    def _delay(self, now: float) -> float:
+        if self.remaining is None or self.reset_at is None:
+            return 0.0
+        if now >= self.reset_at:
+            # Window has rolled over; the next response will tell us the new budget
+            self.remaining = None
+            return 0.0
+        
+        spendable = self.remaining - self.reserve
+        if spendable <= 0:
+            return self.reset_at - now + 1
+        if self.limit and self.remaining > self.limit * RATE_LIMIT_PACING_THRESHOLD:
+            return 0.0
+        interval = (self.reset_at - now) / spendable
+        return max(0.0, self._next_slot + interval - now)
+    
+    def update(self, headers) -> None:
+        """Record the budget reported by a GitHub response"""
+        if headers.get("X-RateLimit-Resource", "core") != "core":
+            return
+        try:
+            limit = int(headers["X-RateLimit-Limit"])
+            remaining = int(headers["X-RateLimit-Remaining"])
+            reset_at = float(headers["X-RateLimit-Reset"])
+        except (KeyError, ValueError):
+            return
+        
+        with self._lock:
+            if self.reset_at == reset_at and self.remaining is not None:
+                # Same window: responses can arrive out of order, so keep the lowest count
+                remaining = min(self.remaining, remaining)
+            self.limit = limit
+            self.remaining = remaining
+            self.reset_at = reset_at
+    
+    def status(self) -> Dict:
+        """Current budget and pacing delay, for the dashboard"""
+        with self._lock:
+            now = time.time()
+            waiting = self._waiting_until - now if self._waiting_until and self._waiting_until > now else 0.0
+            return {
+                "limit": self.limit,
+                "remaining": self.remaining,
+                "reset_at": datetime.utcfromtimestamp(self.reset_at) if self.reset_at else None,
+                "wait_seconds": round(waiting, 1)
+            }
+
+
+def rate_limit_metrics() -> List[str]:
+    """Metrics collector: the budget of the limiter in the newest rate-limit window (the token in use)"""
+    known = [limiter for limiter in list(_rate_limiters.values()) if limiter.reset_at is not None]
+    if not known:
+        return []
+    status = max(known, key=lambda limiter: limiter.reset_at).status()
+    lines = []
+    if status["limit"] is not None:
+        lines += gauge_lines("github_api_rate_limit", "Requests allowed per rate-limit window", [({}, status["limit"])])
+    if status["remaining"] is not None:
+        lines += gauge_lines("github_api_rate_limit_remaining", "Requests left in the current window", [({}, status["remaining"])])
+    lines += gauge_lines(
+        "github_api_rate_limit_reset_seconds", "Seconds until the rate-limit window resets",
+        [({}, max(0.0, round((status["reset_at"] - datetime.utcnow()).total_seconds(), 1)))]
+    )
+    lines += gauge_lines("github_api_pacing_wait_seconds", "Current pacing delay before the next request", [({}, status["wait_seconds"])])
+    return lines
+
+
+registry.add_collector(rate_limit_metrics)
+
+
+def parse_github_timestamp(value: Union[str, int, None]) -> Optional[datetime]:
+    """Convert a GitHub API timestamp (e.g. 2024-01-31T12:00:00Z) to a naive UTC datetime
+    
+    Push webhook payloads give repository timestamps as Unix seconds instead.
+    """
+    if not value:
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.utcfromtimestamp(value)
+    return datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
+
 class GitHubService:
-    def __init__(self, token: str):
+    def __init__(self, token: str, pool_size: Optional[int] = None, cache=None,
+                 listing_concurrency: int = DEFAULT_LISTING_CONCURRENCY, interactive: bool = False):
         self.token = token
-        self.base_url = "https://api.github.com"
+        self.base_url = GITHUB_API_URL
         self.headers = {
             "Authorization": f"token {token}",
             "Accept": "application/vnd.github.v3+json",
             "User-Agent": "GitHub-Backup-App/1.0"
         }
+        self.session = _get_shared_session(token, pool_size or DEFAULT_POOL_SIZE)
+        self.rate_limiter = _get_shared_rate_limiter(token)
+        # Optional persistent store of ETag/Last-Modified validators (see http_cache.py)
+        self.cache = cache
+        self.listing_concurrency = max(1, listing_concurrency)
+        # A user is waiting on the result: spend the reserve and fail fast on throttling instead of waiting
+        self.interactive = interactive
+        # Optional JobTrace; every API request made through this service is recorded as a span
+        self.trace = None
+    
+    def _get(self, url: str, headers: Optional[Dict] = None, paced: bool = True, **kwargs) -> requests.Response:
+        """GET through the shared session, pacing against the rate limit and waiting out throttling"""
+        request_headers = {**self.headers, **(headers or {})}
+        for attempt in range(MAX_RETRIES + 1):
+            if paced:
+                self.rate_limiter.acquire(interactive=self.interactive)
+            if self.trace is not None:
+                with self.trace.span("github", path=urlparse(url).path) as attrs:
+                    response = self.session.get(url, headers=request_headers, **kwargs)
+                    attrs["status"] = response.status_code
+            else:
+                response = self.session.get(url, headers=request_headers, **kwargs)
+            self.rate_limiter.update(response.headers)
+            if attempt == MAX_RETRIES or self.interactive:
+                return response
+            if self._is_primary_rate_limited(response):
+                # Budget exhausted; the limiter now knows, so the next acquire() waits for the reset
+                logger.warning(f"GitHub rate limit exhausted, waiting for reset ({url})")
+                continue
+            if not self._is_secondary_rate_limited(response):
+                return response
+            
+            retry_after = response.headers.get("Retry-After")
+            wait = int(retry_after) if retry_after and retry_after.isdigit() else SECONDARY_RATE_LIMIT_WAIT
+            logger.warning(f"GitHub secondary rate limit hit, retrying in {wait}s ({url})")
+            THROTTLED_SECONDS.inc(wait, reason="secondary")
+            time.sleep(wait)
+    
+    def _get_json(self, url: str, params: Optional[Dict] = None, timeout: int = 30):
+        """GET a JSON resource, revalidating against the response cache when one is configured
+        
+        Returns the decoded payload and the raw Link header (for pagination).
+        """
+        if not self.cache:
+            response = self._get(url, params=params, timeout=timeout)
+            response.raise_for_status()
+            return response.json(), response.headers.get("Link")
+        
+        cache_key = self._cache_key(url, params)
+        entry = self.cache.get(cache_key)
+        conditional_headers = {}
+        if entry:
+            if entry.get("etag"):
+                conditional_headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                conditional_headers["If-Modified-Since"] = entry["last_modified"]
+        
+        response = self._get(url, headers=conditional_headers, params=params, timeout=timeout)
+        if response.status_code == 304 and entry:
+            # Not modified: served from cache and not counted against the rate limit
+            return json.loads(entry["body"]), entry.get("link")
+        
+        response.raise_for_status()
+        if response.headers.get("ETag") or response.headers.get("Last-Modified"):
+            self.cache.set(
+                cache_key,
+                url=response.url,
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+                link=response.headers.get("Link"),
+                body=response.text
+            )
+        return response.json(), response.headers.get("Link")
+    
+    def _cache_key(self, url: str, params: Optional[Dict]) -> str:
+        """Cache entries are per token, since different tokens see different repositories"""
+        query = "&".join(f"{key}={value}" for key, value in sorted((params or {}).items()))
+        return hashlib.sha256(f"{self.token}\n{url}?{query}".encode()).hexdigest()
+    
+    def _is_primary_rate_limited(self, response: requests.Response) -> bool:
+        return response.status_code in (403, 429) and response.headers.get("X-RateLimit-Remaining") == "0"
+    
+    def _is_secondary_rate_limited(self, response: requests.Response) -> bool:
+        """Secondary (abuse) limits come back as 403/429 with Retry-After or an explanatory message"""
+        if response.status_code not in (403, 429):
+            return False
+        if "Retry-After" in response.headers:
+            return True
+        return "secondary rate limit" in response.text.lower()
     
     def test_connection(self) -> bool:
         """Test if the GitHub token is valid"""
         try:
-            response = requests.get(
+            response = self._get(
                 f"{self.base_url}/user",
-                headers=self.headers,
                 timeout=10
             )
             return response.status_code == 200
@@ -30,9 +307,8 @@ class GitHubService:
     def get_user_info(self) -> Optional[Dict]:
         """Get authenticated user information"""
         try:
-            response = requests.get(
+            response = self._get(
                 f"{self.base_url}/user",
-                headers=self.headers,
                 timeout=10
             )
             response.raise_for_status()
@@ -43,50 +319,47 @@ class GitHubService:
     
     def get_user_repositories(self) -> List[Dict]:
         """Get all repositories for the authenticated user"""
-        repositories = []
-        page = 1
-        per_page = 100
+        repositories = list(self.iter_user_repositories())
+        logger.info(f"Retrieved {len(repositories)} repositories from GitHub")
+        return repositories
+    
+    def iter_user_repositories(self) -> Iterator[Dict]:
+        """Yield the authenticated user's repositories in listing order as pages arrive
+        
+        Page one is fetched first; its Link rel="last" header tells us how many pages
+        remain, and those are fetched concurrently with at most listing_concurrency in
+        flight. Repositories are de-duplicated by full_name, since one created or renamed
+        mid-listing can shift others between pages.
+        """
+        url = f"{self.base_url}/user/repos"
+        seen = set()
         
         try:
-            while True:
-                response = requests.get(
-                    f"{self.base_url}/user/repos",
-                    headers=self.headers,
-                    params={
-                        "page": page,
-                        "per_page": per_page,
-                        "sort": "updated",
-                        "direction": "desc"
-                    },
-                    timeout=30
-                )
-                response.raise_for_status()
-                
-                repos = response.json()
-                if not repos:
-                    break
-                
-                for repo in repos:
-                    repositories.append({
-                        "name": repo["name"],
-                        "full_name": repo["full_name"],
-                        "clone_url": repo["clone_url"],
-                        "private": repo["private"],
-                        "description": repo.get("description", ""),
-                        "updated_at": repo["updated_at"],
-                        "size": repo["size"],
-                        "language": repo.get("language"),
-                        "default_branch": repo["default_branch"]
-                    })
-                
-                # Check if we've got all repositories
-                if len(repos) < per_page:
-                    break
-                
-                page += 1
+            repos, link = self._get_json(url, params=self._listing_params(1), timeout=30)
+            yield from self._unique_repositories(repos, seen)
+            
+            last_page = self._last_page(link)
+            if last_page is None:
+                # No pagination links: keep paging until a short page
+                page = 1
+                while len(repos) == LISTING_PER_PAGE:
+                    page += 1
+                    repos, _ = self._get_json(url, params=self._listing_params(page), timeout=30)
+                    yield from self._unique_repositories(repos, seen)
+                return
             
-            logger.info(f"Retrieved {len(repositories)} repositories from GitHub")
-            return repositories
+            with ThreadPoolExecutor(max_workers=self.listing_concurrency,
+                                    thread_name_prefix='github-listing') as executor:
+                in_flight = deque()
+                next_page = 2
+                while next_page <= last_page or in_flight:
+                    while next_page <= last_page and len(in_flight) < self.listing_concurrency:
+                        in_flight.append(executor.submit(
+                            self._get_json, url, params=self._listing_params(next_page), timeout=30
+                        ))
+                        next_page += 1
+                    repos, _ = in_flight.popleft().result()
+                    yield from self._unique_repositories(repos, seen)
         
         except requests.exceptions.RequestException as e:
             logger.error(f"Error fetching repositories: {str(e)}")
@@ -95,12 +368,51 @@ class GitHubService:
             logger.error(f"Unexpected error fetching repositories: {str(e)}")
             raise Exception(f"Unexpected error: {str(e)}")
     
+    def _listing_params(self, page: int) -> Dict:
+        return {
+            "page": page,
+            "per_page": LISTING_PER_PAGE,
+            # A stable order: sorted by update time, a repository pushed mid-listing would move
+            # to an already-fetched page and be missed, and every page before it would change
+            "sort": "full_name",
+            "direction": "asc"
+        }
+    
+    def _last_page(self, link: Optional[str]) -> Optional[int]:
+        """Page number of the Link rel="last" target, or None if the header is absent"""
+        if not link:
+            return None
+        for entry in requests.utils.parse_header_links(link):
+            if entry.get("rel") == "last":
+                query = parse_qs(urlparse(entry["url"]).query)
+                if "page" in query:
+                    return int(query["page"][0])
+        return None
+    
+    def _unique_repositories(self, repos: List[Dict], seen: set) -> Iterator[Dict]:
+        for repo in repos:
+            if repo["full_name"] in seen:
+                continue
+            seen.add(repo["full_name"])
+            yield {
+                "id": repo.get("id"),
+                "name": repo["name"],
+                "full_name": repo["full_name"],
+                "clone_url": repo["clone_url"],
+                "private": repo["private"],
+                "description": repo.get("description", ""),
+                "updated_at": repo["updated_at"],
+                "pushed_at": repo.get("pushed_at"),
+                "size": repo["size"],
+                "language": repo.get("language"),
+                "default_branch": repo["default_branch"]
+            }
+    
     def get_repository_details(self, full_name: str) -> Optional[Dict]:
         """Get detailed information about a specific repository"""
         try:
-            response = requests.get(
+            response = self._get(
                 f"{self.base_url}/repos/{full_name}",
-                headers=self.headers,
                 timeout=10
             )
             response.raise_for_status()
@@ -112,9 +424,8 @@ class GitHubService:
     def get_repository_branches(self, full_name: str) -> List[Dict]:
         """Get all branches for a repository"""
         try:
-            response = requests.get(
+            response = self._get(
                 f"{self.base_url}/repos/{full_name}/branches",
-                headers=self.headers,
                 timeout=10
             )
             response.raise_for_status()
@@ -126,13 +437,28 @@ class GitHubService:
     def get_rate_limit(self) -> Optional[Dict]:
         """Get current rate limit status"""
         try:
-            response = requests.get(
+            # /rate_limit does not count against the budget, so it is never held back
+            response = self._get(
                 f"{self.base_url}/rate_limit",
-                headers=self.headers,
+                paced=False,
                 timeout=10
             )
             response.raise_for_status()
-            return response.json()
+            data = response.json()
+            core = data.get("resources", {}).get("core")
+            if core:
+                self.rate_limiter.update({
+                    "X-RateLimit-Limit": core["limit"],
+                    "X-RateLimit-Remaining": core["remaining"],
+                    "X-RateLimit-Reset": core["reset"]
+                })
+            return data
         except Exception as e:
             logger.error(f"Error getting rate limit: {str(e)}")
             return None
+    
+    def get_rate_limit_status(self) -> Dict:
+        """Budget as tracked from response headers, querying /rate_limit if nothing is known yet"""
+        if self.rate_limiter.remaining is None:
+            self.get_rate_limit()
+        return self.rate_limiter.status()
@@ -0,0 +1,55 @@
+import logging
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from app import app, db
+from models import HttpCacheEntry
+
+logger = logging.getLogger(__name__)
+
+class DatabaseResponseCache:
+    """Persistent response cache for GitHubService, stored in the HttpCacheEntry table"""
+    
+    def get(self, cache_key):
+        """Return the cached validators and body for a key, or None"""
+        with app.app_context():
+            entry = HttpCacheEntry.query.filter_by(cache_key=cache_key).first()
+            if not entry:
+                return None
+            return {
+                "etag": entry.etag,
+                "last_modified": entry.last_modified,
+                "link": entry.link,
+                "body": entry.body
+            }
+    
+    def set(self, cache_key, url, etag, last_modified, link, body):
+        """Store or replace the cached response for a key"""
+        with app.app_context():
+            try:
+                self._upsert(cache_key, url, etag, last_modified, link, body)
+            except IntegrityError:
+                # Another worker inserted the same key first; overwrite its row instead
+                db.session.rollback()
+                self._upsert(cache_key, url, etag, last_modified, link, body)
+            except Exception as e:
+                db.session.rollback()
+                logger.warning(f"Could not store cached response for {url}: {str(e)}")
+    
+    def _upsert(self, cache_key, url, etag, last_modified, link, body):
+        entry = HttpCacheEntry.query.filter_by(cache_key=cache_key).first()
+        if not entry:
+            entry = HttpCacheEntry(cache_key=cache_key)
+            db.session.add(entry)
+        entry.url = url
+        entry.etag = etag
+        entry.last_modified = last_modified
+        entry.link = link
+        entry.body = body
+        entry.updated_at = datetime.utcnow()
+        db.session.commit()
+    
+    def clear(self):
+        """Drop every cached response"""
+        with app.app_context():
+            HttpCacheEntry.query.delete()
+            db.session.commit()
@@ -0,0 +1,169 @@
+import os
+import struct
+import logging
+import subprocess
+import tarfile
+import zipfile
+import zlib
+
+from archive_service import StreamBuffer, list_tree
+from snapshot_store import SnapshotStore
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+ZIP_FORMATS = ('zip', 'zip-store')
+
+# Fixed part of a zip local file header; the file name and extra field lengths are the last two fields
+LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+
+class BackupIndexService:
+    """Content index of a backup (path, size, offset, checksum) and extraction of single files
+    
+    Zip members are read straight from their recorded offset, so getting one file costs a
+    seek and the decompression of that file alone. Compressed tar streams cannot be seeked
+    into and are scanned up to the requested members; deduplicated snapshots read the
+    file's chunks from the store.
+    """
+    
+    def build(self, job, git_dir=None, treeish=None):
+        """Index rows for a finished snapshot or deduplicated backup (bundles have no file tree)"""
+        if job.backup_kind == 'dedup':
+            entries = SnapshotStore.for_manifest(job.backup_file_path).load_manifest(job.backup_file_path)['files']
+        elif job.backup_kind == 'snapshot':
+            entries = list_tree(git_dir, treeish)
+        else:
+            return []
+        
+        members = {}
+        if job.backup_kind == 'snapshot' and job.archive_format in ZIP_FORMATS:
+            with zipfile.ZipFile(job.backup_file_path) as archive:  # Reads only the central directory
+                members = {info.filename: info for info in archive.infolist()}
+        
+        rows = []
+        for entry in entries:
+            info = members.get(entry['path'])
+            rows.append({
+                'job_id': job.id,
+                'path': entry['path'],
+                'directory': os.path.dirname(entry['path']),
+                'mode': entry['mode'],
+                'size': entry['size'],
+                'blob': entry['blob'],
+                'offset': info.header_offset if info else None,
+                'compressed_size': info.compress_size if info else None,
+                'compress_type': info.compress_type if info else None
+            })
+        return rows
+    
+    def listing(self, files, subdirectories, path):
+        """Directory entries for one level of the tree, folders first"""
+        prefix = f"{path}/" if path else ''
+        names = sorted({directory[len(prefix):].split('/', 1)[0] for directory in subdirectories})
+        entries = [{'name': name, 'path': prefix + name, 'type': 'dir'} for name in names]
+        for entry in sorted(files, key=lambda entry: entry.path):
+            entries.append({
+                'name': os.path.basename(entry.path),
+                'path': entry.path,
+                'type': 'symlink' if entry.mode == '120000' else 'file',
+                'size': entry.size,
+                'blob': entry.blob
+            })
+        return entries
+    
+    def read_files(self, job, entries):
+        """Yield (entry, chunks) for each index entry, in archive order for tar scans
+        
+        Each chunk iterator must be consumed before advancing to the next file.
+        """
+        entries = list(entries)
+        if job.backup_kind == 'dedup':
+            store = SnapshotStore.for_manifest(job.backup_file_path)
+            chunks_by_path = {
+                entry['path']: entry['chunks']
+                for entry in store.load_manifest(job.backup_file_path)['files']
+            }
+            for entry in entries:
+                yield entry, store.read_chunks(chunks_by_path[entry.path])
+        elif job.archive_format in ZIP_FORMATS:
+            with open(job.backup_file_path, 'rb') as archive_file:
+                for entry in entries:
+                    if entry.offset is None:
+                        yield entry, self._read_zip_by_name(job.backup_file_path, entry.path)
+                    else:
+                        yield entry, self._read_zip_member(archive_file, entry)
+        else:
+            yield from self._scan_tar(job, entries)
+    
+    def read_file(self, job, entry):
+        """Yield the contents of a single indexed file"""
+        for _, chunks in self.read_files(job, [entry]):
+            yield from chunks
+    
+    def stream_zip(self, job, entries):
+        """Yield a zip archive of the given entries, built on the fly"""
+        buffer = StreamBuffer()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for entry, chunks in self.read_files(job, entries):
+                info = zipfile.ZipInfo(entry.path)
+                info.compress_type = zipfile.ZIP_DEFLATED
+                info.file_size = entry.size
+                info.external_attr = int(entry.mode, 8) << 16
+                with archive.open(info, 'w') as member:
+                    for data in chunks:
+                        member.write(data)
+                        yield buffer.take()
+                yield buffer.take()
+        yield buffer.take()
+    
+    def _read_zip_member(self, archive_file, entry):
+        archive_file.seek(entry.offset)
+        header = LOCAL_HEADER.unpack(archive_file.read(LOCAL_HEADER.size))
+        if header[0] != LOCAL_HEADER_SIGNATURE:
+            raise Exception(f"Backup index is out of date: no zip member at offset {entry.offset}")
+        archive_file.seek(header[-2] + header[-1], os.SEEK_CUR)  # Skip file name and extra field
+        
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS) if entry.compress_type == zipfile.ZIP_DEFLATED else None
+        remaining = entry.compressed_size
+        while remaining > 0:
+            data = archive_file.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                raise Exception("Unexpected end of zip archive")
+            remaining -= len(data)
+            yield decompressor.decompress(data) if decompressor else data
+        if decompressor:
+            yield decompressor.flush()
+    
+    def _read_zip_by_name(self, archive_path, path):
+        """Fallback for members whose names could not be matched when the index was built"""
+        with zipfile.ZipFile(archive_path) as archive:
+            with archive.open(path) as member:
+                yield from iter(lambda: member.read(CHUNK_SIZE), b'')
+    
+    def _scan_tar(self, job, entries):
+        wanted = {entry.path: entry for entry in entries}
+        process = None
+        if job.archive_format == 'tar.zst':
+            process = subprocess.Popen(['zstd', '-q', '-d', '-c', job.backup_file_path], stdout=subprocess.PIPE)
+            stream, mode = process.stdout, 'r|'
+        else:
+            stream, mode = open(job.backup_file_path, 'rb'), 'r|gz'
+        try:
+            with tarfile.open(fileobj=stream, mode=mode) as archive:
+                for member in archive:
+                    entry = wanted.pop(member.name, None)
+                    if entry is None:
+                        continue
+                    if member.issym():
+                        yield entry, iter([member.linkname.encode('utf-8', errors='surrogateescape')])
+                    else:
+                        member_file = archive.extractfile(member)
+                        yield entry, iter(lambda: member_file.read(CHUNK_SIZE), b'')
+                    if not wanted:
+                        break  # Stop decompressing as soon as everything requested was found
+        finally:
+            stream.close()
+            if process is not None:
+                process.kill()
+                process.wait()
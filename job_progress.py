@@ -0,0 +1,89 @@
+import re
+import time
+import logging
+import subprocess
+from datetime import datetime
+from sqlalchemy import update
+from app import app, db
+from models import BackupJob
+
+logger = logging.getLogger(__name__)
+
+# Progress rows are written at most this often per job, so a fast loop never floods the database
+PROGRESS_INTERVAL = 1.0
+PROGRESS_FIELDS = ('bytes_received', 'files_archived', 'compressed_bytes')
+
+# "Receiving objects:  42% (420/1000), 12.34 MiB | 3.21 MiB/s" from `git fetch/clone --progress`
+GIT_RECEIVED_PATTERN = re.compile(rb'Receiving objects:.*?([\d.]+) (bytes|KiB|MiB|GiB)')
+GIT_UNITS = {b'bytes': 1, b'KiB': 1024, b'MiB': 1024 ** 2, b'GiB': 1024 ** 3}
+
+class JobProgress:
+    """Throttled progress reporting for one running BackupJob
+    
+    Updates go through their own short-lived session, so reporting never commits (or
+    waits on) the backup's own transaction.
+    """
+    
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._pending = {}
+        self._last_write = 0.0
+        self.latest = {}  # Most recent value of every counter, written or not
+    
+    def phase(self, name):
+        """Enter a new phase; written immediately"""
+        self._pending['phase'] = name
+        self.flush()
+    
+    def update(self, **counters):
+        """Record counter values (see PROGRESS_FIELDS); written at most every PROGRESS_INTERVAL"""
+        self._pending.update(counters)
+        self.latest.update(counters)
+        if time.monotonic() - self._last_write >= PROGRESS_INTERVAL:
+            self.flush()
+    
+    def flush(self):
+        if not self._pending:
+            return
+        values, self._pending = self._pending, {}
+        self._last_write = time.monotonic()
+        try:
+            with app.app_context():
+                db.session.execute(
+                    update(BackupJob).where(BackupJob.id == self.job_id)
+                    .values(updated_at=datetime.utcnow(), **values)
+                )
+                db.session.commit()
+        except Exception as e:
+            # Progress is informational; never fail a backup because it could not be recorded
+            logger.debug(f"Could not record progress for job {self.job_id}: {str(e)}")
+
+
+def run_git_with_progress(command, on_bytes_received=None):
+    """Run a git clone/fetch with --progress, reporting bytes received as they arrive
+
+    Behaves like subprocess.run(check=True): raises CalledProcessError with the text of
+    stderr (without progress meter lines) if git fails.
+    """
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    messages = []
+    buffer = b''
+    try:
+        for data in iter(lambda: process.stderr.read1(4096), b''):
+            buffer += data
+            # Progress meters redraw with \r; messages end with \n
+            *lines, buffer = re.split(rb'[\r\n]', buffer)
+            for line in lines:
+                match = GIT_RECEIVED_PATTERN.search(line)
+                if match:
+                    if on_bytes_received:
+                        on_bytes_received(int(float(match.group(1)) * GIT_UNITS[match.group(2)]))
+                elif line.strip() and b'%' not in line:
+                    messages.append(line)
+        messages.append(buffer)
+    finally:
+        process.stderr.close()
+        returncode = process.wait()
+    if returncode != 0:
+        stderr = b'\n'.join(line for line in messages if line.strip()).decode('utf-8', errors='replace')
+        raise subprocess.CalledProcessError(returncode, command, stderr=stderr)
@@ -0,0 +1,85 @@
+import io
+import json
+import time
+import pstats
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+MAX_SPANS = 500  # Per trace; a huge listing would otherwise store one span per API page
+PROFILE_DIRNAME = '.profiles'  # Inside backup_path, next to the mirrors
+PROFILE_SUMMARY_LINES = 30
+
+class JobTrace:
+    """Timed spans (name, offset, duration, attributes) of one backup job or sweep
+    
+    Spans may be recorded from several threads (e.g. concurrent listing pages) and are
+    stored on the BackupJob as JSON for the status page's timeline.
+    """
+    
+    def __init__(self):
+        self.started_at = datetime.utcnow()
+        self._origin = time.perf_counter()
+        self._spans = []
+        self._dropped = 0
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def span(self, name, **attrs):
+        """Time the block; yields the attribute dict so byte counts can be added as they become known"""
+        start = time.perf_counter()
+        try:
+            yield attrs
+        except Exception as e:
+            attrs['error'] = str(e)[:200]
+            raise
+        finally:
+            self.add(name, start - self._origin, time.perf_counter() - start, **attrs)
+    
+    def add(self, name, start, duration, **attrs):
+        """Record a span measured elsewhere; start is seconds since the trace began"""
+        with self._lock:
+            if len(self._spans) >= MAX_SPANS:
+                self._dropped += 1
+                return
+            self._spans.append({
+                'name': name,
+                'start': round(start, 4),
+                'duration': round(duration, 4),
+                **({'attrs': attrs} if attrs else {})
+            })
+    
+    def to_json(self):
+        with self._lock:
+            spans = sorted(self._spans, key=lambda span: span['start'])
+            dropped = self._dropped
+        return json.dumps({
+            'started_at': self.started_at.isoformat(),
+            'spans': spans,
+            **({'dropped': dropped} if dropped else {})
+        })
+
+
+def timeline(spans_json):
+    """Spans of a stored trace with offsets and widths as percentages of the job, for drawing bars"""
+    if not spans_json:
+        return None
+    trace = json.loads(spans_json)
+    spans = trace.get('spans', [])
+    total = max((span['start'] + span['duration'] for span in spans), default=0) or 1
+    for span in spans:
+        span['offset_pct'] = round(100 * span['start'] / total, 2)
+        # Keep instantaneous spans visible
+        span['width_pct'] = max(0.3, round(100 * span['duration'] / total, 2))
+    return {'total': total, 'spans': spans, 'dropped': trace.get('dropped', 0)}
+
+
+def profile_summary(profile_path, limit=PROFILE_SUMMARY_LINES):
+    """Top functions by cumulative time from a saved cProfile file, as text"""
+    output = io.StringIO()
+    stats = pstats.Stats(profile_path, stream=output)
+    stats.strip_dirs().sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+    return output.getvalue()
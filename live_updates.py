@@ -0,0 +1,71 @@
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_HISTORY = 60  # Polls kept for subscribers that fall behind (e.g. a slow client)
+
+class PollingBroadcaster:
+    """One poller per process whose results are shared by every subscriber
+    
+    poll(cursor) returns a payload dict including the 'cursor' to pass to the next call.
+    The poller thread only runs while someone is subscribed, so the database is queried
+    once per interval however many live streams are open.
+    """
+    
+    def __init__(self, poll, interval, history=BROADCAST_HISTORY):
+        self.poll = poll
+        self.interval = interval
+        self._history = deque(maxlen=history)  # (sequence, payload), oldest first
+        self._sequence = 0
+        self._subscribers = 0
+        self._thread = None
+        self._condition = threading.Condition()
+    
+    @contextmanager
+    def subscription(self):
+        """Keep the poller running for the duration of the block; yields the current sequence number"""
+        with self._condition:
+            self._subscribers += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='live-updates-poller', daemon=True)
+                self._thread.start()
+            sequence = self._sequence
+        try:
+            yield sequence
+        finally:
+            with self._condition:
+                self._subscribers -= 1
+    
+    def wait(self, sequence, timeout):
+        """Payloads published after sequence, waiting up to timeout for the first; returns (sequence, payloads)
+        
+        payloads is None when the subscriber fell further behind than the history reaches.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._sequence != sequence, timeout)
+            if self._sequence - sequence > len(self._history):
+                return self._sequence, None
+            return self._sequence, [payload for published, payload in self._history if published > sequence]
+    
+    def _run(self):
+        cursor = None
+        while True:
+            with self._condition:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            try:
+                payload = self.poll(cursor)
+                cursor = payload['cursor']
+            except Exception as e:
+                logger.error(f"Live update poll failed: {str(e)}")
+            else:
+                with self._condition:
+                    self._sequence += 1
+                    self._history.append((self._sequence, payload))
+                    self._condition.notify_all()
+            time.sleep(self.interval)
@@ -0,0 +1,223 @@
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+BYTES_BUCKETS = tuple(1024 ** 2 * size for size in (0.1, 1, 10, 50, 100, 500, 1024, 5 * 1024, 20 * 1024))
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class _Metric:
+    """A named metric with optional labels; each label combination is its own series"""
+    
+    kind = None
+    
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series = {}
+    
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+    
+    def _format_labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = sorted(self._series.items())
+        for key, value in series:
+            lines.extend(self._render_series(key, value))
+        return lines
+    
+    def _render_series(self, key, value):
+        return [f"{self.name}{self._format_labels(key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+    
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+    
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+    
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+    
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram; observing is a bisect and two additions under a lock"""
+    
+    kind = 'histogram'
+    
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+    
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts (plus +Inf), sum
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+    
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of the block, including when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = sorted((key, (list(counts), total)) for key, (counts, total) in self._series.items())
+        for key, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                lines.append(f"{self.name}_bucket{self._format_labels(key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Process-wide metrics, rendered in the Prometheus text exposition format
+    
+    Collectors are callables run at scrape time for values that are cheaper to read on
+    demand (queue depth, rate-limit budget) than to keep up to date; they return lines
+    of exposition text.
+    """
+    
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+    
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+    
+    def add_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+    
+    def render(self):
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                # A failing collector must not take the whole scrape down with it
+                logger.warning(f"Metrics collector {getattr(collector, '__name__', collector)} failed: {str(e)}")
+        return '\n'.join(lines) + '\n'
+
+
+def serve(port, host=''):
+    """Expose the registry on its own HTTP port, for processes without the web app (worker.py)"""
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, format, *args):
+            pass  # Scrapes every few seconds would drown the worker's log
+    
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
+
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+
+def gauge_lines(name, documentation, samples):
+    """Exposition lines for a gauge computed by a collector; samples are (labels dict, value)"""
+    metric = Gauge(name, documentation, labelnames=sorted(samples[0][0]) if samples else ())
+    for labels, value in samples:
+        metric.set(value, **labels)
+    return metric.render()
+
+
+registry = Registry()
+
+PHASE_DURATION = registry.register(Histogram(
+    'github_backup_phase_duration_seconds',
+    'Time spent in each backup pipeline phase (listing, disk_wait, clone_wait, fetch, archive_wait, archive, index, retention)',
+    labelnames=('phase',)
+))
+FETCHED_BYTES = registry.register(Histogram(
+    'github_backup_fetched_bytes',
+    'Bytes received from GitHub per clone or fetch, as reported by git',
+    buckets=BYTES_BUCKETS
+))
+WRITTEN_BYTES = registry.register(Histogram(
+    'github_backup_written_bytes',
+    'Bytes written per backup (archive or bundle size, or new bytes added to the snapshot store)',
+    labelnames=('mode',),
+    buckets=BYTES_BUCKETS
+))
+JOBS = registry.register(Counter(
+    'github_backup_jobs_total',
+    'Finished repository backups by outcome; rate() of this gives repositories per second',
+    labelnames=('status',)
+))
+BACKUPS_IN_PROGRESS = registry.register(Gauge(
+    'github_backup_in_progress',
+    'Repository backups currently running in this process'
+))
+BACKUPS_IN_PROGRESS.set(0)
@@ -10,32 +10,141 @@ class BackupConfig(db.Model):
     max_backups = db.Column(db.Integer, default=5)
     schedule_enabled = db.Column(db.Boolean, default=False)
     schedule_cron = db.Column(db.String(64), default='0 2 * * *')  # Daily at 2 AM
+    schedule_mode = db.Column(db.String(16), default='sweep')  # sweep (all at schedule_cron) or staggered (per repository)
+    schedule_window_start = db.Column(db.Integer, default=1)  # Staggered mode: UTC hour the daily window opens
+    schedule_window_hours = db.Column(db.Integer, default=6)  # Staggered mode: length of the daily window
     auto_sync_enabled = db.Column(db.Boolean, default=True)  # Auto-sync new repositories
+    max_workers = db.Column(db.Integer, default=1)  # Repositories backed up in parallel (1 = sequential)
+    max_clone_workers = db.Column(db.Integer, default=4)  # Concurrent git network operations
+    max_archive_workers = db.Column(db.Integer, default=2)  # Concurrent archive compressions
+    api_pool_size = db.Column(db.Integer, default=10)  # Keep-alive connections to the GitHub API
+    archive_format = db.Column(db.String(32), default='zip')  # zip, zip-store, tar.gz, tar.zst
+    compression_level = db.Column(db.Integer)  # None uses the format's default level
+    compression_threads = db.Column(db.Integer, default=0)  # zstd threads; 0 = all cores
+    backup_mode = db.Column(db.String(32), default='snapshot')  # snapshot (archive of HEAD), bundle (full history) or dedup
+    bundle_full_every = db.Column(db.Integer, default=7)  # Incremental bundles before a new full bundle
+    skip_unchanged = db.Column(db.Boolean, default=False)  # Skip repositories with no pushes since last backup
+    min_free_space_mb = db.Column(db.Integer, default=1024)  # Backups wait rather than leave less free disk than this; 0 = no check
+    webhook_secret = db.Column(db.String(256))  # Secret of the GitHub webhook; deliveries are rejected without it
+    profile_repositories = db.Column(db.String(512))  # Space-separated full_name patterns to run under cProfile ('*' = all)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class Repository(db.Model):
     """GitHub repositories to backup"""
     id = db.Column(db.Integer, primary_key=True)
+    github_id = db.Column(db.BigInteger, index=True)  # Stable across renames
     name = db.Column(db.String(256), nullable=False)
-    full_name = db.Column(db.String(512), nullable=False)
+    full_name = db.Column(db.String(512), unique=True, nullable=False)
     clone_url = db.Column(db.String(512), nullable=False)
+    size = db.Column(db.Integer)  # Size in KB as reported by GitHub
+    default_branch = db.Column(db.String(256))
     enabled = db.Column(db.Boolean, default=True)
+    missing_upstream = db.Column(db.Boolean, default=False)  # No longer returned by the GitHub listing
     last_backup = db.Column(db.DateTime)
+    pushed_at = db.Column(db.DateTime)  # Latest push time reported by the GitHub listing
+    last_backup_sha = db.Column(db.String(64))  # HEAD commit captured by the last successful backup
+    last_backup_pushed_at = db.Column(db.DateTime)  # pushed_at as known when the last backup ran
+    schedule_tier = db.Column(db.String(16))  # Staggered mode: hourly, daily or weekly; None picks one from pushed_at
+    next_backup_at = db.Column(db.DateTime, index=True)  # Staggered mode: next slot
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class BackupJob(db.Model):
     """Backup job history and status"""
     id = db.Column(db.Integer, primary_key=True)
     repository_id = db.Column(db.Integer, db.ForeignKey('repository.id'), nullable=True)
-    status = db.Column(db.String(32), default='pending')  # pending, running, completed, failed
-    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    status = db.Column(db.String(32), default='pending')  # pending, running, completed, failed, skipped
+    started_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # Dashboard/status sort key
     completed_at = db.Column(db.DateTime)
     error_message = db.Column(Text)
     backup_file_path = db.Column(db.String(512))
+    archive_format = db.Column(db.String(32))  # Format the archive was written in
+    backup_kind = db.Column(db.String(32))  # snapshot, bundle-full, bundle-incremental, dedup
+    parent_job_id = db.Column(db.Integer, db.ForeignKey('backup_job.id'), nullable=True)  # Previous bundle in the chain
+    refs = db.Column(Text)  # JSON map of ref name to commit captured by a bundle
     file_size = db.Column(db.BigInteger)
+    checksum = db.Column(db.String(64))  # sha256 of the backup file, served as a strong ETag
+    
+    # Live progress while running (see JobProgress); updated_at drives the dashboard's delta feed
+    phase = db.Column(db.String(32))  # fetching, archiving, bundling, storing, indexing, done
+    bytes_received = db.Column(db.BigInteger)
+    files_archived = db.Column(db.Integer)
+    compressed_bytes = db.Column(db.BigInteger)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    
+    spans = db.Column(Text)  # JSON trace of the job's phases (see JobTrace)
+    profile_path = db.Column(db.String(512))  # cProfile output, when the repository was selected for profiling
     
     repository = db.relationship('Repository', backref='backup_jobs')
+    
+    __table_args__ = (
+        # Retention ranks each repository's jobs by completion time within a status
+        db.Index('ix_backup_job_repository_status_completed', 'repository_id', 'status', 'completed_at'),
+    )
+
+class BackupRequest(db.Model):
+    """A request to back up one, several or all repositories; its id is the handle given to the caller"""
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    source = db.Column(db.String(32), default='manual')  # manual, schedule or webhook
+    merged_item_ids = db.Column(Text)  # JSON list of already-queued items this request was merged into
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class BackupQueueItem(db.Model):
+    """Persistent work queue entry: one repository to back up, or a sweep to expand into many"""
+    id = db.Column(db.Integer, primary_key=True)
+    request_id = db.Column(db.String(32), db.ForeignKey('backup_request.id'), nullable=False, index=True)
+    repository_id = db.Column(db.Integer, db.ForeignKey('repository.id'), nullable=True)  # None: sweep of all enabled repositories
+    status = db.Column(db.String(32), nullable=False, default='queued')  # queued, running, completed, failed
+    listing_synced = db.Column(db.Boolean, default=False)  # Queued right after a repository sync
+    job_id = db.Column(db.Integer)  # BackupJob that ran this item; retention may since have removed it
+    error_message = db.Column(Text)
+    worker_id = db.Column(db.String(128))  # Worker holding the lease while running
+    lease_expires_at = db.Column(db.DateTime)  # Renewed by the worker; an expired lease is reclaimed
+    run_after = db.Column(db.DateTime)  # Debounced items are not claimed before this
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    repository = db.relationship('Repository')
+    
+    __table_args__ = (
+        # Workers claim the oldest queued item
+        db.Index('ix_backup_queue_item_status_created', 'status', 'created_at'),
+        # At most one queued entry per repository; duplicate requests merge into it
+        db.Index(
+            'uq_backup_queue_item_queued_repository', 'repository_id', unique=True,
+            sqlite_where=db.text("status = 'queued'"), postgresql_where=db.text("status = 'queued'")
+        ),
+    )
+
+class WorkerLease(db.Model):
+    """Named, time-limited lease so only one worker across all hosts runs a singleton task"""
+    name = db.Column(db.String(64), primary_key=True)
+    worker_id = db.Column(db.String(128), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+class BackupFileEntry(db.Model):
+    """One file in a backup's content index, for browsing and single-file extraction"""
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('backup_job.id'), nullable=False)
+    path = db.Column(Text, nullable=False)
+    directory = db.Column(Text, nullable=False, default='')  # Parent directory of path, '' at the root
+    mode = db.Column(db.String(8))
+    size = db.Column(db.BigInteger)
+    blob = db.Column(db.String(64))  # git blob id, a checksum of the file contents
+    offset = db.Column(db.BigInteger)  # Local header offset within a zip archive
+    compressed_size = db.Column(db.BigInteger)
+    compress_type = db.Column(db.Integer)  # zipfile compression method
+    
+    __table_args__ = (
+        db.Index('ix_backup_file_entry_job_path', 'job_id', 'path'),
+        db.Index('ix_backup_file_entry_job_directory', 'job_id', 'directory'),
+    )
+
+class SnapshotObject(db.Model):
+    """Reference count of a chunk in the deduplicating snapshot store"""
+    chunk_id = db.Column(db.String(64), primary_key=True)  # sha256 of the chunk contents
+    refcount = db.Column(db.Integer, nullable=False, default=0)
 
 class AppSettings(db.Model):
     """General application settings"""
@@ -44,3 +153,14 @@ class AppSettings(db.Model):
     value = db.Column(Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class HttpCacheEntry(db.Model):
+    """Cached GitHub API responses for conditional (ETag/Last-Modified) requests"""
+    id = db.Column(db.Integer, primary_key=True)
+    cache_key = db.Column(db.String(64), unique=True, nullable=False)  # sha256 of token + URL
+    url = db.Column(db.String(1024), nullable=False)
+    etag = db.Column(db.String(256))
+    last_modified = db.Column(db.String(64))
+    link = db.Column(Text)  # Link header, needed to paginate from a cached page
+    body = db.Column(Text, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,503 @@
+import os
+import json
+import uuid
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import delete, exists, insert, or_, select, update
+from sqlalchemy.orm import aliased
+from sqlalchemy.exc import IntegrityError
+from app import app, db
+from models import BackupConfig, BackupJob, BackupQueueItem, BackupRequest, Repository, WorkerLease
+from backup_service import BackupService
+from metrics import gauge_lines, registry
+
+logger = logging.getLogger(__name__)
+
+QUEUE_POLL_INTERVAL = 5  # Seconds an idle worker waits before re-checking; new work wakes it at once
+QUEUE_HISTORY_DAYS = 7  # Finished queue items are kept this long for request status lookups
+FINISHED_QUEUE_STATUSES = ('completed', 'failed')
+
+# A running item's lease is renewed every LEASE_RENEW_INTERVAL; one not renewed for
+# LEASE_DURATION belongs to a dead worker and is handed to another
+LEASE_DURATION = timedelta(seconds=90)
+LEASE_RENEW_INTERVAL = 30
+MAINTENANCE_LEASE = 'maintenance'
+MAINTENANCE_LEASE_DURATION = timedelta(hours=1)
+
+# A debounced item is postponed by each request merged into it, but never past this long after it was queued
+DEBOUNCE_MAX_DELAY = timedelta(minutes=10)
+
+class BackupQueueService:
+    """Persistent queue of backup work, shared by the web process and the background workers"""
+    
+    def enqueue(self, repository_ids=None, source='manual', listing_synced=False, delay=None):
+        """Queue backups and return the request handle
+        
+        With repository_ids=None a single sweep item is queued; the worker that claims it
+        syncs the repository list and queues every enabled repository. Repositories that
+        already have a queued item are merged into it instead of being queued twice.
+        listing_synced says the repositories' pushed_at values were refreshed just now.
+        
+        With a delay (timedelta) the items are debounced: they are not claimed before the
+        delay has passed, and another delayed request for the same repository in the
+        meantime pushes the start back instead of adding a second backup.
+        """
+        with app.app_context():
+            if not BackupConfig.query.first():
+                raise Exception("No backup configuration found")
+            
+            backup_request = BackupRequest(id=uuid.uuid4().hex, source=source)
+            db.session.add(backup_request)
+            db.session.commit()
+            
+            targets = [None] if repository_ids is None else list(dict.fromkeys(repository_ids))
+            run_after = datetime.utcnow() + delay if delay else None
+            merged = self._add_items(backup_request.id, targets, listing_synced, run_after)
+            if merged:
+                backup_request.merged_item_ids = json.dumps(merged)
+                db.session.commit()
+            request_id = backup_request.id
+        
+        worker_pool.wake()
+        logger.info(f"Queued backup request {request_id} ({'all repositories' if repository_ids is None else f'{len(targets)} repositories'})")
+        return request_id
+    
+    def _add_items(self, request_id, repository_ids, listing_synced=False, run_after=None):
+        """Insert queue items for repositories without one already queued; return the ids merged into"""
+        targets = [BackupQueueItem.repository_id.in_([rid for rid in repository_ids if rid is not None])]
+        if None in repository_ids:
+            targets.append(BackupQueueItem.repository_id.is_(None))
+        queued = dict(db.session.execute(
+            select(BackupQueueItem.repository_id, BackupQueueItem.id).where(
+                BackupQueueItem.status == 'queued', or_(*targets)
+            )
+        ).all())
+        rows = [
+            {'request_id': request_id, 'repository_id': repository_id, 'status': 'queued',
+             'listing_synced': listing_synced, 'run_after': run_after, 'created_at': datetime.utcnow()}
+            for repository_id in repository_ids if repository_id not in queued
+        ]
+        if rows:
+            try:
+                db.session.execute(insert(BackupQueueItem), rows)
+                db.session.commit()
+            except IntegrityError:
+                # A concurrent request queued one of these first; fall back to one row at a time
+                db.session.rollback()
+                for row in rows:
+                    try:
+                        db.session.execute(insert(BackupQueueItem), [row])
+                        db.session.commit()
+                    except IntegrityError:
+                        db.session.rollback()
+                        queued[row['repository_id']] = db.session.execute(
+                            select(BackupQueueItem.id).where(
+                                BackupQueueItem.repository_id == row['repository_id'],
+                                BackupQueueItem.status == 'queued'
+                            )
+                        ).scalar()
+        merged = [item_id for item_id in queued.values() if item_id is not None]
+        if merged and run_after:
+            self._postpone(merged, run_after)
+        elif merged:
+            # An immediate request makes a debounced item due now
+            db.session.execute(
+                update(BackupQueueItem)
+                .where(BackupQueueItem.id.in_(merged), BackupQueueItem.status == 'queued',
+                       BackupQueueItem.run_after.isnot(None))
+                .values(run_after=None)
+            )
+            db.session.commit()
+        return merged
+    
+    def _postpone(self, item_ids, run_after):
+        """Move debounced items back to run_after, within DEBOUNCE_MAX_DELAY of when each was queued"""
+        # Items queued without a delay stay due; a debounce never holds up a manual or scheduled backup
+        pending = db.session.execute(
+            select(BackupQueueItem.id, BackupQueueItem.created_at).where(
+                BackupQueueItem.id.in_(item_ids),
+                BackupQueueItem.status == 'queued',
+                BackupQueueItem.run_after.isnot(None)
+            )
+        ).all()
+        for item_id, created_at in pending:
+            db.session.execute(
+                update(BackupQueueItem)
+                .where(BackupQueueItem.id == item_id, BackupQueueItem.status == 'queued')
+                .values(run_after=min(run_after, created_at + DEBOUNCE_MAX_DELAY))
+            )
+        db.session.commit()
+    
+    def claim_next(self, worker_id):
+        """Lease the oldest runnable item to worker_id and return its id, or None
+        
+        Items whose repository is already being backed up wait, so one mirror is never
+        updated by two workers at once, and debounced items wait for their run_after. On PostgreSQL candidates are picked with
+        FOR UPDATE SKIP LOCKED so concurrent workers never contend for the same row;
+        elsewhere the conditional update alone decides which worker wins.
+        """
+        running = aliased(BackupQueueItem)
+        with app.app_context():
+            try:
+                candidate = select(BackupQueueItem.id).where(
+                    BackupQueueItem.status == 'queued',
+                    or_(BackupQueueItem.run_after.is_(None), BackupQueueItem.run_after <= datetime.utcnow()),
+                    ~exists().where(
+                        running.status == 'running',
+                        running.repository_id == BackupQueueItem.repository_id
+                    )
+                ).order_by(BackupQueueItem.created_at, BackupQueueItem.id).limit(1)
+                if db.engine.dialect.name == 'postgresql':
+                    candidate = candidate.with_for_update(skip_locked=True)
+                
+                for _ in range(5):
+                    item_id = db.session.execute(candidate).scalar()
+                    if item_id is None:
+                        db.session.commit()
+                        return None
+                    
+                    now = datetime.utcnow()
+                    claimed = db.session.execute(
+                        update(BackupQueueItem)
+                        .where(BackupQueueItem.id == item_id, BackupQueueItem.status == 'queued')
+                        .values(status='running', worker_id=worker_id, started_at=now,
+                                lease_expires_at=now + LEASE_DURATION)
+                    ).rowcount
+                    db.session.commit()
+                    if claimed:
+                        return item_id
+                return None
+            finally:
+                db.session.remove()
+    
+    def renew_lease(self, item_id, worker_id):
+        """Extend a running item's lease; False if the lease was lost to another worker"""
+        with app.app_context():
+            try:
+                renewed = db.session.execute(
+                    update(BackupQueueItem)
+                    .where(BackupQueueItem.id == item_id, BackupQueueItem.status == 'running',
+                           BackupQueueItem.worker_id == worker_id)
+                    .values(lease_expires_at=datetime.utcnow() + LEASE_DURATION)
+                ).rowcount
+                db.session.commit()
+                return bool(renewed)
+            finally:
+                db.session.remove()
+    
+    def run_item(self, item_id, worker_id):
+        """Run a leased item (expand a sweep, or back up one repository) while renewing its lease"""
+        heartbeat = _LeaseHeartbeat(self, item_id, worker_id)
+        heartbeat.start()
+        with app.app_context():
+            try:
+                item = db.session.get(BackupQueueItem, item_id)
+                result = {'status': 'completed', 'job_id': None, 'error_message': None}
+                service = BackupService()
+                try:
+                    if item.repository_id is None:
+                        self._expand_sweep(item, service)
+                    else:
+                        repository = db.session.get(Repository, item.repository_id)
+                        if repository is None:
+                            raise Exception(f"Repository id {item.repository_id} no longer exists")
+                        result['job_id'] = service.backup_repository(repository, listing_fresh=item.listing_synced)
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Queue item {item_id} failed: {str(e)}")
+                    result.update(status='failed', error_message=str(e))
+                finally:
+                    heartbeat.stop()
+                
+                # Only the lease holder may finish the item; if the lease was reclaimed, the new holder's run counts
+                finished = db.session.execute(
+                    update(BackupQueueItem)
+                    .where(BackupQueueItem.id == item_id, BackupQueueItem.worker_id == worker_id,
+                           BackupQueueItem.status == 'running')
+                    .values(finished_at=datetime.utcnow(), lease_expires_at=None, **result)
+                ).rowcount
+                db.session.commit()
+                if not finished:
+                    logger.warning(f"Queue item {item_id}: lease was lost to another worker, result discarded")
+            finally:
+                db.session.remove()
+    
+    def _expand_sweep(self, item, service):
+        if not service.config:
+            raise Exception("No backup configuration found")
+        repositories = service.sync_and_list_repositories()
+        merged = self._add_items(item.request_id, [repo.id for repo in repositories], service.listing_fresh)
+        if merged:
+            backup_request = db.session.get(BackupRequest, item.request_id)
+            backup_request.merged_item_ids = json.dumps(
+                json.loads(backup_request.merged_item_ids or '[]') + merged
+            )
+        logger.info(f"Sweep {item.request_id}: queued {len(repositories) - len(merged)} repositories, {len(merged)} already queued")
+    
+    def reclaim_expired(self):
+        """Requeue running items whose worker stopped renewing the lease (crashed, killed or cut off)"""
+        with app.app_context():
+            try:
+                now = datetime.utcnow()
+                lease_expired = [
+                    BackupQueueItem.status == 'running',
+                    or_(BackupQueueItem.lease_expires_at < now, BackupQueueItem.lease_expires_at.is_(None))
+                ]
+                reclaimed = 0
+                for item in BackupQueueItem.query.filter(*lease_expired).all():
+                    newer = BackupQueueItem.query.filter(
+                        BackupQueueItem.repository_id == item.repository_id,
+                        BackupQueueItem.status == 'queued'
+                    ).first()
+                    if newer:
+                        values = {'status': 'failed', 'finished_at': now, 'error_message':
+                                  f"Worker {item.worker_id} stopped; continued as queue item {newer.id}"}
+                    else:
+                        values = {'status': 'queued', 'started_at': None}
+                    started_at, worker_id = item.started_at, item.worker_id
+                    # Conditional on the lease still being expired, in case the worker renewed it meanwhile
+                    taken_back = db.session.execute(
+                        update(BackupQueueItem)
+                        .where(BackupQueueItem.id == item.id, *lease_expired)
+                        .values(worker_id=None, lease_expires_at=None, **values)
+                    ).rowcount
+                    if taken_back and item.repository_id is not None and started_at:
+                        # The dead worker's job record would otherwise show as running forever
+                        db.session.execute(
+                            update(BackupJob)
+                            .where(BackupJob.repository_id == item.repository_id, BackupJob.status == 'running',
+                                   BackupJob.started_at >= started_at)
+                            .values(status='failed', completed_at=now,
+                                    error_message=f"Worker {worker_id} stopped before finishing")
+                        )
+                    reclaimed += taken_back
+                db.session.commit()
+                if reclaimed:
+                    logger.info(f"Reclaimed {reclaimed} backup queue items from workers whose lease expired")
+                return reclaimed
+            finally:
+                db.session.remove()
+    
+    def acquire_lease(self, name, worker_id, duration):
+        """Take or extend a named lease; True if worker_id now holds it"""
+        with app.app_context():
+            try:
+                now = datetime.utcnow()
+                taken = db.session.execute(
+                    update(WorkerLease)
+                    .where(WorkerLease.name == name,
+                           or_(WorkerLease.expires_at < now, WorkerLease.worker_id == worker_id))
+                    .values(worker_id=worker_id, expires_at=now + duration)
+                ).rowcount
+                if not taken:
+                    db.session.add(WorkerLease(name=name, worker_id=worker_id, expires_at=now + duration))
+                db.session.commit()
+                return True
+            except IntegrityError:
+                db.session.rollback()  # The lease exists and another worker holds it
+                return False
+            finally:
+                db.session.remove()
+    
+    def release_lease(self, name, worker_id):
+        with app.app_context():
+            try:
+                db.session.execute(delete(WorkerLease).where(WorkerLease.name == name, WorkerLease.worker_id == worker_id))
+                db.session.commit()
+            finally:
+                db.session.remove()
+    
+    def counts(self):
+        """Number of queued and running items, and the workers currently holding leases"""
+        rows = db.session.execute(
+            select(BackupQueueItem.status, db.func.count()).where(
+                BackupQueueItem.status.in_(('queued', 'running'))
+            ).group_by(BackupQueueItem.status)
+        ).all()
+        workers = db.session.execute(
+            select(BackupQueueItem.worker_id).where(BackupQueueItem.status == 'running').distinct()
+        ).scalars().all()
+        return {'queued': 0, 'running': 0, **dict(rows), 'workers': sorted(worker for worker in workers if worker)}
+    
+    def request_status(self, request_id):
+        """Progress of a backup request, including items it was merged into; None if unknown"""
+        backup_request = db.session.get(BackupRequest, request_id)
+        if not backup_request:
+            return None
+        
+        merged_ids = json.loads(backup_request.merged_item_ids or '[]')
+        items = BackupQueueItem.query.filter(or_(
+            BackupQueueItem.request_id == request_id,
+            BackupQueueItem.id.in_(merged_ids)
+        )).order_by(BackupQueueItem.id).all()
+        
+        counts = {}
+        for item in items:
+            counts[item.status] = counts.get(item.status, 0) + 1
+        done = all(item.status in FINISHED_QUEUE_STATUSES for item in items)
+        return {
+            'request_id': backup_request.id,
+            'source': backup_request.source,
+            'created_at': backup_request.created_at.isoformat(),
+            'status': 'finished' if done else ('running' if counts.get('running') else 'queued'),
+            'counts': counts,
+            'items': [{
+                'id': item.id,
+                'repository': item.repository.full_name if item.repository else None,
+                'status': item.status,
+                'worker': item.worker_id,
+                'job_id': item.job_id,
+                'error': item.error_message
+            } for item in items]
+        }
+    
+    def prune_history(self):
+        """Delete finished items and requests older than QUEUE_HISTORY_DAYS"""
+        cutoff = datetime.utcnow() - timedelta(days=QUEUE_HISTORY_DAYS)
+        with app.app_context():
+            db.session.execute(delete(BackupQueueItem).where(
+                BackupQueueItem.status.in_(FINISHED_QUEUE_STATUSES),
+                BackupQueueItem.finished_at < cutoff
+            ))
+            db.session.execute(delete(BackupRequest).where(
+                BackupRequest.created_at < cutoff,
+                ~exists().where(BackupQueueItem.request_id == BackupRequest.id)
+            ))
+            db.session.commit()
+
+
+class _LeaseHeartbeat(threading.Thread):
+    """Renews a running item's lease until stopped"""
+    
+    def __init__(self, queue, item_id, worker_id):
+        super().__init__(name=f'lease-{item_id}', daemon=True)
+        self._queue = queue
+        self._item_id = item_id
+        self._worker_id = worker_id
+        self._stopped = threading.Event()
+    
+    def run(self):
+        while not self._stopped.wait(LEASE_RENEW_INTERVAL):
+            try:
+                if not self._queue.renew_lease(self._item_id, self._worker_id):
+                    logger.warning(f"Queue item {self._item_id}: lease lost, another worker may take it over")
+                    return
+            except Exception as e:
+                logger.warning(f"Queue item {self._item_id}: could not renew lease: {str(e)}")
+    
+    def stop(self):
+        self._stopped.set()
+
+class QueueWorkerPool:
+    """Background threads that lease and run queued backups
+    
+    Any number of pools, in the web process or in standalone workers (worker.py) on other
+    hosts, can share one database. Each idle worker also reclaims items whose lease ran
+    out. When the queue drains, the worker that notices and takes the maintenance lease
+    runs retention and mirror pruning once.
+    """
+    
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._condition = threading.Condition()
+        self._cleanup_lock = threading.Lock()
+        self._threads = {}
+        self._size = 0
+        self._dirty = False  # Backups ran since the last retention pass
+    
+    def start(self, size=None):
+        """Start the workers, or resize the pool to match the configuration"""
+        if size is None:
+            with app.app_context():
+                config = BackupConfig.query.first()
+                size = (config.max_workers if config else None) or 1
+        with self._condition:
+            self._size = max(1, size)
+            for index in range(self._size):
+                thread = self._threads.get(index)
+                if thread is None or not thread.is_alive():
+                    thread = threading.Thread(target=self._run, args=(index,), name=f'backup-queue-{index}', daemon=True)
+                    self._threads[index] = thread
+                    thread.start()
+            self._condition.notify_all()  # Surplus workers notice the smaller size and exit
+    
+    def stop(self, timeout=None):
+        """Let each worker finish its current item, then stop; returns False if some are still busy"""
+        with self._condition:
+            self._size = 0
+            self._condition.notify_all()
+            threads = list(self._threads.values())
+        for thread in threads:
+            thread.join(timeout)
+        return not any(thread.is_alive() for thread in threads)
+    
+    def wake(self):
+        """Tell idle workers that new work was queued"""
+        with self._condition:
+            self._condition.notify_all()
+    
+    def _run(self, index):
+        queue = BackupQueueService()
+        worker_id = f"{self.worker_id}/{index}"
+        while index < self._size:
+            try:
+                item_id = queue.claim_next(worker_id)
+                if item_id is not None:
+                    self._dirty = True
+                    queue.run_item(item_id, worker_id)
+                    continue
+                if queue.reclaim_expired():
+                    continue
+                self._after_drain(queue)
+            except Exception as e:
+                logger.error(f"Backup queue worker {index} error: {str(e)}")
+            with self._condition:
+                self._condition.wait(QUEUE_POLL_INTERVAL)
+        with self._condition:
+            if self._threads.get(index) is threading.current_thread():
+                del self._threads[index]
+    
+    def _after_drain(self, queue):
+        if not self._dirty or not self._cleanup_lock.acquire(blocking=False):
+            return
+        try:
+            with app.app_context():
+                if queue.counts()['running']:
+                    return  # Another worker is still busy; it will run retention when it finishes
+            # One maintenance pass at a time across all hosts: retention must not release a snapshot twice
+            if not queue.acquire_lease(MAINTENANCE_LEASE, self.worker_id, MAINTENANCE_LEASE_DURATION):
+                return
+            try:
+                self._dirty = False
+                service = BackupService()
+                service.cleanup_old_backups()
+                service.prune_orphaned_mirrors()
+                queue.prune_history()
+            finally:
+                queue.release_lease(MAINTENANCE_LEASE, self.worker_id)
+        finally:
+            self._cleanup_lock.release()
+
+
+worker_pool = QueueWorkerPool()
+
+
+def queue_metrics():
+    """Metrics collector: queue depth and the workers holding leases, across all hosts"""
+    with app.app_context():
+        counts = BackupQueueService().counts()
+    return (
+        gauge_lines('github_backup_queue_items', 'Backup queue items by status',
+                    [({'status': status}, counts[status]) for status in ('queued', 'running')])
+        + gauge_lines('github_backup_queue_workers', 'Workers currently running a queued backup', [({}, len(counts['workers']))])
+    )
+
+
+registry.add_collector(queue_metrics)
+
+
+def queue_scheduled_sweep():
+    """Scheduler entry point: queue a sweep of all enabled repositories"""
+    BackupQueueService().enqueue(source='schedule')
@@ -1,14 +1,39 @@
-from flask import render_template, request, redirect, url_for, flash, jsonify, send_file
-from app import app, db, scheduler
-from models import BackupConfig, Repository, BackupJob, AppSettings
+from flask import render_template, request, redirect, url_for, flash, jsonify, send_file, Response, stream_with_context
+from app import app, app_role, db, scheduler
+from models import (
+    BackupConfig, Repository, BackupJob, BackupFileEntry, BackupQueueItem, BackupRequest,
+    AppSettings, HttpCacheEntry, SnapshotObject
+)
 from github_service import GitHubService
 from backup_service import BackupService
-from datetime import datetime
+from http_cache import DatabaseResponseCache
+from sync_service import RepositorySyncService
+from archive_service import ARCHIVE_FORMATS, DEFAULT_ARCHIVE_FORMAT, archive_format_for_path, compression_level_error
+from snapshot_store import SnapshotStore
+from index_service import BackupIndexService
+from job_trace import profile_summary, timeline
+from queue_service import BackupQueueService, worker_pool
+from schedule_service import SCHEDULE_TIERS, StaggeredScheduleService
+from webhook_service import WEBHOOK_DELIVERIES, WebhookService, verify_signature
+from live_updates import PollingBroadcaster
+import metrics
+from datetime import datetime, timedelta
+from urllib.parse import quote
 import os
+import json
+import time
 import logging
+import mimetypes
 
 logger = logging.getLogger(__name__)
 
+# Live job updates (JSON delta endpoint and Server-Sent Events stream)
+JOB_UPDATES_INITIAL_WINDOW = timedelta(minutes=1)
+JOB_UPDATES_OVERLAP = timedelta(seconds=2)
+JOB_STREAM_POLL_INTERVAL = 1
+JOB_STREAM_KEEPALIVE = 15
+JOB_STREAM_MAX_SECONDS = 300
+
 @app.route('/')
 def index():
     """Main dashboard showing backup status and recent jobs"""
@@ -24,12 +49,36 @@ def index():
         if jobs:
             next_job = min(job.next_run_time for job in jobs if job.next_run_time)
     
+    # Only what this process already knows from earlier responses: the page never waits on GitHub
+    rate_limit = None
+    if config and config.github_token:
+        rate_limit = GitHubService(config.github_token, pool_size=config.api_pool_size).rate_limiter.status()
+    
     return render_template('index.html', 
                          config=config,
                          recent_jobs=recent_jobs,
                          total_repos=total_repos,
                          scheduler_running=scheduler_running,
-                         next_job=next_job)
+                         next_job=next_job,
+                         rate_limit=rate_limit,
+                         live_cursor=datetime.utcnow().isoformat())
+
+@app.route('/api/rate-limit')
+def rate_limit_status():
+    """Current GitHub API budget and pacing delay as JSON"""
+    config = BackupConfig.query.first()
+    if not config or not config.github_token:
+        return jsonify({'success': False, 'message': 'GitHub token not configured'}), 404
+    
+    status = GitHubService(config.github_token, pool_size=config.api_pool_size).get_rate_limit_status()
+    if status['reset_at']:
+        status['reset_at'] = status['reset_at'].isoformat() + 'Z'
+    return jsonify({'success': True, **status})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics for this process (standalone workers expose their own with --metrics-port)"""
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route('/config', methods=['GET', 'POST'])
 def config():
@@ -40,14 +89,48 @@ def config():
         max_backups = int(request.form.get('max_backups', 5))
         schedule_enabled = 'schedule_enabled' in request.form
         auto_sync_enabled = 'auto_sync_enabled' in request.form
+        skip_unchanged = 'skip_unchanged' in request.form
         schedule_cron = request.form.get('schedule_cron', '0 2 * * *')
+        schedule_mode = request.form.get('schedule_mode', 'sweep')
+        schedule_window_start = int(request.form.get('schedule_window_start', 1) or 0)
+        schedule_window_hours = int(request.form.get('schedule_window_hours', 6) or 6)
+        max_workers = int(request.form.get('max_workers', 1))
+        max_clone_workers = int(request.form.get('max_clone_workers', 4))
+        max_archive_workers = int(request.form.get('max_archive_workers', 2))
+        api_pool_size = int(request.form.get('api_pool_size', 10))
+        archive_format = request.form.get('archive_format', DEFAULT_ARCHIVE_FORMAT)
+        compression_level = request.form.get('compression_level', '').strip()
+        compression_threads = int(request.form.get('compression_threads', 0) or 0)
+        backup_mode = request.form.get('backup_mode', 'snapshot')
+        bundle_full_every = int(request.form.get('bundle_full_every', 7) or 7)
+        min_free_space_mb = int(request.form.get('min_free_space_mb', 1024) or 1024)
+        webhook_secret = request.form.get('webhook_secret', '').strip()
+        profile_repositories = ' '.join(request.form.get('profile_repositories', '').replace(',', ' ').split())
+        
+        if archive_format not in ARCHIVE_FORMATS:
+            flash(f'Unsupported archive format: {archive_format}', 'error')
+            return render_template('config.html', config=BackupConfig.query.first(), archive_formats=ARCHIVE_FORMATS)
+        
+        if archive_format == 'zip-store' or not compression_level:
+            compression_level = None  # Store-only never compresses; a level left from another format is dropped
+        elif not compression_level.isdigit():
+            flash('Compression level must be a whole number', 'error')
+            return render_template('config.html', config=BackupConfig.query.first(), archive_formats=ARCHIVE_FORMATS)
+        else:
+            compression_level = int(compression_level)
+        level_error = compression_level_error(archive_format, compression_level)
+        if level_error:
+            flash(level_error, 'error')
+            return render_template('config.html', config=BackupConfig.query.first(), archive_formats=ARCHIVE_FORMATS)
         
-        # Validate GitHub token
+        # Validate GitHub token; the same service (and connection pool) is reused for the sync below
+        github_service = None
         if github_token:
-            github_service = GitHubService(github_token)
+            github_service = GitHubService(github_token, pool_size=api_pool_size, cache=DatabaseResponseCache(),
+                                           interactive=True)
             if not github_service.test_connection():
                 flash('Invalid GitHub token. Please check your token and try again.', 'error')
-                return render_template('config.html')
+                return render_template('config.html', archive_formats=ARCHIVE_FORMATS)
         
         # Create or update config
         config = BackupConfig.query.first()
@@ -59,7 +142,23 @@ def config():
         config.backup_path = backup_path
         config.max_backups = max_backups
         config.schedule_enabled = schedule_enabled
+        config.schedule_mode = schedule_mode if schedule_mode in ('sweep', 'staggered') else 'sweep'
+        config.schedule_window_start = min(23, max(0, schedule_window_start))
+        config.schedule_window_hours = min(24, max(1, schedule_window_hours))
         config.auto_sync_enabled = auto_sync_enabled
+        config.skip_unchanged = skip_unchanged
+        config.max_workers = max(1, max_workers)
+        config.max_clone_workers = max(1, max_clone_workers)
+        config.max_archive_workers = max(1, max_archive_workers)
+        config.api_pool_size = max(1, api_pool_size)
+        config.archive_format = archive_format
+        config.compression_level = compression_level
+        config.compression_threads = max(0, compression_threads)
+        config.backup_mode = backup_mode if backup_mode in ('snapshot', 'bundle', 'dedup') else 'snapshot'
+        config.bundle_full_every = max(0, bundle_full_every)
+        config.min_free_space_mb = max(0, min_free_space_mb)
+        config.webhook_secret = webhook_secret or None
+        config.profile_repositories = profile_repositories or None
         # Use the final_cron value if provided (from the new UI), otherwise use schedule_cron
         final_cron = request.form.get('final_cron', schedule_cron)
         config.schedule_cron = final_cron
@@ -72,30 +171,17 @@ def config():
             os.makedirs(backup_path, exist_ok=True)
             
             # Auto-sync repositories when token is configured
-            if github_token:
+            if github_service:
                 try:
-                    github_service = GitHubService(github_token)
-                    repos = github_service.get_user_repositories()
-                    synced_count = 0
-                    
-                    for repo_data in repos:
-                        existing_repo = Repository.query.filter_by(full_name=repo_data['full_name']).first()
-                        if not existing_repo:
-                            new_repo = Repository()
-                            new_repo.name = repo_data['name']
-                            new_repo.full_name = repo_data['full_name']
-                            new_repo.clone_url = repo_data['clone_url']
-                            new_repo.enabled = True
-                            db.session.add(new_repo)
-                            synced_count += 1
+                    synced_count = RepositorySyncService(github_service).sync(auto_enable=True)['added']
                     
                     if synced_count > 0:
-                        db.session.commit()
                         flash(f'Configuration saved and {synced_count} repositories synced!', 'success')
                     else:
                         flash('Configuration saved successfully!', 'success')
                         
                 except Exception as e:
+                    db.session.rollback()
                     logger.warning(f"Could not auto-sync repositories: {str(e)}")
                     flash('Configuration saved, but could not sync repositories automatically.', 'warning')
             
@@ -105,6 +191,10 @@ def config():
                 backup_service.schedule_backup(final_cron)
             else:
                 backup_service.unschedule_backup()
+            
+            # Match the number of in-process queue workers to max_workers
+            if app_role == 'all':
+                worker_pool.start(config.max_workers)
                 
         except Exception as e:
             db.session.rollback()
@@ -112,7 +202,7 @@ def config():
             flash(f'Error saving configuration: {str(e)}', 'error')
     
     config = BackupConfig.query.first()
-    return render_template('config.html', config=config)
+    return render_template('config.html', config=config, archive_formats=ARCHIVE_FORMATS)
 
 @app.route('/repositories')
 def repositories():
@@ -123,7 +213,14 @@ def repositories():
         return redirect(url_for('config'))
     
     repositories = Repository.query.all()
-    return render_template('repositories.html', repositories=repositories)
+    # Effective tier of each repository, shown when backups are staggered
+    tiers = {}
+    if config.schedule_mode == 'staggered':
+        schedule = StaggeredScheduleService(config)
+        now = datetime.utcnow()
+        tiers = {repo.id: schedule.tier(repo, now) for repo in repositories}
+    return render_template('repositories.html', repositories=repositories, tiers=tiers,
+                           schedule_tiers=SCHEDULE_TIERS)
 
 @app.route('/sync-repositories', methods=['POST'])
 def sync_repositories():
@@ -134,22 +231,14 @@ def sync_repositories():
         return redirect(url_for('config'))
     
     try:
-        github_service = GitHubService(config.github_token)
-        repos = github_service.get_user_repositories()
-        
-        synced_count = 0
-        for repo_data in repos:
-            existing_repo = Repository.query.filter_by(full_name=repo_data['full_name']).first()
-            if not existing_repo:
-                new_repo = Repository()
-                new_repo.name = repo_data['name']
-                new_repo.full_name = repo_data['full_name']
-                new_repo.clone_url = repo_data['clone_url']
-                db.session.add(new_repo)
-                synced_count += 1
+        github_service = GitHubService(config.github_token, pool_size=config.api_pool_size,
+                                       cache=DatabaseResponseCache(), interactive=True)
+        stats = RepositorySyncService(github_service).sync()
+        synced_count = stats['added']
         
-        db.session.commit()
         flash(f'Successfully synced {synced_count} new repositories.', 'success')
+        if stats['missing']:
+            flash(f"{stats['missing']} repositories are no longer listed on GitHub.", 'warning')
         
     except Exception as e:
         db.session.rollback()
@@ -204,26 +293,235 @@ def toggle_repository(repo_id):
     
     return redirect(url_for('repositories'))
 
+@app.route('/repositories/<int:repo_id>/schedule-tier', methods=['POST'])
+def set_schedule_tier(repo_id):
+    """Set how often a repository is backed up in staggered mode"""
+    repository = Repository.query.get_or_404(repo_id)
+    tier = request.form.get('schedule_tier') or None
+    if tier is not None and tier not in SCHEDULE_TIERS:
+        flash(f'Unknown schedule tier: {tier}', 'error')
+        return redirect(url_for('repositories'))
+    
+    repository.schedule_tier = tier
+    # Planned again on the next dispatch
+    repository.next_backup_at = None
+    try:
+        db.session.commit()
+        flash(f"Repository {repository.name} scheduled {tier or 'automatically'}.", 'success')
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error updating schedule tier: {str(e)}")
+        flash(f'Error updating repository: {str(e)}', 'error')
+    
+    return redirect(url_for('repositories'))
+
+@app.route('/webhooks/github', methods=['POST'])
+def github_webhook():
+    """Receive GitHub push/create/delete/repository events signed with the configured webhook secret"""
+    config = BackupConfig.query.first()
+    if not config or not config.webhook_secret:
+        return jsonify({'error': 'Webhook secret is not configured'}), 404
+    
+    # The signature covers the raw body, so check it before parsing anything
+    if not verify_signature(config.webhook_secret, request.get_data(), request.headers.get('X-Hub-Signature-256')):
+        WEBHOOK_DELIVERIES.inc(event='unverified', result='rejected')
+        return jsonify({'error': 'Invalid signature'}), 401
+    
+    if request.is_json:
+        payload = request.get_json(silent=True) or {}
+    else:
+        # Webhooks created with content type application/x-www-form-urlencoded
+        payload = json.loads(request.form.get('payload') or '{}')
+    
+    event = request.headers.get('X-GitHub-Event', '')
+    try:
+        result = WebhookService(config).handle(event, payload)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error handling {event} webhook: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    return jsonify({'event': event, 'result': result})
+
 @app.route('/backup-now', methods=['POST'])
 def backup_now():
-    """Trigger immediate backup of all enabled repositories"""
+    """Queue a backup of all enabled repositories, or of the given repository_ids, and return at once"""
+    payload = request.get_json(silent=True) or {}
+    repository_ids = payload.get('repository_ids') or request.form.getlist('repository_ids') or None
+    wants_json = request.is_json or request.accept_mimetypes.best == 'application/json'
+    
+    try:
+        if repository_ids is not None:
+            repository_ids = _parse_repository_ids(repository_ids)
+    except ValueError as e:
+        if wants_json:
+            return jsonify({'error': str(e)}), 400
+        flash(f'Error starting backup: {str(e)}', 'error')
+        return redirect(url_for('status'))
+    
     try:
-        backup_service = BackupService()
-        backup_service.backup_all_repositories()
-        flash('Backup started successfully! Check the status page for progress.', 'success')
+        request_id = BackupQueueService().enqueue(repository_ids)
     except Exception as e:
-        logger.error(f"Error starting backup: {str(e)}")
+        logger.error(f"Error queueing backup: {str(e)}")
+        if wants_json:
+            return jsonify({'error': str(e)}), 400
         flash(f'Error starting backup: {str(e)}', 'error')
+        return redirect(url_for('status'))
     
-    return redirect(url_for('status'))
+    if wants_json:
+        return jsonify({
+            'request_id': request_id,
+            'status_url': url_for('backup_request_status', request_id=request_id)
+        }), 202
+    
+    scope = 'all enabled repositories' if repository_ids is None else f'{len(repository_ids)} repository(ies)'
+    flash(f'Backup of {scope} queued (request {request_id[:8]}). Check the status page for progress.', 'success')
+    return redirect(request.referrer or url_for('status'))
+
+def _parse_repository_ids(values):
+    """Integer ids of existing repositories; ValueError names anything else"""
+    if not isinstance(values, list):
+        raise ValueError('repository_ids must be a list of repository ids')
+    invalid = [value for value in values if isinstance(value, bool) or not str(value).strip().isdigit()]
+    if invalid:
+        raise ValueError(f"Invalid repository ids: {', '.join(map(str, invalid))}")
+    repository_ids = [int(value) for value in values]
+    existing = set(db.session.execute(
+        db.select(Repository.id).where(Repository.id.in_(repository_ids))
+    ).scalars())
+    unknown = [repository_id for repository_id in repository_ids if repository_id not in existing]
+    if unknown:
+        raise ValueError(f"Unknown repository ids: {', '.join(map(str, unknown))}")
+    return repository_ids
+
+@app.route('/api/backup-requests/<request_id>')
+def backup_request_status(request_id):
+    """API endpoint reporting the progress of a queued backup request"""
+    status = BackupQueueService().request_status(request_id)
+    if status is None:
+        return jsonify({'error': 'Unknown backup request'}), 404
+    return jsonify(status)
 
 @app.route('/status')
 def status():
     """Backup status and job history"""
     jobs = BackupJob.query.order_by(BackupJob.started_at.desc()).limit(50).all()
     running_jobs = BackupJob.query.filter_by(status='running').all()
+    queue_counts = BackupQueueService().counts()
+    
+    return render_template('status.html', jobs=jobs, running_jobs=running_jobs, queue_counts=queue_counts,
+                         live_cursor=datetime.utcnow().isoformat())
+
+def _job_progress_payload(job):
+    return {
+        'id': job.id,
+        'repository': job.repository.full_name if job.repository else None,
+        'status': job.status,
+        'phase': job.phase,
+        'bytes_received': job.bytes_received,
+        'files_archived': job.files_archived,
+        'compressed_bytes': job.compressed_bytes,
+        'file_size': job.file_size,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'completed_at': job.completed_at.isoformat() if job.completed_at else None,
+        'error_message': (job.error_message or '')[:500] or None
+    }
+
+def _job_updates(since):
+    """Jobs changed since a cursor (ISO timestamp), plus the cursor for the next call
+    
+    The window overlaps the previous one by JOB_UPDATES_OVERLAP so rows committed just
+    after a cursor was taken are not missed; clients apply updates idempotently.
+    """
+    cursor = datetime.utcnow()
+    try:
+        since = datetime.fromisoformat(since) - JOB_UPDATES_OVERLAP if since else cursor - JOB_UPDATES_INITIAL_WINDOW
+    except ValueError:
+        since = cursor - JOB_UPDATES_INITIAL_WINDOW
+    jobs = BackupJob.query.filter(BackupJob.updated_at > since).order_by(BackupJob.updated_at).limit(200).all()
+    payload = {
+        'cursor': cursor.isoformat(),
+        'jobs': [_job_progress_payload(job) for job in jobs],
+        'queue': BackupQueueService().counts()
+    }
+    db.session.commit()  # End the read transaction so a long-lived stream sees new commits
+    return payload
+
+def _poll_job_updates(since):
+    with app.app_context():
+        return _job_updates(since)
+
+# Every open stream in this process shares one poll per JOB_STREAM_POLL_INTERVAL
+job_updates_feed = PollingBroadcaster(_poll_job_updates, JOB_STREAM_POLL_INTERVAL)
+
+def _merge_job_updates(cursor, payloads):
+    """Combine broadcast polls into one payload; a job's latest state wins"""
+    if not payloads:
+        return {'cursor': cursor, 'jobs': []}
+    jobs = {}
+    for payload in payloads:
+        for job in payload['jobs']:
+            jobs.pop(job['id'], None)
+            jobs[job['id']] = job
+    return {'cursor': payloads[-1]['cursor'], 'jobs': list(jobs.values()), 'queue': payloads[-1]['queue']}
+
+@app.route('/api/jobs/updates')
+def job_updates():
+    """API endpoint returning jobs changed since the given cursor"""
+    return jsonify(_job_updates(request.args.get('since')))
+
+@app.route('/api/jobs/stream')
+def job_updates_stream():
+    """Server-Sent Events stream of job changes
+    
+    The stream ends after JOB_STREAM_MAX_SECONDS so it never pins a server worker
+    indefinitely; EventSource reconnects by itself and resumes from Last-Event-ID.
+    Only the catch-up from that cursor queries the database per client; after that
+    the stream relays the process-wide job_updates_feed.
+    """
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    
+    def generate():
+        deadline = time.monotonic() + JOB_STREAM_MAX_SECONDS
+        last_sent = time.monotonic()
+        yield 'retry: 3000\n\n'
+        with job_updates_feed.subscription() as sequence:
+            payload = _job_updates(since)
+            while True:
+                if payload['jobs']:
+                    yield f"id: {payload['cursor']}\nevent: jobs\ndata: {json.dumps(payload)}\n\n"
+                    last_sent = time.monotonic()
+                elif time.monotonic() - last_sent >= JOB_STREAM_KEEPALIVE:
+                    yield ': keepalive\n\n'
+                    last_sent = time.monotonic()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                sequence, payloads = job_updates_feed.wait(sequence, min(remaining, JOB_STREAM_KEEPALIVE))
+                if payloads is None:
+                    # Fell behind the feed's history; catch up directly
+                    payload = _job_updates(payload['cursor'])
+                else:
+                    payload = _merge_job_updates(payload['cursor'], payloads)
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Let nginx pass events through unbuffered
+    return response
+
+def _accel_redirect(job, mimetype, download_name):
+    """Hand a backup file to nginx via X-Accel-Redirect, or None if it is outside the backup directory"""
+    config = BackupConfig.query.first()
+    backup_root = os.path.abspath(config.backup_path if config else './backups')
+    relative_path = os.path.relpath(os.path.abspath(job.backup_file_path), backup_root)
+    if relative_path.startswith('..'):
+        return None
     
-    return render_template('status.html', jobs=jobs, running_jobs=running_jobs)
+    response = Response(mimetype=mimetype)
+    response.headers['X-Accel-Redirect'] = app.config['DOWNLOAD_ACCEL_PREFIX'].rstrip('/') + '/' + quote(relative_path.replace(os.sep, '/'))
+    response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+    if job.checksum:
+        response.set_etag(job.checksum)
+    return response
 
 @app.route('/download-backup/<int:job_id>')
 def download_backup(job_id):
@@ -235,26 +533,148 @@ def download_backup(job_id):
         return redirect(url_for('status'))
     
     try:
+        if job.backup_kind == 'dedup':
+            # Deduplicated snapshots have no archive on disk; assemble the zip while streaming
+            manifest_path = job.backup_file_path
+            download_name = os.path.basename(manifest_path)[:-len('.json.gz')] + '.zip'
+            return Response(
+                stream_with_context(SnapshotStore.for_manifest(manifest_path).stream_zip(manifest_path)),
+                mimetype='application/zip',
+                headers={'Content-Disposition': f'attachment; filename="{download_name}"'}
+            )
+        
+        archive_format = job.archive_format or archive_format_for_path(job.backup_file_path)
+        mimetype = ARCHIVE_FORMATS.get(archive_format, {}).get('mimetype', 'application/octet-stream')
+        download_name = os.path.basename(job.backup_file_path)
+        
+        if app.config['DOWNLOAD_OFFLOAD'] == 'x-accel-redirect':
+            response = _accel_redirect(job, mimetype, download_name)
+            if response is not None:
+                return response
+        
+        # conditional=True answers Range/If-Range (resumable downloads) and If-None-Match;
+        # the file body goes through wsgi.file_wrapper, which Gunicorn serves with sendfile()
         return send_file(
             job.backup_file_path,
+            mimetype=mimetype,
             as_attachment=True,
-            download_name=os.path.basename(job.backup_file_path)
+            download_name=download_name,
+            conditional=True,
+            etag=job.checksum or True
         )
     except Exception as e:
         logger.error(f"Error downloading backup: {str(e)}")
         flash('Error downloading backup file.', 'error')
         return redirect(url_for('status'))
 
+def _backup_directory(job, path):
+    """One level of a backup's indexed tree: files directly in path plus its subdirectories"""
+    files = BackupFileEntry.query.filter_by(job_id=job.id, directory=path).all()
+    nested = db.session.query(BackupFileEntry.directory).filter(BackupFileEntry.job_id == job.id)
+    if path:
+        nested = nested.filter(BackupFileEntry.directory.startswith(f"{path}/", autoescape=True))
+    else:
+        nested = nested.filter(BackupFileEntry.directory != '')
+    subdirectories = [directory for directory, in nested.distinct()]
+    return BackupIndexService().listing(files, subdirectories, path)
+
+@app.route('/backups/<int:job_id>/files')
+def browse_backup(job_id):
+    """Browse the files in a backup"""
+    job = BackupJob.query.get_or_404(job_id)
+    path = request.args.get('path', '').strip('/')
+    entries = _backup_directory(job, path)
+    if path and not entries:
+        flash('Folder not found in this backup.', 'error')
+        return redirect(url_for('browse_backup', job_id=job.id))
+    
+    crumbs = []
+    if path:
+        parts = path.split('/')
+        crumbs = [{'name': part, 'path': '/'.join(parts[:i + 1])} for i, part in enumerate(parts)]
+    return render_template('browse.html', job=job, path=path, crumbs=crumbs, entries=entries)
+
+@app.route('/api/backups/<int:job_id>/tree')
+def backup_tree(job_id):
+    """API endpoint listing one folder of a backup's indexed tree"""
+    job = BackupJob.query.get_or_404(job_id)
+    path = request.args.get('path', '').strip('/')
+    return jsonify({'job_id': job.id, 'path': path, 'entries': _backup_directory(job, path)})
+
+@app.route('/backups/<int:job_id>/extract')
+def extract_from_backup(job_id):
+    """Stream a single file, or a folder as zip, out of a backup without unpacking the rest"""
+    job = BackupJob.query.get_or_404(job_id)
+    path = request.args.get('path', '').strip('/')
+    index_service = BackupIndexService()
+    
+    entry = BackupFileEntry.query.filter_by(job_id=job.id, path=path).first()
+    if entry:
+        response = Response(
+            stream_with_context(index_service.read_file(job, entry)),
+            mimetype=mimetypes.guess_type(entry.path)[0] or 'application/octet-stream',
+            headers={'Content-Disposition': f'attachment; filename="{os.path.basename(entry.path)}"'}
+        )
+        response.set_etag(entry.blob)
+        return response
+    
+    entries = BackupFileEntry.query.filter(BackupFileEntry.job_id == job.id)
+    if path:
+        entries = entries.filter(BackupFileEntry.path.startswith(f"{path}/", autoescape=True))
+    entries = entries.order_by(BackupFileEntry.path).all()
+    if not entries:
+        flash('File not found in this backup.', 'error')
+        return redirect(url_for('browse_backup', job_id=job.id))
+    
+    download_name = f"{job.repository.name if job.repository else 'backup'}_{job.id}"
+    if path:
+        download_name += f"_{os.path.basename(path)}"
+    return Response(
+        stream_with_context(index_service.stream_zip(job, entries)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{download_name}.zip"'}
+    )
+
+@app.route('/jobs/<int:job_id>/timeline')
+def job_timeline(job_id):
+    """Timeline of a backup job's phases, with its profile summary if it was profiled"""
+    job = BackupJob.query.get_or_404(job_id)
+    summary = None
+    if job.profile_path and os.path.exists(job.profile_path):
+        try:
+            summary = profile_summary(job.profile_path)
+        except Exception as e:
+            logger.warning(f"Could not read profile for job {job.id}: {str(e)}")
+    return render_template('job_timeline.html', job=job, trace=timeline(job.spans), profile=summary)
+
+@app.route('/jobs/<int:job_id>/profile')
+def download_profile(job_id):
+    """Download a job's raw cProfile output (for snakeviz, pstats, etc.)"""
+    job = BackupJob.query.get_or_404(job_id)
+    if not job.profile_path or not os.path.exists(job.profile_path):
+        flash('No profile was captured for this job.', 'error')
+        return redirect(url_for('job_timeline', job_id=job.id))
+    return send_file(os.path.abspath(job.profile_path), as_attachment=True, download_name=f"job_{job.id}.prof")
+
 @app.route('/delete-job/<int:job_id>', methods=['POST'])
 def delete_job(job_id):
     """Delete a backup job record"""
     job = BackupJob.query.get_or_404(job_id)
     
+    if BackupJob.query.filter_by(parent_job_id=job.id).first():
+        flash('This bundle is needed to restore newer incremental backups and cannot be deleted.', 'error')
+        return redirect(url_for('status'))
+    
     try:
         # Delete backup file if it exists
-        if job.backup_file_path and os.path.exists(job.backup_file_path):
+        if job.backup_kind == 'dedup':
+            BackupService().release_snapshot(job.backup_file_path)
+        elif job.backup_file_path and os.path.exists(job.backup_file_path):
             os.remove(job.backup_file_path)
+        if job.profile_path and os.path.exists(job.profile_path):
+            os.remove(job.profile_path)
         
+        BackupFileEntry.query.filter_by(job_id=job.id).delete()
         db.session.delete(job)
         db.session.commit()
         flash('Backup job deleted successfully.', 'success')
@@ -278,10 +698,15 @@ def purge_system():
         backup_path = config.backup_path if config else './backups'
         
         # Delete all database records
+        BackupQueueItem.query.delete()
+        BackupRequest.query.delete()
+        BackupFileEntry.query.delete()
         BackupJob.query.delete()
         Repository.query.delete()
         BackupConfig.query.delete()
         AppSettings.query.delete()
+        HttpCacheEntry.query.delete()
+        SnapshotObject.query.delete()
         db.session.commit()
         
         # Delete all backup files
@@ -0,0 +1,143 @@
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from app import app, db
+from models import Repository
+from backup_service import BackupService
+from queue_service import BackupQueueService
+
+logger = logging.getLogger(__name__)
+
+LISTING_SYNC_INTERVAL = timedelta(hours=1)  # Staggered mode re-syncs the repository list this often
+
+# Backup interval of each tier; 'auto' picks one from how recently the repository was pushed to
+SCHEDULE_TIERS = {
+    'hourly': timedelta(hours=1),
+    'daily': timedelta(days=1),
+    'weekly': timedelta(weeks=1),
+}
+HOT_PUSHED_WITHIN = timedelta(days=1)  # auto: pushed this recently -> hourly
+DORMANT_AFTER = timedelta(days=30)  # auto: not pushed for this long -> weekly
+
+DEFAULT_WINDOW_START_HOUR = 1
+DEFAULT_WINDOW_HOURS = 6
+
+class StaggeredScheduleService:
+    """Spreads per-repository backups over the configured window instead of one sweep
+    
+    Each repository belongs to a tier (hourly, daily or weekly; chosen per repository or
+    derived from its last push). Within a tier, repositories are ordered by a hash of
+    their name and given evenly spaced slots: hourly ones across each hour, daily ones
+    across the daily window, weekly ones across the same window on all seven days. The
+    slots are deterministic, so a repository keeps its time from run to run.
+    """
+    
+    def __init__(self, config):
+        self.config = config
+        start = config.schedule_window_start if config.schedule_window_start is not None else DEFAULT_WINDOW_START_HOUR
+        self.window_start = timedelta(hours=start % 24)
+        self.window = timedelta(hours=min(24, max(1, config.schedule_window_hours or DEFAULT_WINDOW_HOURS)))
+    
+    def tier(self, repository, now):
+        """Effective tier of a repository"""
+        if repository.schedule_tier in SCHEDULE_TIERS:
+            return repository.schedule_tier
+        if repository.pushed_at and now - repository.pushed_at <= HOT_PUSHED_WITHIN:
+            return 'hourly'
+        if repository.pushed_at is None or now - repository.pushed_at >= DORMANT_AFTER:
+            return 'weekly'
+        return 'daily'
+    
+    def slots(self, repositories, now):
+        """{repository id: (tier, fraction)} with fractions spread evenly in [0, 1) within each tier"""
+        by_tier = {}
+        for repo in repositories:
+            by_tier.setdefault(self.tier(repo, now), []).append(repo)
+        slots = {}
+        for tier, members in by_tier.items():
+            members.sort(key=_jitter_key)
+            for rank, repo in enumerate(members):
+                slots[repo.id] = (tier, (rank + 0.5) / len(members))
+        return slots
+    
+    def next_run_after(self, moment, tier, fraction):
+        """First slot of the tier at this fraction strictly after moment"""
+        if tier == 'hourly':
+            start = moment.replace(minute=0, second=0, microsecond=0)
+            period = SCHEDULE_TIERS['hourly']
+            offset = fraction * period
+        elif tier == 'daily':
+            start = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+            period = SCHEDULE_TIERS['daily']
+            offset = self.window_start + fraction * self.window
+        else:
+            # The week is seven daily windows laid end to end
+            position = fraction * 7
+            day = int(position)
+            start = moment.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=moment.weekday())
+            period = SCHEDULE_TIERS['weekly']
+            offset = timedelta(days=day) + self.window_start + (position - day) * self.window
+        
+        run_at = start + offset
+        # A window that starts late in the day may place the previous period's slot after moment
+        while run_at - period > moment:
+            run_at -= period
+        while run_at <= moment:
+            run_at += period
+        return run_at
+    
+    def dispatch(self, now=None, listing_fresh=False):
+        """Queue every repository whose slot has passed and plan the next slot of each; returns the request id"""
+        now = now or datetime.utcnow()
+        repositories = Repository.query.filter(
+            Repository.enabled.is_(True),
+            Repository.missing_upstream.isnot(True)
+        ).all()
+        slots = self.slots(repositories, now)
+        
+        due = [repo for repo in repositories if repo.next_backup_at and repo.next_backup_at <= now]
+        for repo in repositories:
+            tier, fraction = slots[repo.id]
+            if repo in due:
+                # Half a period at least, so a slot that moved later does not run twice in one period
+                repo.next_backup_at = self.next_run_after(now + SCHEDULE_TIERS[tier] / 2, tier, fraction)
+                continue
+            # New repositories get their first slot; a tighter tier or an earlier slot takes effect at once
+            next_run = self.next_run_after(now, tier, fraction)
+            if repo.next_backup_at is None or next_run < repo.next_backup_at:
+                repo.next_backup_at = next_run
+        db.session.commit()
+        
+        if not due:
+            return None
+        return BackupQueueService().enqueue(
+            [repo.id for repo in due], source='schedule', listing_synced=listing_fresh
+        )
+
+
+def _jitter_key(repository):
+    """Stable per-repository sort key, independent of ids and insertion order"""
+    return hashlib.sha256(repository.full_name.encode('utf-8')).hexdigest()
+
+
+_last_listing_sync = None
+
+def dispatch_due_backups():
+    """Scheduler entry point for staggered mode: sync the listing when due, then queue due repositories"""
+    global _last_listing_sync
+    service = BackupService()
+    if not service.config:
+        return
+
+    with app.app_context():
+        listing_fresh = False
+        now = datetime.utcnow()
+        if service.config.auto_sync_enabled and (
+                _last_listing_sync is None or now - _last_listing_sync >= LISTING_SYNC_INTERVAL):
+            _last_listing_sync = now
+            service.sync_and_list_repositories()
+            listing_fresh = service.listing_fresh
+
+        request_id = StaggeredScheduleService(service.config).dispatch(listing_fresh=listing_fresh)
+        if request_id:
+            logger.info(f"Staggered schedule: queued backup request {request_id}")
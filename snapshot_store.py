@@ -0,0 +1,192 @@
+import os
+import gzip
+import json
+import fcntl
+import hashlib
+import logging
+import subprocess
+import tempfile
+import zipfile
+import zlib
+from contextlib import contextmanager
+
+from archive_service import StreamBuffer, list_tree
+
+logger = logging.getLogger(__name__)
+
+# Files are split into fixed-size chunks; identical chunks are stored once across all snapshots
+CHUNK_SIZE = 4 * 1024 * 1024
+OBJECTS_DIRNAME = '.objects'
+MANIFESTS_DIRNAME = '.snapshots'
+LOCK_FILENAME = '.lock'
+
+class SnapshotStore:
+    """Content-addressed, deduplicating store of repository snapshots under backup_path
+    
+    Each snapshot is a gzipped JSON manifest listing files and the sha256 ids of their
+    chunks; chunk data lives zlib-compressed in a shared object directory. Reference
+    counts are kept by the caller (see SnapshotObject) so expired snapshots can be
+    garbage-collected. Taking references and deleting unreferenced chunks both happen
+    under lock(), so a chunk a new snapshot reuses is never collected from under it.
+    """
+    
+    def __init__(self, backup_path):
+        self.objects_dir = os.path.join(backup_path, OBJECTS_DIRNAME)
+        self.manifests_dir = os.path.join(backup_path, MANIFESTS_DIRNAME)
+    
+    @classmethod
+    def for_manifest(cls, manifest_path):
+        """Open the store a manifest belongs to, even if the backup path has since changed"""
+        return cls(os.path.dirname(os.path.dirname(os.path.abspath(manifest_path))))
+    
+    def object_path(self, chunk_id):
+        return os.path.join(self.objects_dir, chunk_id[:2], chunk_id[2:])
+    
+    def create(self, git_dir, treeish, manifest_name, previous_manifest=None, progress=None):
+        """Store the tree at treeish and write its manifest
+        
+        Blobs already chunked by previous_manifest are reused without being read again.
+        progress, if given, is called with (new blobs stored, new bytes written) as they are.
+        Returns (manifest_path, bytes_written), where bytes_written counts new chunk data plus the manifest.
+        """
+        known_blobs = {}
+        if previous_manifest and os.path.exists(previous_manifest):
+            known_blobs = {entry['blob']: entry['chunks'] for entry in self.load_manifest(previous_manifest)['files']}
+        
+        entries = list_tree(git_dir, treeish)
+        new_blobs = {entry['blob'] for entry in entries if entry['blob'] not in known_blobs}
+        stored_blobs, bytes_written = self._store_blobs(git_dir, new_blobs, progress)
+        known_blobs.update(stored_blobs)
+        
+        for entry in entries:
+            entry['chunks'] = known_blobs[entry['blob']]
+        
+        os.makedirs(self.manifests_dir, exist_ok=True)
+        manifest_path = os.path.join(self.manifests_dir, f"{manifest_name}.json.gz")
+        partial_path = f"{manifest_path}.partial"
+        with gzip.open(partial_path, 'wt', encoding='utf-8') as manifest_file:
+            json.dump({'tree': treeish, 'files': entries}, manifest_file)
+        os.replace(partial_path, manifest_path)
+        return manifest_path, bytes_written + os.path.getsize(manifest_path)
+    
+    def load_manifest(self, manifest_path):
+        with gzip.open(manifest_path, 'rt', encoding='utf-8') as manifest_file:
+            return json.load(manifest_file)
+    
+    def chunk_ids(self, manifest_path):
+        """Distinct chunk ids referenced by a snapshot"""
+        return {chunk_id for entry in self.load_manifest(manifest_path)['files'] for chunk_id in entry['chunks']}
+    
+    def missing_chunks(self, chunk_ids):
+        """Chunk ids whose object file is not in the store"""
+        return {chunk_id for chunk_id in chunk_ids if not os.path.exists(self.object_path(chunk_id))}
+    
+    def restore_chunks(self, git_dir, manifest_path, chunk_ids):
+        """Write back chunks of a snapshot that were garbage-collected while it was stored; returns bytes written"""
+        blob_ids = {entry['blob'] for entry in self.load_manifest(manifest_path)['files']
+                    if not chunk_ids.isdisjoint(entry['chunks'])}
+        _, bytes_written = self._store_blobs(git_dir, blob_ids)
+        return bytes_written
+    
+    @contextmanager
+    def lock(self):
+        """Exclusive lock on the store, across threads and processes"""
+        os.makedirs(self.objects_dir, exist_ok=True)
+        with open(os.path.join(self.objects_dir, LOCK_FILENAME), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def read_chunks(self, chunk_ids):
+        """Yield the decompressed data of each chunk in order"""
+        for chunk_id in chunk_ids:
+            with open(self.object_path(chunk_id), 'rb') as object_file:
+                yield zlib.decompress(object_file.read())
+    
+    def stream_zip(self, manifest_path, prefix=''):
+        """Yield a zip archive of a snapshot (optionally only paths under prefix), built on the fly"""
+        buffer = StreamBuffer()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for entry in self.load_manifest(manifest_path)['files']:
+                if prefix and not entry['path'].startswith(prefix):
+                    continue
+                info = zipfile.ZipInfo(entry['path'])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                info.file_size = entry['size']
+                info.external_attr = int(entry['mode'], 8) << 16
+                with archive.open(info, 'w') as member:
+                    for data in self.read_chunks(entry['chunks']):
+                        member.write(data)
+                        yield buffer.take()
+                yield buffer.take()
+        yield buffer.take()
+    
+    def delete_objects(self, chunk_ids):
+        """Remove chunk files that are no longer referenced by any snapshot"""
+        for chunk_id in chunk_ids:
+            try:
+                os.remove(self.object_path(chunk_id))
+            except FileNotFoundError:
+                pass
+    
+    def _store_chunk(self, data):
+        chunk_id = hashlib.sha256(data).hexdigest()
+        path = self.object_path(chunk_id)
+        if os.path.exists(path):
+            return chunk_id, 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        compressed = zlib.compress(data)
+        # Write then rename so concurrent writers of the same chunk never expose a partial object
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as object_file:
+            object_file.write(compressed)
+        os.replace(object_file.name, path)
+        return chunk_id, len(compressed)
+    
+    def _store_blobs(self, git_dir, blob_ids, progress=None):
+        """Chunk and store blobs read through a single `git cat-file --batch`
+        
+        Returns a map of blob id to chunk ids and the number of new bytes written.
+        """
+        stored = {}
+        bytes_written = 0
+        if not blob_ids:
+            return stored, bytes_written
+        with tempfile.TemporaryFile() as request:
+            request.write(''.join(f'{blob_id}\n' for blob_id in blob_ids).encode())
+            request.seek(0)
+            process = subprocess.Popen(
+                ['git', f'--git-dir={git_dir}', 'cat-file', '--batch'],
+                stdin=request, stdout=subprocess.PIPE
+            )
+            try:
+                for _ in blob_ids:
+                    header = process.stdout.readline().decode().split()
+                    blob_id, size = header[0], int(header[2])
+                    chunk_ids = []
+                    for data in self._read_exact_chunks(process.stdout, size):
+                        chunk_id, written = self._store_chunk(data)
+                        chunk_ids.append(chunk_id)
+                        bytes_written += written
+                    process.stdout.read(1)  # Trailing newline after each object
+                    stored[blob_id] = chunk_ids
+                    if progress:
+                        progress(len(stored), bytes_written)
+            finally:
+                process.stdout.close()
+                process.wait()
+        return stored, bytes_written
+    
+    def _read_exact_chunks(self, stream, size):
+        remaining = size
+        if remaining == 0:
+            yield b''
+            return
+        while remaining > 0:
+            data = stream.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                raise Exception("Unexpected end of git cat-file output")
+            remaining -= len(data)
+            yield data
+
@@ -4,8 +4,8 @@ document.addEventListener('DOMContentLoaded', function() {
     // Initialize tooltips
     initializeTooltips();
     
-    // Initialize auto-refresh for running jobs
-    initializeAutoRefresh();
+    // Initialize live job updates
+    initializeLiveUpdates();
     
     // Initialize form validation
     initializeFormValidation();
@@ -25,60 +25,104 @@ function initializeTooltips() {
     });
 }
 
-// Auto-refresh functionality for pages with running jobs
-function initializeAutoRefresh() {
-    const runningJobs = document.querySelectorAll('.badge');
-    let hasRunningJobs = false;
-    
-    // Check if any badge contains "Running" text
-    runningJobs.forEach(badge => {
-        if (badge.textContent.includes('Running')) {
-            hasRunningJobs = true;
+// Live job updates for tables marked with data-live-jobs
+// Uses the Server-Sent Events stream when available and falls back to polling the JSON endpoint
+function initializeLiveUpdates() {
+    const table = document.querySelector('table[data-live-jobs]');
+    if (!table) return;
+    
+    let cursor = table.dataset.cursor;
+    
+    const handleUpdate = function(payload) {
+        cursor = payload.cursor;
+        applyJobUpdates(table, payload.jobs);
+    };
+    
+    if (window.EventSource) {
+        const source = new EventSource(table.dataset.streamUrl + '?since=' + encodeURIComponent(cursor));
+        source.addEventListener('jobs', function(event) {
+            handleUpdate(JSON.parse(event.data));
+        });
+        return;
+    }
+    
+    setInterval(function() {
+        if (document.hidden) return;
+        fetch(table.dataset.pollUrl + '?since=' + encodeURIComponent(cursor))
+            .then(response => response.json())
+            .then(handleUpdate)
+            .catch(error => console.error('Failed to fetch job updates:', error));
+    }, 10000);
+}
+
+const JOB_STATUS_BADGES = {
+    completed: '<span class="badge bg-success"><i class="fas fa-check me-1"></i>Completed</span>',
+    running: '<span class="badge bg-primary"><i class="fas fa-spinner fa-spin me-1"></i>Running</span>',
+    failed: '<span class="badge bg-danger"><i class="fas fa-times me-1"></i>Failed</span>',
+    skipped: '<span class="badge bg-light text-dark" title="No changes since the last backup"><i class="fas fa-forward me-1"></i>Skipped</span>',
+    pending: '<span class="badge bg-secondary"><i class="fas fa-clock me-1"></i>Pending</span>'
+};
+
+// Update status, progress and size cells in place for jobs already on the page
+function applyJobUpdates(table, jobs) {
+    let unknownJobs = false;
+    
+    jobs.forEach(job => {
+        const row = table.querySelector(`tr[data-job-id="${job.id}"]`);
+        if (!row) {
+            unknownJobs = true;
+            return;
+        }
+        
+        const status = row.querySelector('.job-status');
+        if (status && row.dataset.status !== job.status) {
+            status.innerHTML = JOB_STATUS_BADGES[job.status] || JOB_STATUS_BADGES.pending;
+            if (job.error_message) {
+                status.querySelector('.badge').title = job.error_message;
+            }
+            row.dataset.status = job.status;
+        }
+        
+        const progress = row.querySelector('.job-progress');
+        if (progress) {
+            progress.textContent = describeJobProgress(job);
+        }
+        
+        const size = row.querySelector('.job-size');
+        if (size && job.file_size) {
+            size.innerHTML = `<small class="text-muted">${formatFileSize(job.file_size)}</small>`;
         }
     });
     
-    // Also check for data attribute
-    hasRunningJobs = hasRunningJobs || document.querySelector('[data-status="running"]') !== null;
-    
-    if (hasRunningJobs || window.location.pathname.includes('/status') || window.location.pathname === '/') {
-        // Refresh every 10 seconds if there are running jobs or on dashboard/status pages
-        const refreshInterval = setInterval(function() {
-            const currentPath = window.location.pathname;
-            if (currentPath === '/status' || currentPath === '/') {
-                // Only auto-refresh if user hasn't interacted recently
-                if (document.hidden === false && 
-                    (Date.now() - getLastUserInteraction()) > 8000) {
-                    
-                    // Check if we still have running jobs before refreshing
-                    const currentlyRunning = Array.from(document.querySelectorAll('.badge')).some(badge => 
-                        badge.textContent.includes('Running'));
-                    
-                    if (currentlyRunning || currentPath === '/status') {
-                        location.reload();
-                    } else if (currentPath === '/') {
-                        // On dashboard, refresh once more to clear running status then stop
-                        location.reload();
-                        clearInterval(refreshInterval);
-                    }
-                }
-            }
-        }, 10000);
+    if (unknownJobs && !document.getElementById('new-jobs-notice')) {
+        const notice = document.createElement('div');
+        notice.id = 'new-jobs-notice';
+        notice.className = 'alert alert-info py-2 mb-0 rounded-0';
+        notice.innerHTML = 'New backup jobs have started. <a href="#" class="alert-link">Refresh</a> to see them.';
+        notice.querySelector('a').addEventListener('click', function(event) {
+            event.preventDefault();
+            location.reload();
+        });
+        table.closest('.card-body').prepend(notice);
     }
 }
 
-// Track last user interaction for smart auto-refresh
-let lastUserInteraction = Date.now();
-function getLastUserInteraction() {
-    return lastUserInteraction;
+function describeJobProgress(job) {
+    if (job.status !== 'running' || !job.phase) return '';
+    
+    const parts = [job.phase.charAt(0).toUpperCase() + job.phase.slice(1)];
+    if (job.bytes_received && job.phase === 'fetching') {
+        parts.push(`${formatFileSize(job.bytes_received)} received`);
+    }
+    if (job.files_archived) {
+        parts.push(`${job.files_archived} files`);
+    }
+    if (job.compressed_bytes && (job.phase === 'archiving' || job.phase === 'storing')) {
+        parts.push(`${formatFileSize(job.compressed_bytes)} written`);
+    }
+    return parts.join(' · ');
 }
 
-// Track user interactions
-['click', 'keypress', 'scroll', 'mousemove'].forEach(event => {
-    document.addEventListener(event, function() {
-        lastUserInteraction = Date.now();
-    }, { passive: true });
-});
-
 // Form validation enhancements
 function initializeFormValidation() {
     const forms = document.querySelectorAll('form[data-validate]');
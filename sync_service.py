@@ -0,0 +1,140 @@
+import logging
+from datetime import datetime
+from itertools import islice
+from sqlalchemy import insert, select, update
+from app import db
+from models import Repository
+from github_service import parse_github_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Listing entries upserted per round-trip
+SYNC_BATCH_SIZE = 500
+
+# Columns refreshed from the GitHub listing on every sync
+SYNCED_FIELDS = ('github_id', 'name', 'full_name', 'clone_url', 'size', 'default_branch', 'pushed_at')
+
+# Temporary full_name of a renamed row while renames are applied; '~' never occurs in GitHub names
+RENAME_PLACEHOLDER = '~renaming~{id}'
+
+class RepositorySyncService:
+    """Upserts the GitHub repository listing into the Repository table in bulk"""
+    
+    def __init__(self, github_service):
+        self.github_service = github_service
+    
+    def sync(self, auto_enable=True):
+        """Sync repositories from GitHub; must be called inside an app context
+        
+        Existing rows are loaded in one query and matched by GitHub id (so renames
+        update in place) or full_name. New repositories are bulk-inserted and changed
+        ones bulk-updated as listing pages stream in; renames are applied together
+        once the whole listing has been read, since full_name is unique and a rename
+        may target a name another row only gives up later (A->B, B->A). Repositories
+        that are no longer listed are then flagged as missing upstream.
+        
+        Returns a dict with added, updated, missing and total counts.
+        """
+        existing = db.session.execute(select(
+            Repository.id, Repository.missing_upstream, *[getattr(Repository, field) for field in SYNCED_FIELDS]
+        )).all()
+        by_github_id = {row.github_id: row for row in existing if row.github_id}
+        by_full_name = {row.full_name: row for row in existing}
+        
+        stats = {'added': 0, 'updated': 0, 'missing': 0, 'total': 0}
+        seen_ids = set()
+        updated_ids = set()
+        renames = {}  # row id -> new full_name
+        listing = self.github_service.iter_user_repositories()
+        
+        while True:
+            batch = list(islice(listing, SYNC_BATCH_SIZE))
+            if not batch:
+                break
+            
+            inserts = []
+            updates = []
+            for repo_data in batch:
+                fields = repository_fields(repo_data)
+                row = by_github_id.get(fields['github_id']) or by_full_name.get(fields['full_name'])
+                if row is None:
+                    inserts.append({**fields, 'enabled': auto_enable, 'created_at': datetime.utcnow()})
+                    continue
+                
+                seen_ids.add(row.id)
+                changed = {field: value for field, value in fields.items() if getattr(row, field) != value}
+                if row.missing_upstream:
+                    changed['missing_upstream'] = False
+                if changed:
+                    updated_ids.add(row.id)
+                if 'full_name' in changed:
+                    renames[row.id] = changed.pop('full_name')
+                if changed:
+                    updates.append({'id': row.id, **changed})
+            
+            if inserts:
+                db.session.execute(insert(Repository), inserts)
+            if updates:
+                db.session.execute(update(Repository), updates)
+            db.session.commit()
+            
+            stats['added'] += len(inserts)
+            stats['total'] += len(batch)
+        
+        stats['updated'] = len(updated_ids)
+        if renames:
+            self._apply_renames(renames, existing)
+        
+        missing_ids = [row.id for row in existing if row.id not in seen_ids and not row.missing_upstream]
+        if missing_ids:
+            db.session.execute(
+                update(Repository).where(Repository.id.in_(missing_ids)).values(missing_upstream=True)
+            )
+            db.session.commit()
+            stats['missing'] = len(missing_ids)
+        
+        logger.info(
+            f"Repository sync: {stats['total']} listed, {stats['added']} added, "
+            f"{stats['updated']} updated, {stats['missing']} missing upstream"
+        )
+        return stats
+    
+    def _apply_renames(self, renames, existing):
+        """Set new full_names without two rows ever holding the same one
+        
+        Renamed rows first move to placeholder names, which frees every old name before
+        any new one is taken, so swaps and chains apply in one pass. A row that is not
+        renamed but holds a target name is no longer listed under it (the listing has
+        each name once): its repository was deleted and the name reused, so it keeps
+        its backups under a name suffixed with its id.
+        """
+        targets = set(renames.values())
+        displaced = [row for row in existing if row.full_name in targets and row.id not in renames]
+        
+        db.session.execute(update(Repository), [
+            {'id': row_id, 'full_name': RENAME_PLACEHOLDER.format(id=row_id)} for row_id in renames
+        ])
+        if displaced:
+            db.session.execute(update(Repository), [
+                {'id': row.id, 'full_name': f"{row.full_name}~{row.id}"} for row in displaced
+            ])
+            for row in displaced:
+                logger.warning(f"Repository sync: {row.full_name} now names another repository; "
+                               f"the old one is kept as {row.full_name}~{row.id}")
+        db.session.execute(update(Repository), [
+            {'id': row_id, 'full_name': full_name} for row_id, full_name in renames.items()
+        ])
+        db.session.commit()
+
+
+def repository_fields(repo_data):
+    """SYNCED_FIELDS values from a GitHub repository object (listing entry or webhook payload)"""
+    return {
+        'github_id': repo_data.get('id'),
+        'name': repo_data['name'],
+        'full_name': repo_data['full_name'],
+        'clone_url': repo_data['clone_url'],
+        'size': repo_data.get('size'),
+        'default_branch': repo_data.get('default_branch'),
+        'pushed_at': parse_github_timestamp(repo_data.get('pushed_at'))
+    }
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The app module reads these on import: an in-memory database, and no scheduler, routes or queue workers
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('APP_ROLE', 'cli')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,55 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from github_service import MAX_RETRIES, GitHubService
+
+
+class SecondaryRateLimitStub(BaseHTTPRequestHandler):
+    """Answers every request with a 429 secondary rate limit and counts them"""
+    requests = 0
+    
+    def do_GET(self):
+        type(self).requests += 1
+        body = b'{"message": "You have exceeded a secondary rate limit"}'
+        self.send_response(429)
+        self.send_header('Retry-After', '0')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def rate_limited_api():
+    SecondaryRateLimitStub.requests = 0
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SecondaryRateLimitStub)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def _service(base_url, token, **kwargs):
+    service = GitHubService(token, **kwargs)
+    service.base_url = base_url
+    return service
+
+
+def test_secondary_rate_limit_is_retried_only_by_get(rate_limited_api):
+    service = _service(rate_limited_api, 'batch-token')
+    response = service._get(f"{service.base_url}/user", timeout=5)
+    assert response.status_code == 429
+    # One request per _get attempt; urllib3 must not retry the 429 on top
+    assert SecondaryRateLimitStub.requests == MAX_RETRIES + 1
+
+
+def test_interactive_call_fails_fast_on_secondary_rate_limit(rate_limited_api):
+    service = _service(rate_limited_api, 'interactive-token', interactive=True)
+    assert service.test_connection() is False
+    assert SecondaryRateLimitStub.requests == 1
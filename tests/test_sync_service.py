@@ -0,0 +1,71 @@
+import pytest
+
+from app import app, db
+from models import Repository
+from sync_service import RepositorySyncService
+
+
+class ListingStub:
+    """Stands in for GitHubService: yields a fixed repository listing"""
+    
+    def __init__(self, repositories):
+        self.repositories = repositories
+    
+    def iter_user_repositories(self):
+        yield from self.repositories
+
+
+def _listed(github_id, full_name):
+    return {
+        'id': github_id,
+        'name': full_name.split('/')[1],
+        'full_name': full_name,
+        'clone_url': f"https://github.com/{full_name}.git",
+        'size': 1,
+        'default_branch': 'main',
+        'pushed_at': '2024-01-31T12:00:00Z'
+    }
+
+
+@pytest.fixture
+def session():
+    with app.app_context():
+        Repository.query.delete()
+        db.session.commit()
+        yield db.session
+
+
+def _names(session):
+    return {row.github_id: row.full_name for row in session.query(Repository)}
+
+
+def test_sync_applies_swapped_names(session):
+    RepositorySyncService(ListingStub([_listed(1, 'me/a'), _listed(2, 'me/b')])).sync()
+    ids = {row.github_id: row.id for row in session.query(Repository)}
+    
+    stats = RepositorySyncService(ListingStub([_listed(1, 'me/b'), _listed(2, 'me/a')])).sync()
+    
+    assert _names(session) == {1: 'me/b', 2: 'me/a'}
+    assert {row.github_id: row.id for row in session.query(Repository)} == ids
+    assert stats['updated'] == 2
+    assert stats['missing'] == 0
+
+
+def test_sync_applies_rename_chain(session):
+    RepositorySyncService(ListingStub([_listed(1, 'me/a'), _listed(2, 'me/b')])).sync()
+    
+    RepositorySyncService(ListingStub([_listed(1, 'me/b'), _listed(2, 'me/c')])).sync()
+    
+    assert _names(session) == {1: 'me/b', 2: 'me/c'}
+
+
+def test_sync_moves_aside_deleted_repository_whose_name_is_reused(session):
+    RepositorySyncService(ListingStub([_listed(1, 'me/a'), _listed(2, 'me/b')])).sync()
+    
+    stats = RepositorySyncService(ListingStub([_listed(1, 'me/b')])).sync()
+    
+    row = session.query(Repository).filter_by(github_id=2).one()
+    assert row.full_name == f"me/b~{row.id}"
+    assert row.missing_upstream
+    assert _names(session)[1] == 'me/b'
+    assert stats['missing'] == 1
@@ -0,0 +1,121 @@
+import hmac
+import hashlib
+import logging
+from datetime import timedelta
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import Repository
+from sync_service import repository_fields
+from queue_service import BackupQueueService
+from metrics import Counter, registry
+
+logger = logging.getLogger(__name__)
+
+# Pushes to one repository within this long of each other are backed up once, after the last
+WEBHOOK_DEBOUNCE = timedelta(seconds=60)
+
+# Events that change a repository's refs and so call for a backup
+BACKUP_EVENTS = ('push', 'create', 'delete')
+
+# repository event actions after which the stored name, URL or visibility may be stale
+REPOSITORY_UPDATE_ACTIONS = ('renamed', 'transferred', 'edited', 'privatized', 'publicized', 'unarchived')
+
+WEBHOOK_DELIVERIES = registry.register(Counter(
+    'github_backup_webhook_deliveries_total',
+    'GitHub webhook deliveries by event and outcome',
+    labelnames=('event', 'result')
+))
+
+
+def verify_signature(secret, body, signature):
+    """Check an X-Hub-Signature-256 header (sha256=<hex HMAC of the raw body>) in constant time"""
+    if not secret or not signature or not signature.startswith('sha256='):
+        return False
+    expected = 'sha256=' + hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+class WebhookService:
+    """Applies verified GitHub webhook deliveries: registers repositories and queues debounced backups"""
+    
+    def __init__(self, config):
+        self.config = config
+    
+    def handle(self, event, payload):
+        """Apply one delivery; returns a short outcome ('queued', 'registered', 'ignored', ...)"""
+        repo_data = payload.get('repository')
+        if event == 'ping' or not repo_data:
+            result = 'pong' if event == 'ping' else 'ignored'
+        elif event == 'repository':
+            result = self._repository_event(payload.get('action'), repo_data)
+        elif event in BACKUP_EVENTS:
+            result = self._backup_event(repo_data)
+        else:
+            result = 'ignored'
+        WEBHOOK_DELIVERIES.inc(event=event, result=result)
+        return result
+    
+    def _backup_event(self, repo_data):
+        repository = self._find(repo_data)
+        if repository is None:
+            if not self.config.auto_sync_enabled:
+                return 'unknown'
+            repository = self._register(repo_data)
+        else:
+            self._refresh(repository, repo_data)
+        
+        if not repository.enabled:
+            return 'disabled'
+        request_id = BackupQueueService().enqueue([repository.id], source='webhook', delay=WEBHOOK_DEBOUNCE)
+        logger.info(f"Webhook: backup of {repository.full_name} queued as request {request_id}")
+        return 'queued'
+    
+    def _repository_event(self, action, repo_data):
+        repository = self._find(repo_data)
+        if action == 'created':
+            if repository is not None:
+                self._refresh(repository, repo_data)
+                return 'updated'
+            if not self.config.auto_sync_enabled:
+                return 'ignored'
+            self._register(repo_data)
+            return 'registered'
+        if repository is None:
+            return 'unknown'
+        if action == 'deleted':
+            # Existing backups are kept, as for repositories that drop out of the listing
+            repository.missing_upstream = True
+            db.session.commit()
+            logger.info(f"Webhook: {repository.full_name} was deleted on GitHub")
+            return 'missing'
+        if action in REPOSITORY_UPDATE_ACTIONS:
+            self._refresh(repository, repo_data)
+            return 'updated'
+        return 'ignored'
+    
+    def _find(self, repo_data):
+        """The stored repository for a payload, matched by GitHub id (stable across renames) or full_name"""
+        if repo_data.get('id'):
+            repository = Repository.query.filter_by(github_id=repo_data['id']).first()
+            if repository is not None:
+                return repository
+        return Repository.query.filter_by(full_name=repo_data.get('full_name')).first()
+    
+    def _register(self, repo_data):
+        repository = Repository(**repository_fields(repo_data), enabled=True)
+        db.session.add(repository)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # A concurrent delivery or sync added it first
+            db.session.rollback()
+            return self._find(repo_data)
+        logger.info(f"Webhook: registered new repository {repository.full_name}")
+        return repository
+    
+    def _refresh(self, repository, repo_data):
+        for field, value in repository_fields(repo_data).items():
+            if value is not None:
+                setattr(repository, field, value)
+        repository.missing_upstream = False
+        db.session.commit()
@@ -0,0 +1,57 @@
+"""Standalone backup worker
+
+Leases queued backups from the shared database and runs them. Start any number of
+these, on one or more hosts that share the database (PostgreSQL recommended) and the
+backup path, and run the web app with APP_ROLE=web so it only queues work:
+
+    python worker.py --workers 4
+"""
+import os
+import signal
+import logging
+import argparse
+import threading
+
+os.environ["APP_ROLE"] = "worker"  # Before importing app: no scheduler or in-process workers here
+
+from app import app  # noqa: E402, F401
+from queue_service import worker_pool  # noqa: E402
+import metrics  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run backup queue workers")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="number of concurrent backups (default: max_workers from the configuration)")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="serve Prometheus metrics for this worker on this port")
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+        logger.info(f"Serving metrics on port {args.metrics_port}")
+
+    stopping = threading.Event()
+
+    def request_stop(signum, frame):
+        if stopping.is_set():
+            logger.warning("Stopping immediately; unfinished items will be reclaimed when their lease expires")
+            os._exit(1)
+        logger.info("Finishing current backups before exiting (signal again to stop immediately)")
+        stopping.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    worker_pool.start(args.workers)
+    logger.info(f"Backup worker {worker_pool.worker_id} started")
+    while not stopping.wait(1):
+        pass
+    worker_pool.stop()
+    logger.info(f"Backup worker {worker_pool.worker_id} stopped")
+
+
+if __name__ == '__main__':
+    main()